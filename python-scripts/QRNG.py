@@ -1,7 +1,13 @@
 import machine
+import micropython
+from micropython import const
 import rp2
 import _thread
 import math
+from array import array
+import select
+import struct
+import sys
 import time
 import ubinascii
 import uhashlib
@@ -10,8 +16,58 @@ import uhashlib
 # CONFIGURATION
 # ----------------------------------------------------------------------------
 TARGET_FREQ = 250_000_000  # 250 MHz System Clock
-BATCH_SIZE = 1024          # Samples per batch
-LAG_DEPTH = 12             # Compare current sample vs 12 samples ago
+BATCH_SIZE = 1024          # Samples per batch (boot default, see SET batch_size)
+LAG_DEPTH = 12             # Compare current sample vs 12 samples ago (SET lag_depth)
+WINDOW_BATCHES = 1         # Batches in the H_min estimate, 1 = reset every batch (SET window)
+MAX_BATCH_SIZE = 4096      # Sample buffers are allocated at this size
+MAX_LAG_DEPTH = 64
+MAX_WINDOW_SAMPLES = 16384 # Delta history kept for the sliding window estimator
+OUTPUT_MODE = "text"       # "text" (human readable) or "binary" (framed, see protocol.py)
+N_BUFFERS = 4              # Preallocated sample buffers shared by the cores
+SUB_BLOCK = 256            # Samples per hand-over to core 1 within a batch, 0 = whole batches
+STREAM_RAW = False         # Also send each sent batch's raw samples, packed 12 bits each
+TELEMETRY_INTERVAL_MS = 1000  # Pipeline counters report period, 0 disables
+CONDITIONING = 0           # Output conditioning (SET conditioning), see CONDITIONING below
+ACQUISITION = "inline"     # "inline": extra ADC read per sample for the jitter delay
+                           # "schedule": delays drawn from the previous batch's samples
+HEALTH_ENTROPY = 4.0       # Claimed min-entropy per raw sample (bits), sets the health test cutoffs
+HEALTH_ALPHA_LOG2 = 20     # Health test false alarm probability 2^-20 per test
+APT_WINDOW = 512           # Adaptive proportion test window (SP 800-90B, non-binary samples)
+KERNEL = "viper"           # Per-sample loop: "viper" (machine code, checked at boot) or "python"
+
+# ----------------------------------------------------------------------------
+# BINARY FRAMING (keep in sync with protocol.py)
+# ----------------------------------------------------------------------------
+FRAME_SYNC = 0x5AA5
+FRAME_VERSION = 1
+FRAME_BATCH = 1
+FRAME_RAW = 2
+FRAME_TELEMETRY = 3
+FRAME_CONFIG = 4
+FRAME_HEALTH = 5
+HMIN_SCALE = 4096          # H_min sent as Q4.12 fixed point
+
+def send_frame(frame_type, seq, payload):
+    header = struct.pack("<HBBIH", FRAME_SYNC, FRAME_VERSION, frame_type, seq, len(payload))
+    crc = ubinascii.crc32(payload, ubinascii.crc32(header[2:]))
+    # stdout.buffer is the raw stream; print() would turn 0x0A into CR LF
+    out = sys.stdout.buffer
+    out.write(header)
+    out.write(payload)
+    out.write(struct.pack("<I", crc))
+    return len(header) + len(payload) + 4
+
+def pack12(batch, out, n):
+    # Two 12-bit samples -> three bytes, little-endian:
+    # [a7..a0] [b3..b0 a11..a8] [b11..b4]
+    j = 0
+    for i in range(0, n, 2):
+        a = batch[i] & 0xFFF
+        b = batch[i + 1] & 0xFFF
+        out[j] = a & 0xFF
+        out[j + 1] = (a >> 8) | ((b & 0x0F) << 4)
+        out[j + 2] = b >> 4
+        j += 3
 
 # ----------------------------------------------------------------------------
 # PIO PROGRAM
@@ -29,66 +85,589 @@ def square_wave():
 # ----------------------------------------------------------------------------
 # GLOBALS (Inter-core communication)
 # ----------------------------------------------------------------------------
-sample_queue = []
-queue_lock = _thread.allocate_lock()
+# Fixed pool of sample buffers, filled by core 0 and handed to core 1 in
+# order. buffer_owner[i] is 0 while core 0 may fill buffer i and 1 from the
+# moment it is fully sampled until core 1 has finished with it. Nothing is
+# allocated per batch, so the GC never interrupts sampling.
+#
+# Core 1 does not wait for the whole batch: core 0 publishes buffer_fill[i]
+# every SUB_BLOCK samples and core 1 runs the histogram, range, health tests
+# and first digest over each new stretch while the rest is being sampled.
+# Samples below buffer_fill[i] are never written again in that batch.
+sample_buffers = [array('H', bytes(MAX_BATCH_SIZE * 2)) for _ in range(N_BUFFERS)]
+buffer_owner = bytearray(N_BUFFERS)
+buffer_len = array('H', bytes(N_BUFFERS * 2))   # Samples in the batch, set before the first sub-block
+buffer_fill = array('H', bytes(N_BUFFERS * 2))  # Samples published so far, reset by core 1
+
+# Wake-up signals, used as binary semaphores: each side only ever releases
+# the other side's lock, and every wake-up is followed by re-checking
+# buffer_owner, so a stale release just costs one extra loop.
+batch_ready = _thread.allocate_lock()    # Released by core 0 after publishing
+buffer_freed = _thread.allocate_lock()   # Released by core 1 after consuming
+batch_ready.acquire()
+buffer_freed.acquire()
+
+def signal(lock):
+    if lock.locked():
+        lock.release()
+
+# ----------------------------------------------------------------------------
+# RUNTIME CONFIGURATION (keep field order in sync with CONFIG_FIELDS in protocol.py)
+# ----------------------------------------------------------------------------
+# Changed over the serial link with one command per line:
+#   SET batch_size 2048 | SET lag_depth 8 | SET window 8 | SET conditioning 1 | GET
+# Core 1 applies commands between batches and answers each one with the
+# current configuration. Core 0 picks up a new batch size with its next
+# buffer; a change also restarts the lag history and the estimator window.
+CFG_BATCH_SIZE = 0
+CFG_LAG_DEPTH = 1
+CFG_WINDOW = 2
+CFG_CONDITIONING = 3
+CFG_NAMES = ("batch_size", "lag_depth", "window", "conditioning")
+
+config = array('H', [BATCH_SIZE, LAG_DEPTH, WINDOW_BATCHES, CONDITIONING])
+command_chars = []
+
+def config_valid(batch_size, lag_depth, window, conditioning):
+    return (16 <= batch_size <= MAX_BATCH_SIZE and batch_size % 2 == 0
+            and 1 <= lag_depth <= MAX_LAG_DEPTH
+            and window >= 1 and (window == 1 or window * batch_size <= MAX_WINDOW_SAMPLES)
+            and conditioning in (COND_LEGACY, COND_CREDIT, COND_EXTRACT))
+
+def send_config(seq):
+    if OUTPUT_MODE == "binary":
+        send_frame(FRAME_CONFIG, seq, bytes(config))
+    else:
+        print("CFG: " + " ".join(f"{CFG_NAMES[i]}={config[i]}" for i in range(len(CFG_NAMES))))
+
+def handle_command(line):
+    """Applies one command line; returns True if the configuration changed."""
+    parts = line.split()
+    if len(parts) != 3 or parts[0].upper() != "SET" or parts[1].lower() not in CFG_NAMES:
+        return False
+    try:
+        value = int(parts[2])
+    except ValueError:
+        return False
+    new = list(config)
+    new[CFG_NAMES.index(parts[1].lower())] = value
+    if not config_valid(*new) or new == list(config):
+        return False
+    for i in range(len(new)):
+        config[i] = new[i]
+    return True
+
+def poll_commands(poller, seq):
+    """Reads whatever command bytes are waiting; returns True if the configuration changed."""
+    changed = False
+    while poller.poll(0):
+        ch = sys.stdin.read(1)
+        if not ch:
+            break
+        if ch not in "\r\n":
+            if len(command_chars) < 64:
+                command_chars.append(ch)
+            continue
+        if command_chars:
+            changed = handle_command("".join(command_chars)) or changed
+            command_chars.clear()
+            send_config(seq)
+    return changed
+
+# ----------------------------------------------------------------------------
+# CONDITIONING
+# ----------------------------------------------------------------------------
+# COND_LEGACY:  two chained SHA256 digests per batch, whatever H_min says.
+#               The second is a hash of the first, so it carries no new entropy.
+# COND_CREDIT:  batches go into a running SHA256 pool, each credited with
+#               H_min * samples bits (nothing when squelched). A 32-byte block
+#               is drawn, and the pool restarted, once BLOCK_CREDIT bits have
+#               been credited: at most one block per batch.
+# COND_EXTRACT: as COND_CREDIT, but the batch is fed to the pool in segments
+#               just large enough to carry BLOCK_CREDIT bits each, so a good
+#               batch yields one block per segment (up to MAX_BLOCKS).
+# BLOCK_CREDIT is the output size plus 64 bits, the margin SP 800-90C asks of
+# a vetted conditioning function before it counts the output as full entropy.
+COND_LEGACY = 0
+COND_CREDIT = 1
+COND_EXTRACT = 2
+BLOCK_BYTES = 32
+BLOCK_CREDIT = 8 * BLOCK_BYTES + 64
+MAX_BLOCKS = 32
+
+# ----------------------------------------------------------------------------
+# HEALTH TESTS (NIST SP 800-90B 4.4, keep in sync with HEALTH_FIELDS in protocol.py)
+# ----------------------------------------------------------------------------
+# Run on every raw 12-bit sample in core 1's processing loop, carried across
+# batches:
+# repetition count:    fails when one value repeats rct_cutoff times in a row
+# adaptive proportion: fails when the first value of a (non-overlapping)
+#                      APT_WINDOW-sample window turns up apt_cutoff times in it
+# The cutoffs follow from HEALTH_ENTROPY and are computed once at boot, so a
+# sample costs a compare and a counter per test. A batch that fails either
+# test is neither hashed nor sent: a HEALTH line / FRAME_HEALTH goes out under
+# its sequence number instead, and any conditioning credit is discarded.
+HEALTH_RCT = 1
+HEALTH_APT = 2
+
+def health_cutoffs(h, window=APT_WINDOW, alpha_log2=HEALTH_ALPHA_LOG2):
+    """(repetition count cutoff, adaptive proportion cutoff) for h bits per sample."""
+    rct = 1 + int(math.ceil(alpha_log2 / h))
+    # Smallest c with P(X >= c) <= alpha for X ~ Binomial(window, 2^-h), summing
+    # the tail from the top in log space (single precision floats on the RP2040)
+    p = 2.0 ** -h
+    log_ratio = math.log(p / (1 - p))
+    log_pmf = [window * math.log(1 - p)]
+    for k in range(window):
+        log_pmf.append(log_pmf[k] + math.log((window - k) / (k + 1)) + log_ratio)
+    alpha = 2.0 ** -alpha_log2
+    tail = 0.0
+    apt = window + 1
+    while apt > 1 and tail + math.exp(log_pmf[apt - 1]) <= alpha:
+        apt -= 1
+        tail += math.exp(log_pmf[apt])
+    return rct, apt
+
+def send_health(seq, tests, rct_run, apt_count, rct_cutoff, apt_cutoff):
+    if OUTPUT_MODE == "binary":
+        return send_frame(FRAME_HEALTH, seq, struct.pack("<HHHHH", tests, rct_run, apt_count,
+                                                         rct_cutoff, apt_cutoff))
+    line = (f"HEALTH: tests={tests} rct_run={rct_run} apt_count={apt_count} "
+            f"rct_cutoff={rct_cutoff} apt_cutoff={apt_cutoff}")
+    print(line)
+    return len(line) + 2
+
+# ----------------------------------------------------------------------------
+# TELEMETRY (keep field order in sync with TELEMETRY_FIELDS in protocol.py)
+# ----------------------------------------------------------------------------
+# Pipeline counters, reported every TELEMETRY_INTERVAL_MS. Each core only
+# writes its own slots, so neither ever loses the other's update:
+#  - core 1 zeroes its slots itself after each report;
+#  - core 0's counts are running totals (wrapping at 32 bits) that core 1
+#    reports as the difference from the last report;
+#  - core 0's maxima restart when core 0 sees tlm_reports change.
+TLM_INTERVAL_MS = 0
+TLM_ACQUIRED = 1        # Core 0: batches sampled
+TLM_ADC_US = 2          # Core 0: time in the sampling loop (incl. jitter)
+TLM_JITTER_US = 3       # Core 0: requested jitter sleep
+TLM_STALLS = 4          # Core 0: batches that waited for a free buffer
+TLM_STALL_US = 5        # Core 0: time spent waiting
+TLM_QUEUE_HWM = 6       # Core 0: most buffers owned by core 1 at publish
+TLM_PROCESSED = 7       # Core 1: batches processed
+TLM_PROCESS_US = 8      # Core 1: histogram / range loop
+TLM_HASH_US = 9         # Core 1: both SHA256 calls
+TLM_OUTPUT_US = 10      # Core 1: printing / writing frames
+TLM_BYTES_OUT = 11      # Core 1: bytes written to the serial link
+TLM_ADC_READS = 12      # Core 0: ADC conversions (2 per sample inline, 1 with a schedule)
+TLM_ADC_MAX_US = 13     # Core 0: slowest single batch acquisition
+TLM_HEALTH_FAILS = 14   # Core 1: batches suppressed by a health test
+TLM_TAIL_US = 15        # Core 1: from the last sub-block's hand-over to the digest
+TLM_COUNT = 16
+
+TLM_CORE0_TOTALS = (TLM_ACQUIRED, TLM_ADC_US, TLM_JITTER_US, TLM_STALLS, TLM_STALL_US, TLM_ADC_READS)
+TLM_CORE0_PEAKS = (TLM_QUEUE_HWM, TLM_ADC_MAX_US)
+TLM_CORE1 = (TLM_PROCESSED, TLM_PROCESS_US, TLM_HASH_US, TLM_OUTPUT_US, TLM_BYTES_OUT,
+             TLM_HEALTH_FAILS, TLM_TAIL_US)
+
+telemetry = array('I', bytes(4 * TLM_COUNT))
+tlm_reported = array('I', bytes(4 * TLM_COUNT))  # Core 1: core 0's totals at the last report
+tlm_reports = array('I', [0])                     # Core 1: reports sent, so core 0 can restart its maxima
+TLM_NAMES = ("interval_ms", "acquired", "adc_us", "jitter_us", "stalls", "stall_us",
+             "queue_hwm", "processed", "process_us", "hash_us", "output_us", "bytes_out",
+             "adc_reads", "adc_max_us", "health_fails", "tail_us")
+
+def tlm_add(slot, value):
+    """Core 0: adds to one of its running totals."""
+    telemetry[slot] = (telemetry[slot] + value) & 0xFFFFFFFF
+
+def tlm_peak(slot, value):
+    """Core 0: raises one of its maxima."""
+    if value > telemetry[slot]:
+        telemetry[slot] = value
+
+def send_telemetry(seq, interval_ms):
+    report = array('I', telemetry)
+    report[TLM_INTERVAL_MS] = interval_ms
+    for i in TLM_CORE0_TOTALS:
+        total = report[i]
+        report[i] = (total - tlm_reported[i]) & 0xFFFFFFFF
+        tlm_reported[i] = total
+    for i in TLM_CORE1:
+        telemetry[i] = 0
+    tlm_reports[0] += 1
+    if OUTPUT_MODE == "binary":
+        send_frame(FRAME_TELEMETRY, seq, bytes(report))
+    else:
+        print("TLM: " + " ".join(f"{TLM_NAMES[i]}={report[i]}" for i in range(TLM_COUNT)))
+
+# ----------------------------------------------------------------------------
+# PROCESSING KERNEL
+# ----------------------------------------------------------------------------
+# The per-sample work of core 1 (mask, min/max, health tests, lagged
+# derivative, histogram) on typed buffers, over samples start..n-1 of a
+# batch, so it can be fed one published sub-block at a time. Two copies of the same loop:
+# process_viper is compiled to machine code by the viper emitter,
+# process_python is plain bytecode and the reference. Everything carried
+# between samples and batches lives in one array('i') so the kernel can
+# stay within viper's four arguments; the lag history is its tail.
+#
+# batch:  array('H'), masked to 12 bits in place (it is hashed afterwards)
+# counts: array('H') delta histogram
+# deltas: array('H') last win_size deltas, only used when win_size > 0
+#         (sliding window; counts then holds exactly those deltas)
+K_START = const(0)         # In: first sample to process
+K_N = const(1)             # In: end of the samples to process
+K_LAG = const(2)           # In: lag depth
+K_WIN_SIZE = const(3)      # In: window samples, 0 = counts cleared per batch
+K_RCT_CUTOFF = const(4)    # In: health test cutoffs, see HEALTH TESTS
+K_APT_CUTOFF = const(5)
+K_APT_WINDOW = const(6)
+K_MIN = const(7)           # Out: per batch, reset by start_batch
+K_MAX = const(8)
+K_MAX_COUNT = const(9)     # Out: running peak of counts (per-batch mode only)
+K_HEALTH = const(10)
+K_RCT_WORST = const(11)
+K_APT_WORST = const(12)
+K_HEAD = const(13)         # Carried: lag history head
+K_RCT_VALUE = const(14)    # Carried: health test state
+K_RCT_RUN = const(15)
+K_APT_VALUE = const(16)
+K_APT_COUNT = const(17)
+K_APT_LEFT = const(18)
+K_WIN_HEAD = const(19)     # Carried: sliding window position and fill
+K_WIN_FILL = const(20)
+K_HISTORY = const(21)      # Carried: lag history, MAX_LAG_DEPTH entries
+KERNEL_STATE = K_HISTORY + MAX_LAG_DEPTH
+
+def kernel_state(rct_cutoff, apt_cutoff):
+    state = array('i', bytes(4 * KERNEL_STATE))
+    state[K_RCT_CUTOFF] = rct_cutoff
+    state[K_APT_CUTOFF] = apt_cutoff
+    state[K_APT_WINDOW] = APT_WINDOW
+    state[K_RCT_VALUE] = -1
+    state[K_APT_VALUE] = -1
+    return state
+
+def start_batch(state, n, lag_depth, win_size):
+    state[K_START] = 0
+    state[K_N] = n
+    state[K_LAG] = lag_depth
+    state[K_WIN_SIZE] = win_size
+    state[K_MIN] = 4096
+    state[K_MAX] = 0
+    state[K_MAX_COUNT] = 0
+    state[K_HEALTH] = 0
+    state[K_RCT_WORST] = 0
+    state[K_APT_WORST] = 0
+
+def reset_history(state):
+    for i in range(K_HISTORY, KERNEL_STATE):
+        state[i] = 0
+    state[K_HEAD] = 0
+    state[K_WIN_HEAD] = 0
+    state[K_WIN_FILL] = 0
+
+# Viper: no % (the ring indices wrap by compare), no augmented assignment on
+# pointers, int-only locals. Keep the two loops line for line the same.
+@micropython.viper
+def process_viper(batch: ptr16, counts: ptr16, deltas: ptr16, state: ptr32):
+    start = state[K_START]
+    n = state[K_N]
+    lag = state[K_LAG]
+    win_size = state[K_WIN_SIZE]
+    rct_cutoff = state[K_RCT_CUTOFF]
+    apt_cutoff = state[K_APT_CUTOFF]
+    min_val = state[K_MIN]
+    max_val = state[K_MAX]
+    max_count = state[K_MAX_COUNT]
+    health = state[K_HEALTH]
+    rct_worst = state[K_RCT_WORST]
+    apt_worst = state[K_APT_WORST]
+    head = state[K_HEAD]
+    rct_value = state[K_RCT_VALUE]
+    rct_run = state[K_RCT_RUN]
+    apt_value = state[K_APT_VALUE]
+    apt_count = state[K_APT_COUNT]
+    apt_left = state[K_APT_LEFT]
+    win_head = state[K_WIN_HEAD]
+    win_fill = state[K_WIN_FILL]
+    for i in range(start, n):
+        val = batch[i] & 0xFFF
+        if val < min_val: min_val = val
+        if val > max_val: max_val = val
+
+        if val == rct_value:
+            rct_run += 1
+            if rct_run > rct_worst: rct_worst = rct_run
+            if rct_run >= rct_cutoff: health |= 1      # HEALTH_RCT
+        else:
+            rct_value = val
+            rct_run = 1
+        if apt_left != 0:
+            apt_left -= 1
+            if val == apt_value:
+                apt_count += 1
+                if apt_count > apt_worst: apt_worst = apt_count
+                if apt_count >= apt_cutoff: health |= 2 # HEALTH_APT
+        else:
+            apt_value = val
+            apt_count = 1
+            apt_left = state[K_APT_WINDOW] - 1
+
+        old_val = state[K_HISTORY + head]
+        state[K_HISTORY + head] = val
+        head += 1
+        if head == lag: head = 0
+        delta = (val - old_val + 2048) & 0xFFF
+
+        if win_size != 0:
+            if win_fill == win_size:
+                counts[deltas[win_head]] = counts[deltas[win_head]] - 1
+            else:
+                win_fill += 1
+            deltas[win_head] = delta
+            win_head += 1
+            if win_head == win_size: win_head = 0
+        count = counts[delta] + 1
+        counts[delta] = count
+        if count > max_count: max_count = count
+        batch[i] = val
+    state[K_MIN] = min_val
+    state[K_MAX] = max_val
+    state[K_MAX_COUNT] = max_count
+    state[K_HEALTH] = health
+    state[K_RCT_WORST] = rct_worst
+    state[K_APT_WORST] = apt_worst
+    state[K_HEAD] = head
+    state[K_RCT_VALUE] = rct_value
+    state[K_RCT_RUN] = rct_run
+    state[K_APT_VALUE] = apt_value
+    state[K_APT_COUNT] = apt_count
+    state[K_APT_LEFT] = apt_left
+    state[K_WIN_HEAD] = win_head
+    state[K_WIN_FILL] = win_fill
+
+def process_python(batch, counts, deltas, state):
+    start = state[K_START]
+    n = state[K_N]
+    lag = state[K_LAG]
+    win_size = state[K_WIN_SIZE]
+    rct_cutoff = state[K_RCT_CUTOFF]
+    apt_cutoff = state[K_APT_CUTOFF]
+    min_val = state[K_MIN]
+    max_val = state[K_MAX]
+    max_count = state[K_MAX_COUNT]
+    health = state[K_HEALTH]
+    rct_worst = state[K_RCT_WORST]
+    apt_worst = state[K_APT_WORST]
+    head = state[K_HEAD]
+    rct_value = state[K_RCT_VALUE]
+    rct_run = state[K_RCT_RUN]
+    apt_value = state[K_APT_VALUE]
+    apt_count = state[K_APT_COUNT]
+    apt_left = state[K_APT_LEFT]
+    win_head = state[K_WIN_HEAD]
+    win_fill = state[K_WIN_FILL]
+    for i in range(start, n):
+        val = batch[i] & 0xFFF
+        if val < min_val: min_val = val
+        if val > max_val: max_val = val
+
+        # Health tests (repeats are rare, so the extra work is too)
+        if val == rct_value:
+            rct_run += 1
+            if rct_run > rct_worst: rct_worst = rct_run
+            if rct_run >= rct_cutoff: health |= HEALTH_RCT
+        else:
+            rct_value = val
+            rct_run = 1
+        if apt_left != 0:
+            apt_left -= 1
+            if val == apt_value:
+                apt_count += 1
+                if apt_count > apt_worst: apt_worst = apt_count
+                if apt_count >= apt_cutoff: health |= HEALTH_APT
+        else:
+            apt_value = val
+            apt_count = 1
+            apt_left = state[K_APT_WINDOW] - 1
+
+        # Lagged Derivative Calculation
+        old_val = state[K_HISTORY + head]
+        state[K_HISTORY + head] = val
+        head += 1
+        if head == lag: head = 0
+        delta = (val - old_val + 2048) & 0xFFF
+
+        if win_size != 0:
+            # counts holds the last win_size deltas: take the oldest back out
+            if win_fill == win_size:
+                counts[deltas[win_head]] = counts[deltas[win_head]] - 1
+            else:
+                win_fill += 1
+            deltas[win_head] = delta
+            win_head += 1
+            if win_head == win_size: win_head = 0
+        count = counts[delta] + 1
+        counts[delta] = count
+        if count > max_count: max_count = count
+        # Keep the masked sample in place; the buffer is hashed directly
+        # (array('H') is little-endian on the RP2040, 2 bytes per sample)
+        batch[i] = val
+    state[K_MIN] = min_val
+    state[K_MAX] = max_val
+    state[K_MAX_COUNT] = max_count
+    state[K_HEALTH] = health
+    state[K_RCT_WORST] = rct_worst
+    state[K_APT_WORST] = apt_worst
+    state[K_HEAD] = head
+    state[K_RCT_VALUE] = rct_value
+    state[K_RCT_RUN] = rct_run
+    state[K_APT_VALUE] = apt_value
+    state[K_APT_COUNT] = apt_count
+    state[K_APT_LEFT] = apt_left
+    state[K_WIN_HEAD] = win_head
+    state[K_WIN_FILL] = win_fill
+
+def check_kernels(batches=6, n=512):
+    """
+    Runs both kernels from the same state over the same pseudo-random
+    batches (with stuck runs, so the health tests fire) in both counting
+    modes, and compares every output. The viper copy gets each batch in
+    uneven sub-blocks, the Python one whole. True when they agree.
+    """
+    x = 0x2545F491
+    for lag, win_size in ((12, 0), (5, 3 * n // 2)):
+        runs = []
+        for kernel in (process_viper, process_python):
+            state = kernel_state(6, 6)
+            state[K_APT_WINDOW] = 16
+            counts = array('H', bytes(4096 * 2))
+            deltas = array('H', bytes(4 * n))
+            batch = array('H', bytes(2 * n))
+            seed = x
+            out = []
+            for b in range(batches):
+                for i in range(n):
+                    # xorshift32; every 64th slot starts a stuck run of 1-6
+                    # samples, so the longest just reaches both cutoffs
+                    seed ^= (seed << 13) & 0xFFFFFFFF
+                    seed ^= seed >> 17
+                    seed ^= (seed << 5) & 0xFFFFFFFF
+                    stuck = 0 < (i & 63) <= (i >> 6) % 6
+                    batch[i] = batch[i - 1] if stuck else seed & 0xFFFF
+                if not win_size:
+                    counts[:] = array('H', bytes(4096 * 2))
+                start_batch(state, n, lag, win_size)
+                step = 97 if kernel is process_viper else n
+                for end in range(step, n + step, step):
+                    state[K_N] = min(end, n)
+                    kernel(batch, counts, deltas, state)
+                    state[K_START] = state[K_N]
+                out.append((bytes(batch), bytes(state), bytes(counts), bytes(deltas)))
+            runs.append(out)
+        if runs[0] != runs[1]:
+            return False
+    return True
 
 # ----------------------------------------------------------------------------
 # CORE 1: Processing & Output
 # ----------------------------------------------------------------------------
 def core1_entry():
-    # Ring buffer history
-    history = [0] * LAG_DEPTH
-    hist_head = 0
+    seq = 0
+    read_idx = 0
+
+    # Preallocated working storage
+    # Histogram for Min-Entropy (0-4095 for 12-bit delta)
+    counts = array('H', bytes(4096 * 2))
+    zero_counts = array('H', bytes(4096 * 2))
+    raw_packed = bytearray(MAX_BATCH_SIZE * 3 // 2)
+    tlm_last = time.ticks_ms()
+
+    # Sliding window estimator: the last window * batch_size deltas, so the
+    # oldest batch can be taken out of counts as each new one goes in
+    window_deltas = array('H', bytes(MAX_WINDOW_SAMPLES * 2))
+
+    # Conditioning pool, carried across batches until it has enough credit
+    pool = uhashlib.sha256()
+    pool_credit = 0.0
+    blocks_out = bytearray(BLOCK_BYTES * MAX_BLOCKS)
+
+    # Lag history, health test and window state, see PROCESSING KERNEL
+    rct_cutoff, apt_cutoff = health_cutoffs(HEALTH_ENTROPY)
+    state = kernel_state(rct_cutoff, apt_cutoff)
+
+    # The viper build is only trusted once it matches the reference loop
+    process = process_python
+    if KERNEL == "viper":
+        if check_kernels():
+            process = process_viper
+        else:
+            print("Core 1: viper kernel disagrees with the Python loop, using the Python loop.")
+
+    commands = select.poll()
+    commands.register(sys.stdin, select.POLLIN)
     
     print("Core 1: Processing Entropy & Hashing.")
+    send_config(seq)
     
+    done = 0    # Samples of the batch in buffer read_idx already processed
     while True:
-        batch = None
-        with queue_lock:
-            if sample_queue:
-                batch = sample_queue.pop(0)
-        
-        if batch is None:
-            # No data yet, yield slightly
-            time.sleep_ms(1)
+        fill = buffer_fill[read_idx]
+        if fill == done:
+            # Nothing new published yet, block until core 0 signals
+            batch_ready.acquire()
             continue
+        batch = sample_buffers[read_idx]
+        t_start = time.ticks_us()
+        if not done:
+            # First sub-block of a batch: settings hold until it is finished
+            n = buffer_len[read_idx]
+            lag_depth = config[CFG_LAG_DEPTH]
+            window = config[CFG_WINDOW]
+            conditioning = config[CFG_CONDITIONING]
+            if window == 1:
+                counts[:] = zero_counts
+                start_batch(state, n, lag_depth, 0)
+            else:
+                # counts holds the last window_size deltas
+                start_batch(state, n, lag_depth, window * config[CFG_BATCH_SIZE])
+            h1_ctx = uhashlib.sha256()
+            process_us = 0
+            hash_us = 0
             
-        # --- Processing ---
-        # Histogram for Min-Entropy (0-4095 for 12-bit delta)
-        # Using a list as a sparse array/histogram
-        counts = [0] * 4096 
-        max_count = 0
-        
-        min_val = 4096
-        max_val = 0
-        
-        # Prepare bytes for hashing (1024 samples * 2 bytes = 2048 bytes)
-        batch_bytes = bytearray(BATCH_SIZE * 2)
-        
-        for i in range(BATCH_SIZE):
-            val = batch[i] & 0xFFF
-            
-            # Update Min/Max
-            if val < min_val: min_val = val
-            if val > max_val: max_val = val
-            
-            # Lagged Derivative Calculation
-            old_val = history[hist_head]
-            history[hist_head] = val
-            hist_head = (hist_head + 1) % LAG_DEPTH
-            
-            delta = (val - old_val + 2048) & 0xFFF
-            
-            counts[delta] += 1
-            if counts[delta] > max_count:
-                max_count = counts[delta]
-            
-            # Store raw sample in bytearray (Little Endian)
-            batch_bytes[2*i] = val & 0xFF
-            batch_bytes[2*i+1] = (val >> 8) & 0xFF
+        # --- Processing, as far as core 0 has got ---
+        state[K_START] = done
+        state[K_N] = fill
+        process(batch, counts, window_deltas, state)
+        t_processed = time.ticks_us()
+        process_us += time.ticks_diff(t_processed, t_start)
+        if conditioning == COND_LEGACY:
+            # The first digest absorbs the masked samples as they come in;
+            # a batch that fails a health test just drops the context
+            h1_ctx.update(memoryview(batch)[done:fill])
+            hash_us += time.ticks_diff(time.ticks_us(), t_processed)
+        done = fill
+        if done < n:
+            continue
+        done = 0
+        t_final = time.ticks_us()
 
-        # Calculate Min-Entropy
-        min_entropy = 10.0 - math.log2(max_count) if max_count > 0 else 0.0
+        if window == 1:
+            max_count = state[K_MAX_COUNT]
+            estimate_samples = n
+        else:
+            # Counts also go down here, so take the peak afterwards
+            max_count = max(counts)
+            estimate_samples = state[K_WIN_FILL]
+        min_val = state[K_MIN]
+        max_val = state[K_MAX]
+        health = state[K_HEALTH]
+        rct_worst = state[K_RCT_WORST]
+        apt_worst = state[K_APT_WORST]
+
+        # Calculate Min-Entropy, normalised to the number of samples in the estimate
+        min_entropy = math.log2(estimate_samples) - math.log2(max_count) if max_count > 0 else 0.0
         
         # Calculate Range
         dynamic_range = max_val - min_val
@@ -97,19 +676,102 @@ def core1_entry():
         if dynamic_range < 200:
             min_entropy = 0.0
             
+        t_processed = time.ticks_us()
+        process_us += time.ticks_diff(t_processed, t_final)
+
         # Hashing (Using SHA256 as SHA512 isn't available in standard MicroPython)
-        h1_ctx = uhashlib.sha256()
-        h1_ctx.update(batch_bytes)
-        hash_out_1 = h1_ctx.digest()
-        
-        h2_ctx = uhashlib.sha256()
-        h2_ctx.update(hash_out_1)
-        hash_out_2 = h2_ctx.digest()
+        if health:
+            # Suppressed: nothing from this batch may reach the output
+            pool = uhashlib.sha256()
+            pool_credit = 0.0
+        elif conditioning == COND_LEGACY:
+            hash_out_1 = h1_ctx.digest()
+            
+            h2_ctx = uhashlib.sha256()
+            h2_ctx.update(hash_out_1)
+            hash_out_2 = h2_ctx.digest()
+        else:
+            # Credit-accounted output, see CONDITIONING
+            if conditioning == COND_EXTRACT and min_entropy > 0:
+                segment = int(math.ceil(BLOCK_CREDIT / min_entropy))
+            else:
+                segment = n
+            samples = memoryview(batch)
+            blocks = 0
+            for start in range(0, n, segment):
+                end = min(n, start + segment)
+                pool.update(samples[start:end])
+                pool_credit += (end - start) * min_entropy
+                if pool_credit >= BLOCK_CREDIT and blocks < MAX_BLOCKS:
+                    blocks_out[blocks * BLOCK_BYTES:(blocks + 1) * BLOCK_BYTES] = pool.digest()
+                    pool = uhashlib.sha256()
+                    pool_credit = 0.0
+                    blocks += 1
+            output = memoryview(blocks_out)[:blocks * BLOCK_BYTES]
+        t_hashed = time.ticks_us()
         
         # Output
-        print(f"H_min: {min_entropy:.4f} | R: {dynamic_range:4d} | Data: ")
-        print(ubinascii.hexlify(hash_out_1).decode())
-        print(ubinascii.hexlify(hash_out_2).decode())
+        if health:
+            sent = send_health(seq, health, rct_worst, apt_worst, rct_cutoff, apt_cutoff)
+            telemetry[TLM_HEALTH_FAILS] += 1
+        elif conditioning != COND_LEGACY:
+            if OUTPUT_MODE == "binary":
+                sent = send_frame(FRAME_BATCH, seq,
+                                  struct.pack("<HH", int(min_entropy * HMIN_SCALE + 0.5), dynamic_range)
+                                  + bytes(output))
+            else:
+                # Single line; "-" when the pool is still short of credit
+                line = (f"H_min: {min_entropy:.4f} | R: {dynamic_range:4d} | Data: "
+                        + (ubinascii.hexlify(output).decode() if blocks else "-"))
+                print(line)
+                sent = len(line) + 2
+        elif OUTPUT_MODE == "binary":
+            sent = send_frame(FRAME_BATCH, seq,
+                              struct.pack("<HH", int(min_entropy * HMIN_SCALE + 0.5), dynamic_range)
+                              + hash_out_1 + hash_out_2)
+        else:
+            header = f"H_min: {min_entropy:.4f} | R: {dynamic_range:4d} | Data: "
+            print(header)
+            print(ubinascii.hexlify(hash_out_1).decode())
+            print(ubinascii.hexlify(hash_out_2).decode())
+            sent = len(header) + 4 * len(hash_out_1) + 6   # CR LF per line
+
+        if STREAM_RAW and not health:
+            pack12(batch, raw_packed, n)
+            raw = memoryview(raw_packed)[:n * 3 // 2]
+            if OUTPUT_MODE == "binary":
+                sent += send_frame(FRAME_RAW, seq, raw)
+            else:
+                print("RAW: " + ubinascii.hexlify(raw).decode())
+                sent += 7 + 2 * len(raw)
+        t_output = time.ticks_us()
+
+        telemetry[TLM_PROCESSED] += 1
+        telemetry[TLM_PROCESS_US] += process_us
+        telemetry[TLM_HASH_US] += hash_us + time.ticks_diff(t_hashed, t_processed)
+        telemetry[TLM_OUTPUT_US] += time.ticks_diff(t_output, t_hashed)
+        telemetry[TLM_TAIL_US] += time.ticks_diff(t_hashed, t_start)
+        telemetry[TLM_BYTES_OUT] += sent
+
+        if TELEMETRY_INTERVAL_MS:
+            elapsed = time.ticks_diff(time.ticks_ms(), tlm_last)
+            if elapsed >= TELEMETRY_INTERVAL_MS:
+                send_telemetry(seq, elapsed)
+                tlm_last = time.ticks_ms()
+        seq = (seq + 1) & 0xFFFFFFFF
+
+        # Hand the buffer back to core 0
+        buffer_fill[read_idx] = 0
+        buffer_owner[read_idx] = 0
+        signal(buffer_freed)
+        read_idx = (read_idx + 1) % N_BUFFERS
+
+        if poll_commands(commands, seq):
+            # New settings: start the lag history and the estimate afresh
+            reset_history(state)
+            counts[:] = zero_counts
+            pool = uhashlib.sha256()
+            pool_credit = 0.0
 
 # ----------------------------------------------------------------------------
 # CORE 0: Hardware Setup & Acquisition
@@ -132,25 +794,78 @@ def main():
     
     # 4. Setup ADC on Pin 26 (ADC 0)
     adc = machine.ADC(0)
+
+    # Jitter schedule for ACQUISITION = "schedule": slot i holds the delay
+    # after sample i, refilled from the low bits of the sample taken there
+    jitter_schedule = bytearray(MAX_BATCH_SIZE)
+    for i in range(MAX_BATCH_SIZE):
+        jitter_schedule[i] = 1 + ((adc.read_u16() >> 4) & 0x03)
     
     print(f"Core 0: Generating {machine.freq()/1000000} MHz Wave & Sampling ADC.")
     
     # 5. Main Loop
+    write_idx = 0
+    reports_seen = tlm_reports[0]
     while True:
-        current_batch = []
-        for _ in range(BATCH_SIZE):
-            # Read ADC (MicroPython returns 16-bit 0-65535)
-            val = adc.read_u16()
-            current_batch.append(val)
-            
-            # Jitter: busy_wait_us_32(1 + (adc_read() & 0x03))
-            jitter_read = adc.read_u16()
-            time.sleep_us(1 + (jitter_read & 0x03))
-            
-        with queue_lock:
-            # Simple flow control to prevent OOM if Core 1 is slow
-            if len(sample_queue) < 4:
-                sample_queue.append(current_batch)
+        # Wait for core 1 to release the next buffer (mirrors queue_add_blocking in main.c)
+        if buffer_owner[write_idx]:
+            t_wait = time.ticks_us()
+            while buffer_owner[write_idx]:
+                buffer_freed.acquire()
+            tlm_add(TLM_STALLS, 1)
+            tlm_add(TLM_STALL_US, time.ticks_diff(time.ticks_us(), t_wait))
+
+        current_batch = sample_buffers[write_idx]
+        n = config[CFG_BATCH_SIZE]
+        buffer_len[write_idx] = n
+        step = SUB_BLOCK or n
+        jitter_us = 0
+        t_start = time.ticks_us()
+        for start in range(0, n, step):
+            end = min(n, start + step)
+            if ACQUISITION == "schedule":
+                # Every conversion is a sample; the delay comes from the schedule
+                for i in range(start, end):
+                    val = adc.read_u16()
+                    current_batch[i] = val
+                    jitter = jitter_schedule[i]
+                    time.sleep_us(jitter)
+                    jitter_us += jitter
+                    # Next batch's delay for this slot (bits 0-1 of the 12-bit code;
+                    # read_u16's own low bits repeat the top of the code)
+                    jitter_schedule[i] = 1 + ((val >> 4) & 0x03)
+            else:
+                for i in range(start, end):
+                    # Read ADC (MicroPython returns 16-bit 0-65535)
+                    current_batch[i] = adc.read_u16()
+                    
+                    # Jitter: busy_wait_us_32(1 + (adc_read() & 0x03))
+                    jitter = 1 + (adc.read_u16() & 0x03)
+                    time.sleep_us(jitter)
+                    jitter_us += jitter
+            if end < n:
+                # Hand this stretch to core 1 while the rest is sampled
+                buffer_fill[write_idx] = end
+                signal(batch_ready)
+        reads = n if ACQUISITION == "schedule" else 2 * n
+        acq_us = time.ticks_diff(time.ticks_us(), t_start)
+        if tlm_reports[0] != reports_seen:
+            # Core 1 has reported the last interval's maxima
+            reports_seen = tlm_reports[0]
+            for i in TLM_CORE0_PEAKS:
+                telemetry[i] = 0
+        tlm_add(TLM_ADC_US, acq_us)
+        tlm_peak(TLM_ADC_MAX_US, acq_us)
+        tlm_add(TLM_JITTER_US, jitter_us)
+        tlm_add(TLM_ADC_READS, reads)
+        tlm_add(TLM_ACQUIRED, 1)
+
+        # Publish to core 1 (owner first: core 1 hands the buffer back as soon as it sees it full)
+        buffer_owner[write_idx] = 1
+        buffer_fill[write_idx] = n
+        signal(batch_ready)
+        tlm_peak(TLM_QUEUE_HWM, sum(buffer_owner))
+        write_idx = (write_idx + 1) % N_BUFFERS
 
 if __name__ == "__main__":
     main()
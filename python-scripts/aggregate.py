@@ -0,0 +1,221 @@
+"""
+Reads several FiberRanger boards at once and mixes their output into one pool.
+
+Each device gets its own reader thread. Every batch is checked against the
+same squelch rule as core1_entry (range below 200 means the input is
+floating or disconnected); a device that squelches is excluded until it has
+produced HEALTHY_STREAK good batches in a row, and a device that goes quiet
+for STALE_SECONDS is excluded too.
+
+Healthy digests are folded into a SHA-256 mixing state. Each one is credited
+in proportion to its H_min (relative to the most its device can report,
+log2 of the samples behind the estimate: batch size times window),
+and a 32-byte output block is drawn from the state for every 32 bytes of
+credit, so degraded boards contribute less and bad boards nothing. Output goes
+into the same ring buffer / Unix socket service as harvestd.py.
+
+Usage:
+    python aggregate.py --device /dev/ttyACM0 --device /dev/ttyACM1 --protocol binary
+    python aggregate.py --device mock --device mock --device mock:squelched
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+import protocol
+from harvestd import DEFAULT_POOL_SIZE, DEFAULT_SOCKET, PoolServer, RingBuffer
+
+SQUELCH_RANGE = 200        # Same threshold as core1_entry
+HEALTHY_STREAK = 8         # Good batches needed before a device is (re)admitted
+STALE_SECONDS = 5.0
+H_MAX = math.log2(1024)    # Min-entropy of a perfect 1024-sample batch, until a device reports its config
+BLOCK_SIZE = 32            # SHA-256 output block
+
+
+def h_max(config):
+    """Largest H_min a device with these settings reports (the window counts batches)."""
+    if config is None:
+        return H_MAX
+    return math.log2(config.batch_size * max(1, config.window))
+
+
+class Mixer:
+    """Health-weighted SHA-256 mixing pool shared by all device readers."""
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.state = hashlib.sha256(b"FiberRanger aggregate").digest()
+        self.credit = 0.0
+        self.blocks = 0
+
+    def add(self, device_id, record, conditioned=False, ceiling=H_MAX):
+        # Device-conditioned blocks are already full entropy; legacy digests
+        # are weighted by their batch's H_min against the device's ceiling
+        weight = 1.0 if conditioned else min(1.0, record.h_min / ceiling)
+        with self.lock:
+            self.state = hashlib.sha256(self.state + device_id.encode() +
+                                        record.seq.to_bytes(4, "little") + record.digest).digest()
+            # Legacy digests are digest || hash(digest): only the first half is new
+            self.credit += weight * (len(record.digest) if conditioned else len(record.digest) // 2)
+            out = bytearray()
+            while self.credit >= BLOCK_SIZE:
+                self.credit -= BLOCK_SIZE
+                self.blocks += 1
+                out += hashlib.sha256(b"out" + self.blocks.to_bytes(8, "little") + self.state).digest()
+        if out:
+            self.pool.write(bytes(out))
+
+
+class DeviceReader(threading.Thread):
+    """Reads one device, tracks its health and feeds healthy batches to the mixer."""
+    def __init__(self, device_id, make_records, mixer, retry_seconds=2.0):
+        super().__init__(daemon=True, name=f"reader-{device_id}")
+        self.device_id = device_id
+        self.make_records = make_records
+        self.mixer = mixer
+        self.retry_seconds = retry_seconds
+
+        self.batches = 0
+        self.mixed = 0
+        self.excluded = 0
+        self.health_events = 0
+        self.streak = 0
+        self.last_h_min = None
+        self.last_range = None
+        self.last_seen = None
+        self.error = None
+        self.conditioned = False
+        self.h_max = H_MAX
+
+    @property
+    def healthy(self):
+        fresh = self.last_seen is not None and time.monotonic() - self.last_seen < STALE_SECONDS
+        return fresh and self.streak >= HEALTHY_STREAK
+
+    def run(self):
+        while True:
+            try:
+                for record in self.make_records():
+                    if isinstance(record, protocol.BatchRecord):
+                        self.handle(record)
+                    elif isinstance(record, protocol.ConfigRecord):
+                        self.conditioned = record.conditioning != protocol.COND_LEGACY
+                        self.h_max = h_max(record)
+                    elif isinstance(record, protocol.HealthRecord):
+                        # A health test failure on the device restarts the streak
+                        self.health_events += 1
+                        self.streak = 0
+                self.error = "source ended"
+                return
+            except (ImportError, OSError) as e:
+                self.error = str(e)
+                self.streak = 0
+                time.sleep(self.retry_seconds)
+
+    def handle(self, record):
+        self.batches += 1
+        self.last_h_min = record.h_min
+        self.last_range = record.range
+        self.last_seen = time.monotonic()
+        self.error = None
+
+        if record.range < SQUELCH_RANGE or record.h_min <= 0.0:
+            self.streak = 0
+        else:
+            self.streak += 1
+
+        if self.healthy:
+            self.mixer.add(self.device_id, record, self.conditioned, self.h_max)
+            self.mixed += 1
+        else:
+            self.excluded += 1
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "batches": self.batches,
+            "mixed": self.mixed,
+            "excluded": self.excluded,
+            "health_events": self.health_events,
+            "h_min": self.last_h_min,
+            "range": self.last_range,
+            "error": self.error,
+            "conditioned": self.conditioned,
+            "h_max": round(self.h_max, 4),
+        }
+
+
+class Aggregator:
+    def __init__(self, pool, readers, mixer):
+        self.pool = pool
+        self.readers = readers
+        self.mixer = mixer
+        self.started = time.monotonic()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        stats = self.pool.stats()
+        stats.update({
+            "uptime_s": round(elapsed, 1),
+            "in_rate_Bps": round(stats["bytes_in"] / elapsed, 1) if elapsed else 0.0,
+            "healthy_devices": sum(r.healthy for r in self.readers),
+            "devices": {r.device_id: r.stats() for r in self.readers},
+        })
+        return stats
+
+
+def make_source(spec, args):
+    """Device spec: a serial port, 'mock', 'mock:squelched' or 'capture:FILE'."""
+    if spec == "mock":
+        return lambda: protocol.mock_records(rate=args.rate)
+    if spec == "mock:squelched":
+        return lambda: (r._replace(range=r.range % SQUELCH_RANGE, h_min=0.0)
+                        for r in protocol.mock_records(rate=args.rate))
+    if spec.startswith("capture:"):
+        import capture
+        return lambda: capture.replay_capture(spec.split(":", 1)[1], speed=1.0)
+    return lambda: protocol.serial_records(spec, args.baud, args.protocol)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate several QRNG boards into one entropy pool")
+    parser.add_argument("--device", action="append", required=True,
+                        help="serial port, mock, mock:squelched or capture:FILE (repeatable)")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text")
+    parser.add_argument("--rate", type=float, default=10, help="batches/s for mock devices")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    pool = RingBuffer(args.pool_size)
+    mixer = Mixer(pool)
+    readers = [DeviceReader(f"{i}:{spec}", make_source(spec, args), mixer)
+               for i, spec in enumerate(args.device)]
+    for reader in readers:
+        reader.start()
+    aggregator = Aggregator(pool, readers, mixer)
+
+    server = PoolServer(args.socket, pool, aggregator)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Aggregating {len(readers)} devices on {args.socket}")
+
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print(json.dumps(aggregator.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+asyncio entropy service: many concurrent callers, one connection per device.
+
+Each device is opened once and kept open. A pump task reads its records,
+applies the same rules as harvestd.py (squelched batches are dropped, legacy
+digests only count their first half) and prefetches the bytes into a
+preallocated ring buffer, so a request that fits in what is already buffered
+returns without touching the link. Callers that have to wait are served in
+arrival order.
+
+    import asyncio, aioentropy
+
+    async def main():
+        device = await aioentropy.connect("/dev/ttyACM0", mode="binary")
+        key = await device.get_bytes(32)
+        async for chunk in device.stream(4096):
+            ...
+
+connect() returns the same EntropyDevice for the same spec, so every task in
+the process shares one serial connection. The transport is pluggable:
+
+    /dev/ttyACM0      SerialTransport (pyserial, read from the event loop)
+    mock              MockTransport   (synthetic batches, --rate per second)
+    replay:FILE       ReplayTransport (serial byte dump, looped)
+    capture:FILE      ReplayTransport (.qcap from capture.py, looped)
+
+Run directly for a latency check with many concurrent clients:
+
+    python aioentropy.py --device mock --clients 200 --requests 500 --size 32
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import protocol
+from harvestd import RingBuffer, pool_bytes
+
+DEFAULT_BUFFER = 1 << 16      # Prefetched bytes per device
+READ_CHUNK = 4096             # Largest serial read per wakeup
+
+
+# ----------------------------------------------------------------------------
+# TRANSPORTS
+# ----------------------------------------------------------------------------
+class Transport:
+    """A record source. records() is an async iterator; send() writes a command line."""
+    async def open(self):
+        pass
+
+    def records(self):
+        raise NotImplementedError
+
+    async def send(self, command):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SerialTransport(Transport):
+    """
+    pyserial port read from the event loop: the file descriptor is watched
+    with add_reader, so no thread is parked in a blocking read. Falls back
+    to reads in the default executor where the loop can't watch the port
+    (Windows).
+    """
+    def __init__(self, port, baud=115200, mode="text"):
+        self.port = port
+        self.baud = baud
+        self.mode = mode
+        self.ser = None
+        self.readable = None
+
+    async def open(self):
+        import serial
+        self.ser = serial.Serial(self.port, self.baud, timeout=0)
+        self.readable = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_reader(self.ser.fileno(), self.readable.set)
+        except (NotImplementedError, AttributeError, ValueError):
+            self.readable = None
+            self.ser.timeout = 0.1
+
+    async def _read(self):
+        if self.readable is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, lambda: self.ser.read(self.ser.in_waiting or 1))
+        while True:
+            self.readable.clear()
+            data = self.ser.read(min(self.ser.in_waiting, READ_CHUNK) or 1)
+            if data:
+                return data
+            await self.readable.wait()
+
+    async def records(self):
+        parser = protocol.make_parser(self.mode)
+        while True:
+            for record in parser.feed(await self._read()):
+                yield record
+
+    async def send(self, command):
+        self.ser.write(command)
+
+    async def close(self):
+        if self.ser is None:
+            return
+        if self.readable is not None:
+            asyncio.get_running_loop().remove_reader(self.ser.fileno())
+        self.ser.close()
+        self.ser = None
+
+
+class MockTransport(Transport):
+    """Synthetic batches at rate per second (0 = as fast as the loop allows)."""
+    def __init__(self, rate=10, digest_size=32, seed=None):
+        self.rate = rate
+        self.digest_size = digest_size
+        self.seed = seed
+
+    async def records(self):
+        seq = 0
+        seed = self.seed
+        while True:
+            for h_min, dynamic_range, d1, d2 in protocol.synthetic_records(1000, self.digest_size, seed):
+                yield protocol.BatchRecord(seq, h_min, dynamic_range, d1 + d2)
+                seq += 1
+                # Sleeping 0 still yields, so a fast mock doesn't starve the callers
+                await asyncio.sleep(1.0 / self.rate if self.rate else 0)
+            seed = None if seed is None else seed + 1
+
+
+class ReplayTransport(Transport):
+    """Replays a serial byte dump, or a .qcap capture, in a loop."""
+    def __init__(self, path, mode="text", rate=0, loop=True):
+        self.path = path
+        self.mode = mode
+        self.rate = rate
+        self.loop = loop
+
+    def _file_records(self):
+        if self.path.endswith(".qcap"):
+            import capture
+            reader = capture.CaptureReader(self.path)
+            try:
+                for i in range(len(reader)):
+                    yield reader.batch(i)
+            finally:
+                reader.close()
+            return
+        parser = protocol.make_parser(self.mode)
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+                yield from parser.feed(chunk)
+
+    async def records(self):
+        while True:
+            for record in self._file_records():
+                yield record
+                await asyncio.sleep(1.0 / self.rate if self.rate else 0)
+            if not self.loop:
+                return
+
+
+def make_transport(spec, mode="text", baud=115200, rate=10):
+    """Device spec: a serial port, 'mock', 'replay:FILE' or 'capture:FILE'."""
+    if spec == "mock":
+        return MockTransport(rate=rate)
+    if spec.startswith("replay:"):
+        return ReplayTransport(spec.split(":", 1)[1], mode, rate=rate)
+    if spec.startswith("capture:"):
+        return ReplayTransport(spec.split(":", 1)[1], rate=rate)
+    return SerialTransport(spec, baud, mode)
+
+
+# ----------------------------------------------------------------------------
+# SHARED DEVICE
+# ----------------------------------------------------------------------------
+class EntropyDevice:
+    """One open transport, its prefetch pump and the callers sharing it."""
+    def __init__(self, transport, buffer_size=DEFAULT_BUFFER, commands=()):
+        self.transport = transport
+        self.commands = commands
+        self.pool = RingBuffer(buffer_size)
+        self.ready = asyncio.Condition()     # Notified when the pump adds bytes or stops
+        self.queue = asyncio.Lock()          # Waiting callers take turns, in arrival order
+        self.task = None
+        self.closed = False
+        self.error = None
+
+        self.batches = 0
+        self.squelched = 0
+        self.health_events = 0
+        self.requests = 0
+        self.waits = 0
+        self.config = None
+        self.telemetry = None
+        self.started = time.monotonic()
+
+    async def start(self):
+        await self.transport.open()
+        for command in self.commands:
+            await self.transport.send(command)
+        self.task = asyncio.create_task(self._pump())
+        return self
+
+    async def _pump(self):
+        try:
+            async for record in self.transport.records():
+                if isinstance(record, protocol.TelemetryRecord):
+                    self.telemetry = record
+                elif isinstance(record, protocol.ConfigRecord):
+                    self.config = record
+                elif isinstance(record, protocol.HealthRecord):
+                    self.health_events += 1
+                elif isinstance(record, protocol.BatchRecord):
+                    self.batches += 1
+                    data = pool_bytes(record, self.config)
+                    if data is None:
+                        self.squelched += 1
+                        continue
+                    # Never blocks: a full buffer drops the bytes and counts them
+                    self.pool.write(data)
+                    if self.queue.locked():
+                        async with self.ready:
+                            self.ready.notify_all()
+            self.error = "source ended"
+        except OSError as e:
+            self.error = str(e)
+        finally:
+            self.closed = True
+            # Release the port (and its loop reader) now, not when someone calls close()
+            await self.transport.close()
+            async with self.ready:
+                self.ready.notify_all()
+
+    async def get_bytes(self, n):
+        """Returns exactly n bytes; raises EOFError if the device goes away first."""
+        self.requests += 1
+        # Fast path: nobody queued ahead and the bytes are already here
+        if n <= self.pool.size and not self.queue.locked():
+            return self.pool.read(n)
+
+        out = bytearray()
+        async with self.queue:
+            while len(out) < n:
+                take = min(n - len(out), self.pool.size)
+                if take:
+                    out += self.pool.read(take)
+                    continue
+                if self.closed:
+                    raise EOFError(self.error or "device closed")
+                self.waits += 1
+                async with self.ready:
+                    await self.ready.wait()
+        return bytes(out)
+
+    async def stream(self, chunk_size):
+        """Yields chunk_size-byte chunks until the device goes away."""
+        while True:
+            try:
+                chunk = await self.get_bytes(chunk_size)
+            except EOFError:
+                return
+            yield chunk
+
+    async def send(self, name, value=None):
+        """Sends a runtime setting (protocol.config_command) to the device."""
+        await self.transport.send(protocol.config_command(name, value))
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.transport.close()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        stats = self.pool.stats()
+        stats.update({
+            "batches": self.batches,
+            "squelched": self.squelched,
+            "health_events": self.health_events,
+            "requests": self.requests,
+            "request_waits": self.waits,
+            "uptime_s": round(elapsed, 1),
+            "in_rate_Bps": round(stats["bytes_in"] / elapsed, 1) if elapsed else 0.0,
+            "error": self.error,
+        })
+        if self.telemetry is not None:
+            stats["device"] = self.telemetry._asdict()
+        if self.config is not None:
+            stats["config"] = self.config._asdict()
+        return stats
+
+
+# ----------------------------------------------------------------------------
+# CONNECTION REGISTRY
+# ----------------------------------------------------------------------------
+devices = {}
+connecting = {}
+
+
+async def connect(spec, mode="text", baud=115200, rate=10, buffer_size=DEFAULT_BUFFER, settings=()):
+    """
+    Returns the shared EntropyDevice for spec, opening it on first use.
+    settings are (name, value) pairs sent to the device when it is opened.
+    Concurrent first calls wait for the same open instead of racing.
+    """
+    device = devices.get(spec)
+    if device is not None and not device.closed:
+        return device
+    if device is not None:
+        # The old device went away: close it before a new one takes its place
+        await device.close()
+        if devices.get(spec) is device:
+            del devices[spec]
+    if spec not in connecting:
+        commands = [protocol.config_command(name, value) for name, value in settings]
+        device = EntropyDevice(make_transport(spec, mode, baud, rate), buffer_size, commands)
+        connecting[spec] = asyncio.ensure_future(device.start())
+    try:
+        devices[spec] = await asyncio.shield(connecting[spec])
+    finally:
+        connecting.pop(spec, None)
+    return devices[spec]
+
+
+async def get_bytes(n, spec="mock", **options):
+    device = await connect(spec, **options)
+    return await device.get_bytes(n)
+
+
+async def close_all():
+    for device in list(devices.values()):
+        await device.close()
+    devices.clear()
+
+
+# ----------------------------------------------------------------------------
+# LATENCY CHECK
+# ----------------------------------------------------------------------------
+async def client(device, requests, size, interval, latencies):
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        await device.get_bytes(size)
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(interval)
+
+
+async def run_clients(args):
+    settings = [setting.split("=", 1) for setting in args.set]
+    device = await connect(args.device, args.protocol, args.baud, args.rate, args.buffer, settings)
+    # Let the prefetch buffer fill before timing
+    deadline = time.monotonic() + args.warmup
+    while device.pool.size < device.pool.capacity and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+    latencies = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(device, args.requests, args.size, args.interval / 1000, latencies) for _ in range(args.clients)))
+    elapsed = time.perf_counter() - t0
+    stats = device.stats()
+    await close_all()
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e3
+
+    print(f"{len(latencies)} requests of {args.size} B from {args.clients} clients in {elapsed:.2f} s "
+          f"({len(latencies) / elapsed:.0f} req/s)")
+    print(f"latency ms: p50 {percentile(0.50):.3f}  p99 {percentile(0.99):.3f}  max {latencies[-1] * 1e3:.3f}")
+    print(json.dumps(stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="asyncio entropy service latency check")
+    parser.add_argument("--device", default="mock", help="serial port, mock, replay:FILE or capture:FILE")
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--rate", type=float, default=0,
+                        help="batches/s for mock and replay devices (0 = as fast as possible)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="device setting sent on connect (repeatable)")
+    parser.add_argument("--buffer", type=int, default=DEFAULT_BUFFER, help="prefetch buffer in bytes")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    parser.add_argument("--size", type=int, default=32, help="bytes per request")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="ms each client sleeps between requests (0 = back to back, measures supply)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="max seconds to prefill the buffer")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_clients(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
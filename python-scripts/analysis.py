@@ -0,0 +1,237 @@
+"""
+Vectorized re-implementation of the core1_entry health statistics.
+
+For every batch of raw ADC samples the firmware computes:
+
+* the dynamic range (max - min of the 12-bit samples)
+* a histogram of the lagged derivative (val - val[LAG_DEPTH samples ago] + 2048) & 0xFFF,
+  with the lag history carried over from the previous batch
+* min-entropy = log2(BATCH_SIZE) - log2(max histogram count), forced to 0
+  when the range is below the squelch threshold
+
+With a sliding window (`SET window N` on the device) the histogram covers
+the last N batches instead, and the normalisation is log2 of the number of
+samples in it (fewer than N * BATCH_SIZE until the window has filled).
+
+BatchAnalyzer does the same over many batches at once with NumPy and keeps
+the lag history between calls, so a capture can be fed in any chunking and
+gives the same answer as the device. reference_stats() is a line-by-line
+port of the firmware loop used to check that.
+
+Usage:
+    python analysis.py capture.u16          # raw little-endian uint16 samples
+    python analysis.py --packed capture.p12 # packed 12-bit capture from rawcapture.py
+    python analysis.py --verify             # compare against the reference loop
+"""
+import argparse
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+BATCH_SIZE = 1024
+LAG_DEPTH = 12
+SQUELCH_RANGE = 200
+SAMPLE_MASK = 0xFFF
+
+BatchStats = namedtuple("BatchStats", "min_entropy range min max max_count squelched")
+
+
+class BatchAnalyzer:
+    """
+    Stateful batch statistics engine. Feed it (n_batches, batch_size) arrays
+    (or a flat sample array that is a whole number of batches) in stream order.
+    """
+    def __init__(self, batch_size=BATCH_SIZE, lag_depth=LAG_DEPTH,
+                 squelch_range=SQUELCH_RANGE, chunk_batches=1024, window=1):
+        self.batch_size = batch_size
+        self.lag_depth = lag_depth
+        self.squelch_range = squelch_range
+        self.chunk_batches = chunk_batches
+        self.window = window
+        # Last lag_depth samples in stream order, zero on boot like the firmware
+        self.history = np.zeros(lag_depth, dtype=np.int32)
+        # Histograms of the previous window - 1 batches
+        self.recent = np.zeros((0, SAMPLE_MASK + 1), dtype=np.int32)
+        self.batches = 0
+
+    def process(self, samples):
+        samples = np.asarray(samples)
+        samples = samples.reshape(-1, self.batch_size)
+        parts = [self._process_chunk(samples[i:i + self.chunk_batches])
+                 for i in range(0, len(samples), self.chunk_batches)]
+        if not parts:
+            return BatchStats(*(np.empty(0) for _ in BatchStats._fields))
+        return BatchStats(*(np.concatenate(field) for field in zip(*parts)))
+
+    def _process_chunk(self, chunk):
+        n = len(chunk)
+        vals = chunk.astype(np.int32) & SAMPLE_MASK
+
+        # Range
+        lo = vals.min(axis=1)
+        hi = vals.max(axis=1)
+        dynamic_range = hi - lo
+
+        # Lagged derivative over the continuous stream
+        stream = np.concatenate((self.history, vals.ravel()))
+        deltas = (stream[self.lag_depth:] - stream[:-self.lag_depth] + 2048) & SAMPLE_MASK
+        self.history = stream[-self.lag_depth:].copy()
+
+        # Per-batch histograms in one bincount by offsetting each row
+        offsets = (np.arange(n, dtype=np.int64) * (SAMPLE_MASK + 1))[:, None]
+        flat = (deltas.reshape(n, self.batch_size) + offsets).ravel()
+        counts = np.bincount(flat, minlength=n * (SAMPLE_MASK + 1)).reshape(n, SAMPLE_MASK + 1)
+        samples = np.full(n, self.batch_size)
+
+        if self.window > 1:
+            # Windowed histogram = difference of running sums over batches
+            per_batch = np.concatenate((self.recent, counts.astype(np.int32)))
+            before = len(self.recent)
+            running = np.concatenate((np.zeros((1, SAMPLE_MASK + 1), dtype=np.int64),
+                                      np.cumsum(per_batch, axis=0)))
+            rows = np.arange(before, before + n)
+            first = np.maximum(rows + 1 - self.window, 0)
+            counts = running[rows + 1] - running[first]
+            samples = (self.batches + np.arange(n) + 1).clip(max=self.window) * self.batch_size
+            self.recent = per_batch[max(0, len(per_batch) - (self.window - 1)):]
+        max_count = counts.max(axis=1)
+
+        min_entropy = np.where(max_count > 0,
+                               np.log2(samples) - np.log2(np.maximum(max_count, 1)), 0.0)
+        squelched = dynamic_range < self.squelch_range
+        min_entropy[squelched] = 0.0
+
+        self.batches += n
+        return min_entropy, dynamic_range, lo, hi, max_count, squelched
+
+
+def reference_stats(batch, history, hist_head, squelch_range=SQUELCH_RANGE):
+    """
+    Direct port of the per-sample loop in core1_entry. history is the ring
+    buffer list and is updated in place; returns (stats, new hist_head).
+    """
+    lag_depth = len(history)
+    counts = [0] * 4096
+    max_count = 0
+    min_val = 4096
+    max_val = 0
+
+    for raw in batch:
+        val = int(raw) & 0xFFF
+        if val < min_val: min_val = val
+        if val > max_val: max_val = val
+
+        old_val = history[hist_head]
+        history[hist_head] = val
+        hist_head = (hist_head + 1) % lag_depth
+
+        delta = (val - old_val + 2048) & 0xFFF
+        counts[delta] += 1
+        if counts[delta] > max_count:
+            max_count = counts[delta]
+
+    h_max = math.log2(len(batch))
+    min_entropy = h_max - math.log2(max_count) if max_count > 0 else 0.0
+    dynamic_range = max_val - min_val
+    squelched = dynamic_range < squelch_range
+    if squelched:
+        min_entropy = 0.0
+    return BatchStats(min_entropy, dynamic_range, min_val, max_val, max_count, squelched), hist_head
+
+
+def verify(n_batches=64, seed=0):
+    """Checks the vectorized engine against the reference loop on awkward inputs."""
+    rng = np.random.default_rng(seed)
+    batches = rng.integers(0, 1 << 16, size=(n_batches, BATCH_SIZE), dtype=np.uint16)
+    batches[1] = 2048                                   # Flat batch, squelched
+    batches[2] = rng.integers(2000, 2100, BATCH_SIZE)   # Narrow range
+    batches[3, ::2] = 0                                 # Wrapping deltas
+
+    analyzer = BatchAnalyzer()
+    # Uneven chunking to exercise history carry-over
+    results = [analyzer.process(batches[:5]), analyzer.process(batches[5:])]
+    fast = BatchStats(*(np.concatenate(f) for f in zip(*results)))
+
+    history = [0] * LAG_DEPTH
+    head = 0
+    for i, batch in enumerate(batches):
+        ref, head = reference_stats(batch, history, head)
+        for field in BatchStats._fields:
+            a = getattr(fast, field)[i]
+            b = getattr(ref, field)
+            if a != b:
+                raise AssertionError(f"batch {i} {field}: vectorized {a} != reference {b}")
+    print(f"OK: {n_batches} batches match the firmware algorithm")
+
+    # Sliding window: against a direct histogram of the last window * BATCH_SIZE deltas
+    window = 4
+    analyzer = BatchAnalyzer(window=window)
+    results = [analyzer.process(batches[:3]), analyzer.process(batches[3:4]), analyzer.process(batches[4:])]
+    fast = BatchStats(*(np.concatenate(f) for f in zip(*results)))
+    stream = np.concatenate((np.zeros(LAG_DEPTH, dtype=np.int32), (batches.astype(np.int32) & SAMPLE_MASK).ravel()))
+    deltas = (stream[LAG_DEPTH:] - stream[:-LAG_DEPTH] + 2048) & SAMPLE_MASK
+    for i in range(n_batches):
+        first = max(0, i + 1 - window) * BATCH_SIZE
+        span = deltas[first:(i + 1) * BATCH_SIZE]
+        expected = math.log2(len(span)) - math.log2(np.bincount(span).max())
+        if fast.squelched[i]:
+            expected = 0.0
+        if not math.isclose(fast.min_entropy[i], expected):
+            raise AssertionError(f"batch {i} window {window}: {fast.min_entropy[i]} != {expected}")
+    print(f"OK: sliding window of {window} batches matches a direct count")
+
+
+def analyze_file(path, batch_size=BATCH_SIZE, lag_depth=LAG_DEPTH, chunk_batches=4096, packed=False,
+                 window=1):
+    """Streams a raw capture through the analyzer without loading it whole."""
+    analyzer = BatchAnalyzer(batch_size, lag_depth, window=window)
+    if packed:
+        # 12-bit packed capture from rawcapture.py, 3 bytes per 2 samples
+        from rawcapture import unpack12
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        bytes_per_batch = batch_size * 3 // 2
+        usable = len(data) - len(data) % bytes_per_batch
+        step = chunk_batches * bytes_per_batch
+        chunks = (unpack12(data[i:min(i + step, usable)]) for i in range(0, usable, step))
+    else:
+        samples = np.memmap(path, dtype="<u2", mode="r")
+        usable = len(samples) - len(samples) % batch_size
+        step = chunk_batches * batch_size
+        chunks = (samples[i:min(i + step, usable)] for i in range(0, usable, step))
+
+    results = [analyzer.process(chunk) for chunk in chunks]
+    if not results:
+        return analyzer.process(np.empty(0, dtype=np.uint16))
+    return BatchStats(*(np.concatenate(f) for f in zip(*results)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch health statistics")
+    parser.add_argument("capture", nargs="?", help="raw little-endian uint16 sample file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lag-depth", type=int, default=LAG_DEPTH)
+    parser.add_argument("--window", type=int, default=1, help="sliding window estimator, in batches")
+    parser.add_argument("--packed", action="store_true", help="capture is packed 12-bit (rawcapture.py)")
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args()
+
+    if args.verify or not args.capture:
+        verify()
+        return
+
+    t0 = time.perf_counter()
+    stats = analyze_file(args.capture, args.batch_size, args.lag_depth, packed=args.packed,
+                         window=args.window)
+    elapsed = time.perf_counter() - t0
+    n = len(stats.range)
+    print(f"Batches:     {n} ({n / elapsed:.0f} batches/s)")
+    if n:
+        print(f"Squelched:   {int(stats.squelched.sum())}")
+        print(f"H_min:       mean {stats.min_entropy.mean():.4f}  min {stats.min_entropy.min():.4f}")
+        print(f"Range:       mean {stats.range.mean():.1f}  min {stats.range.min()}")
+
+
+if __name__ == "__main__":
+    main()
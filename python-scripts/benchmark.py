@@ -0,0 +1,280 @@
+"""
+Reproducible throughput benchmarks for each stage of the pipeline.
+
+Every stage is timed on the same seeded synthetic input and reported in
+batches per second (best of --repeat runs):
+
+* process   - the core1_entry loop: range, lagged-derivative histogram, min-entropy
+              (analysis.reference_stats, the line-by-line port of the firmware)
+* kernel    - QRNG.process_python, the firmware's own per-sample kernel, loaded through
+              simulator.py (on the board process_viper runs instead; it is checked
+              against this one at boot)
+* pack12    - QRNG.pack12 itself, loaded through simulator.py
+* hash      - the firmware's double SHA256 over a 2048-byte batch
+* parse_text / parse_binary - protocol parsers, fed in serial-sized chunks
+* pipeline  - QRNG.py end to end in the simulator (acquisition included), null output
+* pipeline_schedule - the same with ACQUISITION = "schedule" (one ADC read per sample)
+* history_append - History.append, what SerialWorker adds per batch for the charts
+* ui_record - MainWindow.show_record (labels, hex box, byte map)
+* viz_paint - VisualizerWidget repaint for a fresh digest
+* chart_paint - HistoryChart repaints of a full history over its 6 h span, per second
+                (not batches: this has to stay above display.CHART_FPS)
+
+The Qt stages are skipped when PyQt6 is not installed (run them with
+QT_QPA_PLATFORM=offscreen on a headless host). Results are printed and
+written as JSON; with --baseline, any stage slower than the baseline by
+more than --tolerance is reported as a regression and the exit code is 1.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import hashlib
+import json
+import platform
+import random
+import sys
+import time
+
+import analysis
+import protocol
+import simulator
+
+BATCH_SIZE = 1024
+LAG_DEPTH = 12
+DIGEST_SIZE = 32
+
+
+def synthetic_batches(count, seed=0):
+    rng = random.Random(seed)
+    return [[rng.getrandbits(16) for _ in range(BATCH_SIZE)] for _ in range(count)]
+
+
+def best_rate(fn, batches, repeat):
+    """Runs fn() repeat times; fn processes `batches` batches. Returns the best batches/s."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return batches / best
+
+
+# ----------------------------------------------------------------------------
+# STAGES
+# ----------------------------------------------------------------------------
+def bench_process(n, repeat):
+    batches = synthetic_batches(n)
+
+    def run():
+        history = [0] * LAG_DEPTH
+        head = 0
+        for batch in batches:
+            _, head = analysis.reference_stats(batch, history, head)
+    return best_rate(run, n, repeat)
+
+
+def bench_kernel(n, repeat):
+    firmware = simulator.load_firmware(simulator.make_modules(simulator.SimulatedADC(None)))
+    buffers = [firmware.array("H", batch) for batch in synthetic_batches(n)]
+    state = firmware.kernel_state(*firmware.health_cutoffs(firmware.HEALTH_ENTROPY))
+    counts = firmware.array("H", bytes(4096 * 2))
+    zero_counts = firmware.array("H", bytes(4096 * 2))
+
+    def run():
+        for batch in buffers:
+            counts[:] = zero_counts
+            firmware.start_batch(state, BATCH_SIZE, LAG_DEPTH, 0)
+            firmware.process_python(batch, counts, None, state)
+    return best_rate(run, n, repeat)
+
+
+def bench_pack12(n, repeat):
+    firmware = simulator.load_firmware(simulator.make_modules(simulator.SimulatedADC(None)))
+    buffers = [firmware.array("H", batch) for batch in synthetic_batches(n)]
+    out = bytearray(BATCH_SIZE * 3 // 2)
+
+    def run():
+        for batch in buffers:
+            firmware.pack12(batch, out, BATCH_SIZE)
+    return best_rate(run, n, repeat)
+
+
+def bench_hash(n, repeat):
+    rng = random.Random(0)
+    batches = [rng.randbytes(BATCH_SIZE * 2) for _ in range(n)]
+
+    def run():
+        for batch in batches:
+            first = hashlib.sha256(batch).digest()
+            hashlib.sha256(first).digest()
+    return best_rate(run, n, repeat)
+
+
+def bench_parse(mode, n, repeat, chunk=256):
+    stream = protocol.synthetic_stream(n, mode, DIGEST_SIZE, seed=1)
+
+    def run():
+        parser = protocol.make_parser(mode)
+        for i in range(0, len(stream), chunk):
+            parser.feed(stream[i:i + chunk])
+    return best_rate(run, n, repeat)
+
+
+def bench_history(n, repeat):
+    import history
+    rng = random.Random(3)
+    rows = [(1e9 + i * 0.1, i, rng.uniform(7, 8), rng.randrange(4096)) for i in range(n)]
+
+    def run():
+        h = history.History()
+        for row in rows:
+            h.append(*row)
+    return best_rate(run, n, repeat)
+
+
+def bench_pipeline(seconds, acquisition="inline"):
+    sim = simulator.Simulator(simulator.SerialSink(lambda data: None), "gaussian", seed=0,
+                              OUTPUT_MODE="binary", TELEMETRY_INTERVAL_MS=0, ACQUISITION=acquisition)
+    sim.start()
+    time.sleep(seconds)
+    sim.stop()
+    return sim.stats()["batches_per_s"]
+
+
+def qt_stages(n, repeat):
+    """Returns {stage: batches/s} for the GUI stages, or {} without PyQt6."""
+    try:
+        from PyQt6.QtWidgets import QApplication
+    except ImportError:
+        return {}
+    import display
+    import display_qt
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    rng = random.Random(2)
+    records = [protocol.BatchRecord(i, rng.uniform(7, 8), rng.randrange(4096), rng.randbytes(2 * DIGEST_SIZE))
+               for i in range(n)]
+
+    # The worker is never started, records are fed to show_record directly
+    window = display_qt.MainWindow(display.SerialWorker("mock"))
+    window.resize(800, 600)
+
+    def ui_record():
+        for record in records:
+            window.show_record(record)
+
+    viz = display_qt.VisualizerWidget()
+    viz.resize(640, 320)
+
+    def viz_paint():
+        for record in records:
+            viz.update_bytes(record.digest)
+            viz.grab()
+
+    # A full history ending now, 10 batches/s
+    import numpy as np
+    from history import History
+    full = History()
+    count = full.capacity
+    now = time.time()
+    full.extend(now - (count - np.arange(count)) * 0.1, np.arange(count),
+                np.random.default_rng(4).normal(7.7, 0.05, count), np.full(count, 1550))
+    chart = display_qt.HistoryChart(full)
+    chart.resize(1000, 240)
+    chart.set_span(3)
+    frames = max(1, n // 10)
+
+    def chart_paint():
+        for _ in range(frames):
+            chart.grab()
+
+    results = {
+        "ui_record": best_rate(ui_record, n, repeat),
+        "viz_paint": best_rate(viz_paint, n, repeat),
+        "chart_paint": best_rate(chart_paint, frames, repeat),
+    }
+    window.close()
+    app.processEvents()
+    return results
+
+
+def run_all(args):
+    n = args.batches
+    stages = {
+        "process": lambda: bench_process(max(1, n // 10), args.repeat),
+        "kernel": lambda: bench_kernel(max(1, n // 10), args.repeat),
+        "pack12": lambda: bench_pack12(max(1, n // 10), args.repeat),
+        "hash": lambda: bench_hash(n, args.repeat),
+        "parse_text": lambda: bench_parse("text", n, args.repeat),
+        "parse_binary": lambda: bench_parse("binary", n, args.repeat),
+        "history_append": lambda: bench_history(n, args.repeat),
+        "pipeline": lambda: bench_pipeline(args.pipeline_seconds),
+        "pipeline_schedule": lambda: bench_pipeline(args.pipeline_seconds, "schedule"),
+    }
+    results = {}
+    for name, fn in stages.items():
+        if args.stage and name not in args.stage:
+            continue
+        results[name] = round(fn(), 1)
+    if not args.stage or {"ui_record", "viz_paint", "chart_paint"} & set(args.stage):
+        for name, rate in qt_stages(max(1, n // 10), args.repeat).items():
+            if not args.stage or name in args.stage:
+                results[name] = round(rate, 1)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns [(stage, current, baseline, ratio)] for stages slower than tolerance allows."""
+    regressions = []
+    for stage, rate in results.items():
+        base = baseline.get(stage)
+        if base and rate < base * (1 - tolerance):
+            regressions.append((stage, rate, base, rate / base))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage pipeline benchmarks")
+    parser.add_argument("--batches", type=int, default=2000, help="batches per run (Python loop stages use 1/10)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pipeline-seconds", type=float, default=2.0)
+    parser.add_argument("--stage", action="append", help="only run this stage (repeatable)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown vs baseline")
+    args = parser.parse_args()
+
+    results = run_all(args)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["batches_per_s"]
+
+    for stage, rate in results.items():
+        line = f"{stage:>17}: {rate:12.1f} batches/s"
+        if stage in baseline:
+            line += f"  ({rate / baseline[stage] - 1:+.1%} vs baseline)"
+        print(line)
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "batches": args.batches,
+        "repeat": args.repeat,
+        "batches_per_s": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for stage, rate, base, ratio in regressions:
+        print(f"REGRESSION {stage}: {rate:.1f} batches/s vs {base:.1f} ({ratio:.0%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Append-only capture files for recording and replaying serial sessions.
+
+A capture (.qcap) is a 32-byte header followed by fixed-width batch records:
+
+    header:  magic "QRNGCAP1", version, header size, digest size, raw size,
+             batch size, reserved, creation time
+    record:  timestamp  f8  host receive time (unix seconds)
+             seq        u4  firmware sequence number
+             h_min      f4
+             range      u2
+             flags      u2  FLAG_RAW when the raw field holds samples
+             digest     u1[digest size]
+             raw        u1[raw size]   packed 12-bit samples (STREAM_RAW), may be 0 bytes
+
+Because every record has the same size, batch N lives at a known offset.
+The sidecar index (<capture>.idx) holds (record number, timestamp, seq) for
+every INDEX_STRIDE-th record so time ranges can be located without
+scanning; it is rebuilt from the capture if missing.
+
+Usage:
+    python capture.py record --port /dev/ttyACM0 --protocol binary session.qcap
+    python capture.py info session.qcap
+"""
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+import protocol
+
+MAGIC = b"QRNGCAP1"
+VERSION = 1
+HEADER = struct.Struct("<8sHHHHHHId")
+HEADER_SIZE = 32
+INDEX = struct.Struct("<QdI")
+INDEX_DTYPE = np.dtype([("record", "<u8"), ("timestamp", "<f8"), ("seq", "<u4")])
+INDEX_STRIDE = 256
+
+FLAG_RAW = 0x0001
+
+DEFAULT_DIGEST_SIZE = 64    # Two SHA256 digests from QRNG.py
+DEFAULT_BATCH_SIZE = 1024
+SLEEP_SLICE = 0.1           # Longest replay sleep between should_stop() checks
+
+
+def record_dtype(digest_size, raw_size):
+    return np.dtype([
+        ("timestamp", "<f8"),
+        ("seq", "<u4"),
+        ("h_min", "<f4"),
+        ("range", "<u2"),
+        ("flags", "<u2"),
+        ("digest", "u1", (digest_size,)),
+        ("raw", "u1", (raw_size,)),
+    ])
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+class CaptureWriter:
+    """
+    Appends batch records to a capture and its index. Opening an existing
+    capture continues it, as long as the record layout matches. A new raw
+    capture takes its batch size from the first ConfigRecord or RawRecord
+    given to add(), since the device's batch size is a runtime setting.
+    """
+    def __init__(self, path, digest_size=DEFAULT_DIGEST_SIZE, raw=False,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.digest_size = digest_size
+        self.raw_size = batch_size * 3 // 2 if raw else 0
+        self.batch_size = batch_size
+        self.record = struct.Struct(f"<dIfHH{digest_size}s{self.raw_size}s")
+        self.raw_dropped = 0         # Raw samples of another batch size, not stored
+
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            reader = CaptureReader(path)
+            if (reader.digest_size, reader.raw_size) != (digest_size, self.raw_size):
+                raise ValueError(f"{path} has a different record layout")
+            self.count = len(reader)
+            reader.close()
+            self.f = open(path, "ab")
+            self.resizable = False
+        else:
+            self.count = 0
+            self.f = open(path, "wb")
+            self._write_header()
+            self.resizable = bool(self.raw_size)
+        self.idx = open(index_path(path), "ab")
+        self.pending = None
+
+    def _write_header(self):
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, VERSION, HEADER_SIZE, self.digest_size, self.raw_size,
+                                 self.batch_size, 0, 0, time.time()).ljust(HEADER_SIZE, b"\0"))
+
+    def _resize(self, batch_size):
+        """Switches a new, still empty raw capture to another batch size."""
+        if self.resizable and self.count == 0 and batch_size and batch_size != self.batch_size:
+            self.batch_size = batch_size
+            self.raw_size = batch_size * 3 // 2
+            self.record = struct.Struct(f"<dIfHH{self.digest_size}s{self.raw_size}s")
+            self._write_header()
+        self.resizable = False
+
+    def write(self, record, raw_packed=None, timestamp=None):
+        """Writes a protocol.BatchRecord, optionally with its packed raw samples."""
+        timestamp = time.time() if timestamp is None else timestamp
+        if len(record.digest) != self.digest_size:
+            # Records are fixed width; conditioned output (credit / extract) varies per batch
+            raise ValueError(f"digest of {len(record.digest)} bytes in a {self.digest_size}-byte capture "
+                             "(record with conditioning=legacy)")
+        if raw_packed is not None and len(raw_packed) != self.raw_size:
+            # struct would pad or cut it silently, leaving samples from another batch size
+            raise ValueError(f"raw field of {len(raw_packed)} bytes in a capture with "
+                             f"{self.raw_size}-byte raw fields")
+        if self.count % INDEX_STRIDE == 0:
+            self.idx.write(INDEX.pack(self.count, timestamp, record.seq))
+        flags = FLAG_RAW if raw_packed is not None and self.raw_size else 0
+        self.f.write(self.record.pack(timestamp, record.seq, record.h_min, record.range, flags,
+                                      record.digest, raw_packed or b""))
+        self.count += 1
+
+    def write_array(self, rows):
+        """Writes an array of record_dtype rows (e.g. history.py's export) in one go."""
+        self.flush_pending()
+        if rows.dtype != record_dtype(self.digest_size, self.raw_size):
+            raise ValueError("rows do not match this capture's record layout")
+        first = -self.count % INDEX_STRIDE
+        for i in range(first, len(rows), INDEX_STRIDE):
+            self.idx.write(INDEX.pack(self.count + i, float(rows["timestamp"][i]), int(rows["seq"][i])))
+        self.f.write(rows.tobytes())
+        self.count += len(rows)
+
+    def add(self, record, timestamp=None):
+        """
+        Takes records straight from a parser. A raw capture holds each batch
+        back until its RawRecord (same seq) arrives, or the next batch shows
+        that none is coming.
+        """
+        if isinstance(record, protocol.BatchRecord):
+            if not self.raw_size:
+                self.write(record, timestamp=timestamp)
+                return
+            self.flush_pending()
+            self.pending = (record, time.time() if timestamp is None else timestamp)
+        elif isinstance(record, protocol.ConfigRecord):
+            self._resize(record.batch_size)
+        elif isinstance(record, protocol.RawRecord) and self.pending is not None:
+            batch, ts = self.pending
+            self.pending = None
+            raw = record.packed if record.seq == batch.seq else None
+            if raw is not None:
+                self._resize(len(raw) * 2 // 3)
+                if len(raw) != self.raw_size:
+                    # The batch size changed mid-session: keep the batch, not the samples
+                    self.raw_dropped += 1
+                    raw = None
+            self.write(batch, raw, ts)
+
+    def flush_pending(self):
+        if self.pending is not None:
+            batch, ts = self.pending
+            self.pending = None
+            self.write(batch, timestamp=ts)
+
+    def close(self):
+        self.flush_pending()
+        self.f.close()
+        self.idx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """Memory-maps a capture; records are addressable by number, seq or time."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        magic, version, header_size, digest_size, raw_size, batch_size, _, _, created = \
+            HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} capture")
+        self.digest_size = digest_size
+        self.raw_size = raw_size
+        self.batch_size = batch_size
+        self.created = created
+        self.dtype = record_dtype(digest_size, raw_size)
+
+        n = (os.path.getsize(path) - header_size) // self.dtype.itemsize
+        if n:
+            self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=header_size, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        path = index_path(self.path)
+        expected = (len(self.records) + INDEX_STRIDE - 1) // INDEX_STRIDE
+        if os.path.exists(path) and os.path.getsize(path) >= expected * INDEX.size:
+            return np.fromfile(path, dtype=INDEX_DTYPE, count=expected)
+        return self.build_index()
+
+    def build_index(self):
+        """Regenerates the sidecar index from the records themselves."""
+        rows = np.arange(0, len(self.records), INDEX_STRIDE)
+        with open(index_path(self.path), "wb") as f:
+            for i in rows:
+                f.write(INDEX.pack(int(i), float(self.records["timestamp"][i]),
+                                   int(self.records["seq"][i])))
+        return np.fromfile(index_path(self.path), dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def time_range(self, start=None, end=None):
+        """Returns (first, stop) record numbers covering start <= timestamp < end."""
+        return (self._find_time(start) if start is not None else 0,
+                self._find_time(end) if end is not None else len(self.records))
+
+    def _find_time(self, t):
+        # Coarse step over the index, then a search within one stride
+        block = max(0, int(np.searchsorted(self.index["timestamp"], t, side="right")) - 1)
+        lo = block * INDEX_STRIDE
+        hi = min(lo + INDEX_STRIDE + 1, len(self.records))
+        return lo + int(np.searchsorted(self.records["timestamp"][lo:hi], t))
+
+    def find_seq(self, seq):
+        """Record number of the first record with this sequence number, or None."""
+        seqs = self.index["seq"]
+        if len(seqs) and np.all(seqs[1:] >= seqs[:-1]):
+            block = max(0, int(np.searchsorted(seqs, seq, side="right")) - 1)
+            lo = block * INDEX_STRIDE
+            hits = np.flatnonzero(self.records["seq"][lo:lo + INDEX_STRIDE] == seq)
+            if len(hits):
+                return lo + int(hits[0])
+        # Sequence numbers wrap and restart on reboot, so fall back to a scan
+        hits = np.flatnonzero(self.records["seq"] == seq)
+        return int(hits[0]) if len(hits) else None
+
+    def batch(self, i):
+        """Record i as a protocol.BatchRecord."""
+        r = self.records[i]
+        return protocol.BatchRecord(int(r["seq"]), float(r["h_min"]), int(r["range"]),
+                                    r["digest"].tobytes())
+
+    def raw(self, i):
+        """Packed raw samples of record i, or None if it has none."""
+        r = self.records[i]
+        return r["raw"].tobytes() if r["flags"] & FLAG_RAW else None
+
+    def close(self):
+        if isinstance(self.records, np.memmap):
+            self.records._mmap.close()
+
+
+def replay_capture(path, speed=1.0, start=0, stop=None, should_stop=lambda: False):
+    """
+    Yields the capture's records as the parser would have produced them:
+    BatchRecord, followed by a RawRecord when raw samples were stored.
+    speed=1.0 keeps the original timing, 2.0 plays twice as fast, 0 as fast as possible.
+    """
+    reader = CaptureReader(path)
+    stop = len(reader) if stop is None else min(stop, len(reader))
+    t_first = None
+    wall_first = time.monotonic()
+    for i in range(start, stop):
+        if should_stop():
+            break
+        if speed:
+            ts = float(reader.records["timestamp"][i])
+            if t_first is None:
+                t_first = ts
+            # Long gaps (a paused session) are slept in slices so a stop request isn't kept waiting
+            while not should_stop():
+                delay = (ts - t_first) / speed - (time.monotonic() - wall_first)
+                if delay <= 0:
+                    break
+                time.sleep(min(delay, SLEEP_SLICE))
+            else:
+                break
+        record = reader.batch(i)
+        yield record
+        raw = reader.raw(i)
+        if raw is not None:
+            yield protocol.RawRecord(record.seq, raw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or inspect QRNG capture files")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    rec = sub.add_parser("record", help="record a serial session")
+    rec.add_argument("output")
+    rec.add_argument("--port", default="/dev/ttyACM0")
+    rec.add_argument("--baud", type=int, default=115200)
+    rec.add_argument("--protocol", choices=("text", "binary"), default="binary")
+    rec.add_argument("--digest-size", type=int, default=DEFAULT_DIGEST_SIZE)
+    rec.add_argument("--raw", action="store_true", help="store raw samples (firmware STREAM_RAW)")
+    rec.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                     help="samples per batch for --raw, until the device reports its own")
+    rec.add_argument("--mock", action="store_true", help="record the mock source instead of a device")
+    rec.add_argument("--batches", type=int, default=0, help="stop after N batches (0 = forever)")
+
+    info = sub.add_parser("info", help="summarise a capture")
+    info.add_argument("capture")
+
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        if args.mock:
+            source = protocol.mock_records(rate=0, digest_size=args.digest_size // 2)
+        else:
+            # GET makes the device report its settings, batch size included
+            source = protocol.serial_records(args.port, args.baud, args.protocol,
+                                             commands=[protocol.config_command(None)])
+        with CaptureWriter(args.output, args.digest_size, args.raw, args.batch_size) as writer:
+            try:
+                for record in source:
+                    writer.add(record)
+                    if args.batches and writer.count >= args.batches:
+                        break
+            except KeyboardInterrupt:
+                pass
+        print(f"{writer.count} records in {args.output}")
+        if writer.raw_dropped:
+            print(f"{writer.raw_dropped} batches without raw samples (batch size changed)")
+    else:
+        reader = CaptureReader(args.capture)
+        n = len(reader)
+        print(f"Records:     {n} ({reader.dtype.itemsize} bytes each, "
+              f"digest {reader.digest_size}, raw {reader.raw_size})")
+        if n:
+            ts = reader.records["timestamp"]
+            duration = ts[-1] - ts[0]
+            print(f"Time span:   {time.ctime(ts[0])} .. {time.ctime(ts[-1])} ({duration:.1f} s)")
+            print(f"Seq:         {reader.records['seq'][0]} .. {reader.records['seq'][-1]}")
+            print(f"Squelched:   {int((reader.records['h_min'] == 0).sum())}")
+
+
+if __name__ == "__main__":
+    main()
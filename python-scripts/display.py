@@ -1,281 +1,220 @@
-import sys
+"""
+Entropy source visualizer, or a headless record logger with --headless.
+
+Nothing heavy is imported up front: PyQt6 only when a window is opened
+(display_qt.py), pyserial only when the worker thread connects, so the
+window shows straight away and a collector box never loads Qt at all.
+
+Usage:
+    python display.py                                   # first attached Pico, else SERIAL_PORT
+    python display.py --port COM3 --protocol binary
+    python display.py --source mock
+    python display.py --source replay --replay session.qcap --speed 4
+    python display.py --headless --port /dev/ttyACM0 --log records.log
+"""
+import argparse
 import random
+import sys
+import threading
 import time
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
-                             QWidget, QLabel, QTextEdit, QPushButton, QSpinBox)
-from PyQt6.QtCore import pyqtSignal, QThread, Qt
-from PyQt6.QtGui import QPainter, QColor, QBrush, QPen
+from collections import deque
+
+import protocol
 
-# Configuration
-SERIAL_PORT = '/dev/tty.usbmodem101' # Adjust to your actual serial port (e.g., COM3 on Windows)
+# Configuration (defaults for the command-line options)
+SERIAL_PORT = '/dev/tty.usbmodem101' # Used when no Pico is found (e.g., COM3 on Windows, /dev/ttyACM0 on Linux)
+PICO_VID = 0x2E8A # Raspberry Pi USB vendor ID, for finding the board
 BAUD_RATE = 115200
+PROTOCOL = 'text' # 'text' or 'binary', must match OUTPUT_MODE in the firmware
+REPLAY_SPEED = 1.0 # 1.0 = original timing, 0 = as fast as possible
+UI_FPS = 30 # Maximum display refresh rate; records arriving faster are coalesced
+RECORD_BUFFER = 4096 # Records held between UI refreshes before the oldest are dropped
+HISTORY_BATCHES = 1 << 19 # H_min / range history kept for the charts (~14 h at 10 batches/s, 9 MiB)
+CHART_FPS = 10 # History chart redraw rate
+
+def find_port():
+    """First attached Pico, else SERIAL_PORT. Imports pyserial on first use."""
+    try:
+        from serial.tools import list_ports
+    except ImportError:
+        return SERIAL_PORT
+    for port in list_ports.comports():
+        if port.vid == PICO_VID:
+            return port.device
+    return SERIAL_PORT
+
+class SerialWorker(threading.Thread):
+    """
+    Reads records from the serial port (or a mock / replay source) in a
+    background thread, so connecting never holds up the UI.
+    With fallback set, a failed serial open switches to the mock generator.
 
-logeaux = "0000000000000000000000000000000000000099999900000099000000990000000099000000990000990000009900000000990000009900009900000099000000009900000099000099000000990000000099009900990000009900990000000000009999990000000000990000000000000000000099000000000000000000"
+    Parsed records go into a bounded buffer that the UI drains on its own
+    timer, so ingest never waits on rendering and a slow UI only loses the
+    oldest undisplayed records.
 
-class SerialWorker(QThread):
-    """
-    Handles reading from the serial port in a separate thread to keep the UI responsive.
-    Falls back to a mock generator if the serial port is unavailable.
+    With history set (a history.History, which the window provides) every
+    batch's H_min and range is also kept for the charts, never dropped.
     """
-    data_received = pyqtSignal(str)
+    def __init__(self, source="serial", port=None, baud=BAUD_RATE, mode=PROTOCOL,
+                 replay=None, speed=REPLAY_SPEED, fallback=True, maxlen=RECORD_BUFFER,
+                 history=None):
+        super().__init__(daemon=True, name="serial-worker")
+        self.source = source
+        self.port = port
+        self.baud = baud
+        self.mode = mode
+        self.replay = replay
+        self.speed = speed
+        self.fallback = fallback
+        self.stopping = threading.Event()
+        self.error = None
+
+        self.records = deque(maxlen=maxlen)
+        self.telemetry = None
+        self.ingested = 0
+        self.overflowed = 0
+        self.history = history
+
+    def stop(self):
+        self.stopping.set()
+
+    def should_stop(self):
+        return self.stopping.is_set()
 
     def run(self):
+        for record in self.iter_records():
+            self.emit_record(record)
+
+    def iter_records(self):
+        """Records from the configured source until stop() (also used directly by --headless)."""
+        if self.source == "mock":
+            yield from self.mock_records()
+            return
+        if self.source == "replay":
+            yield from self.replay_records(self.replay, self.speed)
+            return
         try:
-            import serial
-            with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
-                print(f"Connected to {SERIAL_PORT}")
-                while not self.isInterruptionRequested():
-                    try:
-                        line = ser.readline().decode('utf-8', errors='ignore').strip()
-                        if line.startswith("H_min:") and "Data:" in line:
-                            hex1 = ser.readline().decode('utf-8', errors='ignore').strip()
-                            hex2 = ser.readline().decode('utf-8', errors='ignore').strip()
-                            self.data_received.emit(f"{line} {hex1}{hex2}")
-                    except Exception as e:
-                        print(f"Read error: {e}")
-                        break
+            port = self.port or find_port()
+            yield from protocol.serial_records(port, self.baud, self.mode, self.should_stop)
         except (ImportError, OSError) as e:
+            self.error = str(e)
+            if not self.fallback:
+                print(f"Serial connection failed ({e}).", file=sys.stderr)
+                return
             print(f"Serial connection failed ({e}). Starting mock data generator for demonstration.")
-            self.mock_run()
+            yield from self.mock_records()
+
+    def emit_record(self, record):
+        # deque.append / popleft are atomic, no lock needed with a single reader
+        if isinstance(record, protocol.BatchRecord):
+            if len(self.records) == self.records.maxlen:
+                self.overflowed += 1
+            self.records.append(record)
+            self.ingested += 1
+            if self.history is not None:
+                self.history.append(time.time(), record.seq, record.h_min, record.range)
+        elif isinstance(record, protocol.TelemetryRecord):
+            self.telemetry = record
+
+    def drain(self):
+        """Takes every buffered record (called from the GUI thread)."""
+        out = []
+        try:
+            while True:
+                out.append(self.records.popleft())
+        except IndexError:
+            return out
+
+    def replay_records(self, path, speed):
+        """Replays a .qcap capture at its original pace or faster, or a serial byte dump."""
+        print(f"Replaying {path} at " + (f"{speed}x speed" if speed else "maximum speed"), file=sys.stderr)
+        if path.endswith(".qcap"):
+            import capture
+            yield from capture.replay_capture(path, speed, should_stop=self.should_stop)
+        else:
+            # Byte dumps carry no timestamps; speed 1.0 is the firmware's ~10 batches/s
+            yield from protocol.replay_records(path, self.mode, rate=10 * speed, should_stop=self.should_stop)
 
-    def mock_run(self):
+    def mock_records(self):
         """Generates fake data in the specified format for testing."""
         base_hex = "c4e441871b5f1dd50dd7915b89c1733fcc62f548f453545ee48d59d63a9dbedc8f75685116a81a72cb02fec716770278118765126f63281ff2a5c9aab755ced927db67e613d96552e8febee2cf19bddd2ec2cccb543055ed3159287d30de38aa7fb01bae71ba02c326502010ead442263c18aecb1fa2c87aa1c1d5883d1c3b6e"
         h_min = 7.6781
         r_val = 1554
-        
-        while not self.isInterruptionRequested():
+        seq = 0
+
+        while not self.should_stop():
             # Randomize the hex string slightly to show animation
             hex_list = list(base_hex)
             for _ in range(10):
                 idx = random.randint(0, len(hex_list)-1)
                 hex_list[idx] = hex(random.randint(0, 15))[2:]
             current_hex = "".join(hex_list)
-            
+
             # Vary H_min slightly
             current_h = h_min + random.uniform(-0.05, 0.05)
-            
-            data_str = f"H_min: {current_h:.4f} | R: {r_val} | Data: {current_hex}"
-            self.data_received.emit(data_str)
-            time.sleep(0.1) # Update rate (10Hz)
-
-class VisualizerWidget(QWidget):
-    """
-    Custom widget to draw the geometric interpretation of the random data.
-    """
-    def __init__(self):
-        super().__init__()
-        self.bytes_data = b''
-        self.setMinimumHeight(300)
-        # Dark background for better contrast with colors
-        self.setStyleSheet("background-color: #2b2b2b; border-radius: 8px;")
-
-    def update_data(self, hex_data):
-        try:
-            self.bytes_data = bytes.fromhex(hex_data)
-            self.update() # Trigger a repaint
-        except ValueError:
-            pass
-
-    def paintEvent(self, event):
-        if not self.bytes_data:
-            return
-
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-        w = self.width()
-        h = self.height()
-        
-        # Calculate grid dimensions
-        # 128 bytes fits nicely into a 16x8 grid
-        cols = 16
-        rows = (len(self.bytes_data) + cols - 1) // cols
-        
-        # Margins and cell sizing
-        margin = 20
-        available_w = w - 2 * margin
-        available_h = h - 2 * margin
-        
-        cell_w = available_w / cols
-        cell_h = available_h / rows
-        
-        # Size of the shape within the cell
-        shape_size = min(cell_w, cell_h) * 0.85
-        
-        # Centering offsets
-        offset_x = margin + (available_w - (cols * cell_w)) / 2 + (cell_w - shape_size) / 2
-        offset_y = margin + (available_h - (rows * cell_h)) / 2 + (cell_h - shape_size) / 2
-
-        for i, byte in enumerate(self.bytes_data):
-            row = i // cols
-            col = i % cols
-            
-            x = margin + col * cell_w + (cell_w - shape_size) / 2
-            y = margin + row * cell_h + (cell_h - shape_size) / 2
-            
-            # Map byte value (0-255) to a color using HSV
-            # Hue: The byte value itself (mapped to 0-359 degrees)
-            # Saturation: High for vivid colors
-            # Value: High for brightness
-            hue = int((byte / 255.0) * 360)
-            color = QColor()
-            color.setHsv(hue, 200, 255)
-            
-            painter.setBrush(QBrush(color))
-            painter.setPen(Qt.PenStyle.NoPen)
-            
-            # Draw a circle for each byte
-            painter.drawEllipse(int(x), int(y), int(shape_size), int(shape_size))
-
-class MainWindow(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("Entropy Source Visualizer")
-        self.resize(900, 700)
-        
-        # Main layout container
-        central = QWidget()
-        self.setCentralWidget(central)
-        layout = QVBoxLayout(central)
-        layout.setSpacing(15)
-        
-        # --- Header Stats Section ---
-        stats_layout = QHBoxLayout()
-        self.lbl_hmin = QLabel("H_min: --")
-        self.lbl_r = QLabel("R: --")
-        
-        # Styling for stats
-        style = """
-            QLabel {
-                font-size: 18px; 
-                font-weight: bold; 
-                color: #333; 
-                padding: 10px; 
-                background: #e0e0e0; 
-                border-radius: 5px;
-                border: 1px solid #ccc;
-            }
-        """
-        for lbl in [self.lbl_hmin, self.lbl_r]:
-            lbl.setStyleSheet(style)
-            stats_layout.addWidget(lbl)
-        
-        stats_layout.addStretch()
-        layout.addLayout(stats_layout)
-
-        # --- Controls Section ---
-        controls_layout = QHBoxLayout()
-        
-        self.btn_manual = QPushButton("Plot Manual Data")
-        self.btn_manual.clicked.connect(self.plot_manual)
-        
-        self.spin_runs = QSpinBox()
-        self.spin_runs.setRange(1, 1000)
-        self.spin_runs.setValue(10)
-        self.spin_runs.setPrefix("Runs: ")
-        
-        self.btn_burst = QPushButton("Go")
-        self.btn_burst.clicked.connect(self.start_burst)
-        
-        self.btn_cont = QPushButton("Start Continuous")
-        self.btn_cont.setCheckable(True)
-        self.btn_cont.clicked.connect(self.toggle_continuous)
-        
-        controls_layout.addWidget(self.btn_manual)
-        controls_layout.addStretch()
-        controls_layout.addWidget(self.spin_runs)
-        controls_layout.addWidget(self.btn_burst)
-        controls_layout.addWidget(self.btn_cont)
-        
-        layout.addLayout(controls_layout)
-        
-        # --- Visualization Section ---
-        layout.addWidget(QLabel("<b>Geometric Interpretation (Byte Map):</b>"))
-        self.viz = VisualizerWidget()
-        layout.addWidget(self.viz, 1) # Stretch factor 1 to fill space
-        
-        # --- Raw Data Section ---
-        layout.addWidget(QLabel("<b>Raw Hex Data:</b>"))
-        self.txt_raw = QTextEdit()
-        self.txt_raw.setMaximumHeight(80)
-        self.txt_raw.setReadOnly(False)
-        self.txt_raw.setStyleSheet("font-family: Monospace; font-size: 11px; color: #555; background: #f9f9f9;")
-        layout.addWidget(self.txt_raw)
-
-        # --- Serial Thread ---
-        self.thread = SerialWorker()
-        self.thread.data_received.connect(self.on_data)
-        self.thread.start()
-        
-        # State
-        self.continuous = False
-        self.burst_remaining = 0
-        
-        # Initialize holding pattern
-        default_hex = "c4e441871b5f1dd50dd7915b89c1733fcc62f548f453545ee48d59d63a9dbedc8f75685116a81a72cb02fec716770278118765126f63281ff2a5c9aab755ced927db67e613d96552e8febee2cf19bddd2ec2cccb543055ed3159287d30de38aa7fb01bae71ba02c326502010ead442263c18aecb1fa2c87aa1c1d5883d1c3b6e"
-        self.txt_raw.setText(default_hex)
-        self.plot_manual()
 
-    def plot_manual(self):
-        data = self.txt_raw.toPlainText().replace('\n', '').replace(' ', '')
-        # self.viz.update_data(data)
-        self.viz.update_data(logeaux)
-
-    def start_burst(self):
-        self.burst_remaining = self.spin_runs.value()
-        self.continuous = False
-        self.btn_cont.setChecked(False)
-        self.btn_cont.setText("Start Continuous")
-
-    def toggle_continuous(self, checked):
-        self.continuous = checked
-        if checked:
-            self.btn_cont.setText("Stop Continuous")
-            self.burst_remaining = 0
-        else:
-            self.btn_cont.setText("Start Continuous")
-
-    def on_data(self, line):
-        """Parses the incoming serial line and updates UI."""
-        if not self.continuous and self.burst_remaining <= 0:
-            return
-            
-        if self.burst_remaining > 0:
-            self.burst_remaining -= 1
-
-        # Expected format: H_min: 7.6781 | R: 1554 | Data: c4e4...
-        try:
-            parts = line.split('|')
-            if len(parts) >= 3:
-                # Extract values using split (more robust than fixed indices if whitespace varies)
-                h_part = parts[0].split(':')[1].strip()
-                r_part = parts[1].split(':')[1].strip()
-                data_part = parts[2].split(':')[1].strip()
-                
-                # Update UI
-                self.lbl_hmin.setText(f"H_min: {h_part}")
-                self.lbl_r.setText(f"R: {r_part}")
-                self.txt_raw.setText(data_part)
-                
-                # Update Visualization
-                self.viz.update_data(data_part)
-        except Exception as e:
-            # Silently ignore parse errors for partial lines
-            pass
+            yield protocol.BatchRecord(seq, current_h, r_val, bytes.fromhex(current_hex))
+            seq += 1
+            time.sleep(0.1) # Update rate (10Hz)
 
-    def closeEvent(self, event):
-        """Clean up thread on close."""
-        self.thread.requestInterruption()
-        self.thread.wait()
-        event.accept()
+def format_line(record):
+    """Log line for --headless, or None for record types it doesn't log."""
+    if isinstance(record, protocol.BatchRecord):
+        return f"{record.seq} {protocol.format_record(record)}"
+    if isinstance(record, protocol.TelemetryRecord):
+        return f"TLM: {protocol.format_telemetry(record)}"
+    if isinstance(record, protocol.HealthRecord):
+        return f"{record.seq} HEALTH: " + " ".join(f"{name}={getattr(record, name)}" for name in protocol.HEALTH_FIELDS)
+    if isinstance(record, protocol.ConfigRecord):
+        return "CFG: " + " ".join(f"{name}={getattr(record, name)}" for name in protocol.CONFIG_FIELDS)
+    return None
+
+def run_headless(worker, log=None, count=0):
+    """Prints (or appends to log) every parsed record, in the main thread. Returns an exit code."""
+    out = open(log, "a") if log else sys.stdout
+    batches = 0
+    try:
+        for record in worker.iter_records():
+            line = format_line(record)
+            if line is None:
+                continue
+            print(line, file=out, flush=True)
+            if isinstance(record, protocol.BatchRecord):
+                batches += 1
+                if count and batches >= count:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log:
+            out.close()
+    return 1 if worker.error and not batches else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Entropy source visualizer")
+    parser.add_argument("--source", choices=("serial", "mock", "replay"), default="serial")
+    parser.add_argument("--port", help=f"serial port (default: first attached Pico, else {SERIAL_PORT})")
+    parser.add_argument("--baud", type=int, default=BAUD_RATE)
+    parser.add_argument("--protocol", choices=("text", "binary"), default=PROTOCOL)
+    parser.add_argument("--replay", help=".qcap capture or serial byte dump for --source replay")
+    parser.add_argument("--speed", type=float, default=REPLAY_SPEED,
+                        help="replay speed (1.0 = original timing, 0 = as fast as possible)")
+    parser.add_argument("--headless", action="store_true", help="no window: print records instead (no Qt import)")
+    parser.add_argument("--log", help="--headless: append records to this file instead of stdout")
+    parser.add_argument("--count", type=int, default=0, help="--headless: stop after this many batches")
+    args = parser.parse_args()
+    if args.source == "replay" and not args.replay:
+        parser.error("--source replay needs --replay FILE")
+
+    # Headless collectors want to know about a dead port, not get mock data
+    worker = SerialWorker(args.source, args.port, args.baud, args.protocol, args.replay, args.speed,
+                          fallback=not args.headless)
+    if args.headless:
+        return run_headless(worker, args.log, args.count)
+
+    import display_qt
+    return display_qt.run_gui(worker, sys.argv)
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    
-    # Set a clean fusion style
-    app.setStyle("Fusion")
-    
-    window = MainWindow()
-    window.show()
-    sys.exit(app.exec())
+    sys.exit(main())
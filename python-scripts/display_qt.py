@@ -0,0 +1,433 @@
+"""
+Qt front end for display.py: the byte-map visualizer and the main window.
+
+Kept apart from display.py so the headless collector never imports PyQt6;
+display.py only loads this module when it is about to open a window.
+"""
+import math
+import time
+from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
+                             QWidget, QLabel, QTextEdit, QPushButton, QSpinBox, QComboBox,
+                             QFileDialog)
+from PyQt6.QtCore import QTimer, Qt, QPointF, QLineF, QRectF
+from PyQt6.QtGui import QPainter, QColor, QBrush, QPen, QImage, QPixmap, QPolygonF
+
+import protocol
+from display import UI_FPS, CHART_FPS, HISTORY_BATCHES
+from history import History
+
+logeaux = "0000000000000000000000000000000000000099999900000099000000990000000099000000990000990000009900000000990000009900009900000099000000009900000099000099000000990000000099009900990000009900990000000000009999990000000000990000000000000000000099000000000000000000"
+
+class VisualizerWidget(QWidget):
+    """
+    Custom widget to draw the geometric interpretation of the random data.
+
+    Each byte value's circle is rendered once per cell size into a cached
+    pixmap, and the byte map is kept in an off-screen image. New data only
+    re-blits the cells whose byte changed; paintEvent just copies the image.
+    """
+    MARGIN = 20
+
+    def __init__(self, cols=16):
+        super().__init__()
+        self.bytes_data = b''
+        self.cols = cols
+        self.setMinimumHeight(300)
+        # Dark background for better contrast with colors
+        self.setStyleSheet("background-color: #2b2b2b; border-radius: 8px;")
+
+        # Map byte value (0-255) to a color using HSV
+        # Hue: The byte value itself (mapped to 0-359 degrees)
+        # Saturation: High for vivid colors
+        # Value: High for brightness
+        self.palette_colors = [QColor.fromHsv(int((b / 255.0) * 360) % 360, 200, 255)
+                               for b in range(256)]
+        self.glyphs = {}      # byte -> QPixmap for the current cell size
+        self.frame = None     # Off-screen QImage of the whole byte map
+        self.drawn = []       # Byte currently drawn in each cell of the frame
+        self.geometry_key = None
+
+    def update_data(self, hex_data):
+        try:
+            self.update_bytes(bytes.fromhex(hex_data))
+        except ValueError:
+            pass
+
+    def update_bytes(self, data):
+        self.bytes_data = bytes(data)
+        if self.render_frame():
+            self.update() # Trigger a repaint
+
+    def resizeEvent(self, event):
+        # Cell size depends on the widget size, so cached glyphs are stale
+        self.frame = None
+        self.render_frame()
+        super().resizeEvent(event)
+
+    def layout_cells(self):
+        """Returns (cell_w, cell_h, shape_size) for the current size and data length."""
+        rows = (len(self.bytes_data) + self.cols - 1) // self.cols
+        available_w = self.width() - 2 * self.MARGIN
+        available_h = self.height() - 2 * self.MARGIN
+        cell_w = available_w / self.cols
+        cell_h = available_h / rows
+        # Size of the shape within the cell
+        shape_size = min(cell_w, cell_h) * 0.85
+        return cell_w, cell_h, shape_size
+
+    def glyph(self, byte, size, dpr):
+        pixmap = self.glyphs.get(byte)
+        if pixmap is None:
+            pixmap = QPixmap(max(1, int(size * dpr)), max(1, int(size * dpr)))
+            pixmap.setDevicePixelRatio(dpr)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            p = QPainter(pixmap)
+            p.setRenderHint(QPainter.RenderHint.Antialiasing)
+            p.setBrush(QBrush(self.palette_colors[byte]))
+            p.setPen(Qt.PenStyle.NoPen)
+            # Draw a circle for each byte
+            p.drawEllipse(0, 0, size, size)
+            p.end()
+            self.glyphs[byte] = pixmap
+        return pixmap
+
+    def render_frame(self):
+        """Brings the off-screen frame up to date; returns True if anything changed."""
+        if not self.bytes_data:
+            return False
+        cell_w, cell_h, shape_size = self.layout_cells()
+        size = int(shape_size)
+        if size <= 0:
+            return False
+        dpr = self.devicePixelRatioF()
+
+        key = (self.width(), self.height(), len(self.bytes_data), dpr)
+        if self.frame is None or key != self.geometry_key:
+            self.geometry_key = key
+            self.glyphs = {}
+            self.frame = QImage(int(self.width() * dpr), int(self.height() * dpr),
+                                QImage.Format.Format_ARGB32_Premultiplied)
+            self.frame.setDevicePixelRatio(dpr)
+            self.frame.fill(Qt.GlobalColor.transparent)
+            self.drawn = [None] * len(self.bytes_data)
+
+        painter = QPainter(self.frame)
+        # Source mode: each glyph fully replaces the square it covers
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        changed = False
+        for i, byte in enumerate(self.bytes_data):
+            if self.drawn[i] == byte:
+                continue
+            row = i // self.cols
+            col = i % self.cols
+            x = self.MARGIN + col * cell_w + (cell_w - shape_size) / 2
+            y = self.MARGIN + row * cell_h + (cell_h - shape_size) / 2
+            painter.drawPixmap(int(x), int(y), self.glyph(byte, size, dpr))
+            self.drawn[i] = byte
+            changed = True
+        painter.end()
+        return changed
+
+    def paintEvent(self, event):
+        if self.frame is None:
+            return
+        painter = QPainter(self)
+        painter.drawImage(0, 0, self.frame)
+
+class HistoryChart(QWidget):
+    """
+    Rolling H_min and range charts over a history.History.
+
+    Each repaint asks the history for the visible span in at most one point
+    per pixel column, so the cost depends on the widget width, not on how
+    many batches the span holds. Decimated buckets are drawn as a min/max
+    envelope (one vertical line per bucket) with the mean on top.
+    """
+    SPANS = [("1 min", 60), ("10 min", 600), ("1 h", 3600), ("6 h", 6 * 3600), ("All", None)]
+    MARGIN = 40
+    # (label, Series field prefix, lowest axis maximum, colour); an axis grows to
+    # the history's peak, e.g. H_min up to 10 at a batch size of 1024
+    PANELS = [("H_min", "h_min", 8.0, QColor("#2a7fd4")), ("R", "range", 4096.0, QColor("#d4782a"))]
+
+    def __init__(self, history):
+        super().__init__()
+        self.history = history
+        self.span = self.SPANS[1][1]
+        self.setMinimumHeight(180)
+
+    def set_span(self, index):
+        self.span = self.SPANS[index][1]
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#fafafa"))
+        extent = self.history.time_span()
+        if extent is None:
+            painter.setPen(QColor("#888"))
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "No batches yet")
+            return
+        end = max(extent[1], time.time())
+        start = extent[0] if self.span is None else end - self.span
+        plot_w = max(1, self.width() - self.MARGIN - 10)
+        series = self.history.window(start, end + 1e-3, plot_w)
+
+        panel_h = (self.height() - 10) / len(self.PANELS)
+        for i, (label, field, top, colour) in enumerate(self.PANELS):
+            top = max(top, math.ceil(getattr(self.history, field + "_peak")))
+            rect = QRectF(self.MARGIN, 5 + i * panel_h, plot_w, panel_h - 10)
+            self.draw_panel(painter, rect, series, field, top, colour, start, end)
+            painter.setPen(QColor("#555"))
+            painter.drawText(QRectF(0, rect.top(), self.MARGIN - 4, 14),
+                             Qt.AlignmentFlag.AlignRight, f"{top:g}")
+            painter.drawText(QRectF(0, rect.bottom() - 14, self.MARGIN - 4, 14),
+                             Qt.AlignmentFlag.AlignRight, "0")
+            painter.drawText(QRectF(0, rect.center().y() - 7, self.MARGIN - 4, 14),
+                             Qt.AlignmentFlag.AlignRight, label)
+        painter.end()
+
+    def draw_panel(self, painter, rect, series, field, top, colour, start, end):
+        painter.setPen(QColor("#ccc"))
+        painter.drawRect(rect)
+        if not len(series.t):
+            return
+        # Pixel coordinates for the whole series at once
+        x = rect.left() + (series.t - start) * (rect.width() / max(end - start, 1e-9))
+        scale = rect.height() / top
+        lo = rect.bottom() - getattr(series, field + "_lo").clip(0, top) * scale
+        hi = rect.bottom() - getattr(series, field + "_hi").clip(0, top) * scale
+        mean = rect.bottom() - getattr(series, field + "_mean").clip(0, top) * scale
+        x, lo, hi, mean = x.tolist(), lo.tolist(), hi.tolist(), mean.tolist()
+
+        if series.level:
+            envelope = QColor(colour)
+            envelope.setAlpha(90)
+            painter.setPen(QPen(envelope, 1))
+            painter.drawLines([QLineF(a, b, a, c) for a, b, c in zip(x, lo, hi)])
+        painter.setPen(QPen(colour, 1.5))
+        painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(x, mean)]))
+
+
+class MainWindow(QMainWindow):
+    def __init__(self, worker):
+        super().__init__()
+        self.setWindowTitle("Entropy Source Visualizer")
+        self.resize(900, 700)
+        
+        # Main layout container
+        central = QWidget()
+        self.setCentralWidget(central)
+        layout = QVBoxLayout(central)
+        layout.setSpacing(15)
+        
+        # --- Header Stats Section ---
+        stats_layout = QHBoxLayout()
+        self.lbl_hmin = QLabel("H_min: --")
+        self.lbl_r = QLabel("R: --")
+        
+        # Styling for stats
+        style = """
+            QLabel {
+                font-size: 18px; 
+                font-weight: bold; 
+                color: #333; 
+                padding: 10px; 
+                background: #e0e0e0; 
+                border-radius: 5px;
+                border: 1px solid #ccc;
+            }
+        """
+        for lbl in [self.lbl_hmin, self.lbl_r]:
+            lbl.setStyleSheet(style)
+            stats_layout.addWidget(lbl)
+        
+        stats_layout.addStretch()
+        layout.addLayout(stats_layout)
+
+        # Pipeline telemetry from the firmware (TELEMETRY_INTERVAL_MS)
+        self.lbl_tlm = QLabel("Pipeline: waiting for telemetry")
+        self.lbl_tlm.setStyleSheet("font-family: Monospace; font-size: 11px; color: #555;")
+        layout.addWidget(self.lbl_tlm)
+
+        # Host-side ingest vs display rate
+        self.lbl_rate = QLabel("Records/sec: --")
+        self.lbl_rate.setStyleSheet("font-family: Monospace; font-size: 11px; color: #555;")
+        layout.addWidget(self.lbl_rate)
+
+        # --- Controls Section ---
+        controls_layout = QHBoxLayout()
+        
+        self.btn_manual = QPushButton("Plot Manual Data")
+        self.btn_manual.clicked.connect(self.plot_manual)
+        
+        self.spin_runs = QSpinBox()
+        self.spin_runs.setRange(1, 1000)
+        self.spin_runs.setValue(10)
+        self.spin_runs.setPrefix("Runs: ")
+        
+        self.btn_burst = QPushButton("Go")
+        self.btn_burst.clicked.connect(self.start_burst)
+        
+        self.btn_cont = QPushButton("Start Continuous")
+        self.btn_cont.setCheckable(True)
+        self.btn_cont.clicked.connect(self.toggle_continuous)
+        
+        controls_layout.addWidget(self.btn_manual)
+        controls_layout.addStretch()
+        controls_layout.addWidget(self.spin_runs)
+        controls_layout.addWidget(self.btn_burst)
+        controls_layout.addWidget(self.btn_cont)
+        
+        layout.addLayout(controls_layout)
+        
+        # --- Visualization Section ---
+        layout.addWidget(QLabel("<b>Geometric Interpretation (Byte Map):</b>"))
+        self.viz = VisualizerWidget()
+        layout.addWidget(self.viz, 1) # Stretch factor 1 to fill space
+        
+        # --- Raw Data Section ---
+        layout.addWidget(QLabel("<b>Raw Hex Data:</b>"))
+        self.txt_raw = QTextEdit()
+        self.txt_raw.setMaximumHeight(80)
+        self.txt_raw.setReadOnly(False)
+        self.txt_raw.setStyleSheet("font-family: Monospace; font-size: 11px; color: #555; background: #f9f9f9;")
+        layout.addWidget(self.txt_raw)
+
+        # --- Record source (display.SerialWorker, started by run_gui) ---
+        self.worker = worker
+        if worker.history is None:
+            worker.history = History(HISTORY_BATCHES)
+
+        # --- History Section ---
+        history_layout = QHBoxLayout()
+        history_layout.addWidget(QLabel("<b>History:</b>"))
+        self.combo_span = QComboBox()
+        self.combo_span.addItems([name for name, _ in HistoryChart.SPANS])
+        self.combo_span.setCurrentIndex(1)
+        history_layout.addWidget(self.combo_span)
+        history_layout.addStretch()
+        self.btn_export = QPushButton("Export History")
+        self.btn_export.clicked.connect(self.export_history)
+        history_layout.addWidget(self.btn_export)
+        layout.addLayout(history_layout)
+
+        self.chart = HistoryChart(worker.history)
+        self.combo_span.currentIndexChanged.connect(self.chart.set_span)
+        layout.addWidget(self.chart)
+        
+        # State
+        self.continuous = False
+        self.burst_remaining = 0
+        self.displayed = 0
+        self.shown_telemetry = None
+        self.rate_mark = (time.monotonic(), 0, 0, 0)
+
+        # --- Frame-rate capped refresh ---
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(int(1000 / UI_FPS))
+        self.chart_timer = QTimer(self)
+        self.chart_timer.timeout.connect(self.chart.update)
+        self.chart_timer.start(int(1000 / CHART_FPS))
+        
+        # Initialize holding pattern
+        default_hex = "c4e441871b5f1dd50dd7915b89c1733fcc62f548f453545ee48d59d63a9dbedc8f75685116a81a72cb02fec716770278118765126f63281ff2a5c9aab755ced927db67e613d96552e8febee2cf19bddd2ec2cccb543055ed3159287d30de38aa7fb01bae71ba02c326502010ead442263c18aecb1fa2c87aa1c1d5883d1c3b6e"
+        self.txt_raw.setText(default_hex)
+        self.plot_manual()
+
+    def plot_manual(self):
+        data = self.txt_raw.toPlainText().replace('\n', '').replace(' ', '')
+        # self.viz.update_data(data)
+        self.viz.update_data(logeaux)
+
+    def start_burst(self):
+        self.burst_remaining = self.spin_runs.value()
+        self.continuous = False
+        self.btn_cont.setChecked(False)
+        self.btn_cont.setText("Start Continuous")
+
+    def toggle_continuous(self, checked):
+        self.continuous = checked
+        if checked:
+            self.btn_cont.setText("Stop Continuous")
+            self.burst_remaining = 0
+        else:
+            self.btn_cont.setText("Start Continuous")
+
+    def refresh(self):
+        """Drains the worker's buffer and shows the newest accepted record, once per frame."""
+        latest = None
+        for record in self.worker.drain():
+            if not self.continuous and self.burst_remaining <= 0:
+                continue
+            if self.burst_remaining > 0:
+                self.burst_remaining -= 1
+            latest = record
+        if latest is not None:
+            self.show_record(latest)
+
+        if self.worker.telemetry is not self.shown_telemetry:
+            self.shown_telemetry = self.worker.telemetry
+            self.on_telemetry(self.shown_telemetry)
+
+        self.update_rates()
+
+    def show_record(self, record):
+        """Updates the UI with one batch record."""
+        self.lbl_hmin.setText(f"H_min: {record.h_min:.4f}")
+        self.lbl_r.setText(f"R: {record.range}")
+        self.txt_raw.setText(record.digest.hex())
+        
+        # Update Visualization
+        self.viz.update_bytes(record.digest)
+        self.displayed += 1
+
+    def update_rates(self):
+        now = time.monotonic()
+        t0, ingested0, displayed0, overflowed0 = self.rate_mark
+        if now - t0 < 1.0:
+            return
+        ingested = self.worker.ingested
+        overflowed = self.worker.overflowed
+        dt = now - t0
+        self.lbl_rate.setText(f"Records/sec: {(ingested - ingested0) / dt:.1f} ingested, "
+                              f"{(self.displayed - displayed0) / dt:.1f} displayed, "
+                              f"{overflowed - overflowed0} dropped from buffer")
+        self.rate_mark = (now, ingested, self.displayed, overflowed)
+
+    def export_history(self):
+        """Saves the retained history (visible span or not) as a .qcap capture."""
+        path, _ = QFileDialog.getSaveFileName(self, "Export History", "history.qcap",
+                                              "Captures (*.qcap)")
+        if not path:
+            return
+        try:
+            count = self.worker.history.export(path)
+        except (OSError, ValueError) as e:
+            self.statusBar().showMessage(f"Export failed: {e}", 5000)
+            return
+        self.statusBar().showMessage(f"Exported {count} batches to {path}", 5000)
+
+    def on_telemetry(self, record):
+        """Shows the latest pipeline counters, regardless of burst/continuous mode."""
+        self.lbl_tlm.setText(f"Pipeline: {protocol.format_telemetry(record)}")
+
+    def closeEvent(self, event):
+        """Clean up thread on close."""
+        self.worker.stop()
+        if self.worker.is_alive():
+            self.worker.join()
+        event.accept()
+
+
+def run_gui(worker, argv):
+    """Opens the window on worker's records and runs the Qt event loop."""
+    app = QApplication(argv)
+    
+    # Set a clean fusion style
+    app.setStyle("Fusion")
+    
+    window = MainWindow(worker)
+    window.show()
+    worker.start()
+    return app.exec()
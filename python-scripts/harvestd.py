@@ -0,0 +1,284 @@
+"""
+Headless entropy harvesting daemon.
+
+Reads batches from the generator (serial, a replayed capture or the mock
+source), keeps the digest bytes of every unsquelched batch in a fixed-size
+preallocated ring buffer and serves them to local clients over a Unix socket.
+
+Socket protocol (one command per line):
+
+    GET <n>     -> exactly n pool bytes (waits until they are available)
+    STATS       -> one line of JSON with pool and backpressure statistics
+
+Example:
+
+    python harvestd.py --source mock --socket /tmp/qrng.sock
+    python harvestd.py --get 64 --socket /tmp/qrng.sock | xxd
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import protocol
+from rawcapture import RawCaptureWriter
+
+DEFAULT_SOCKET = "/tmp/qrng.sock"
+DEFAULT_POOL_SIZE = 1 << 20   # 1 MiB of harvested digest bytes
+MAX_REQUEST = 1 << 20         # Largest single GET a client may issue
+
+
+class RingBuffer:
+    """
+    Fixed-capacity byte FIFO backed by one preallocated bytearray.
+
+    The producer never blocks: when the pool is full, incoming bytes are
+    dropped and counted, which is the backpressure signal for operators.
+    Readers can block until enough bytes are available.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buf = bytearray(capacity)
+        self.head = 0            # Next byte to read
+        self.size = 0            # Bytes currently stored
+        self.cond = threading.Condition()
+
+        # Statistics
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_dropped = 0
+        self.high_water = 0
+        self.waits = 0
+
+    def write(self, data):
+        with self.cond:
+            n = min(len(data), self.capacity - self.size)
+            if n < len(data):
+                self.bytes_dropped += len(data) - n
+            if n:
+                tail = (self.head + self.size) % self.capacity
+                first = min(n, self.capacity - tail)
+                self.buf[tail:tail + first] = data[:first]
+                self.buf[:n - first] = data[first:n]
+                self.size += n
+                self.bytes_in += n
+                self.high_water = max(self.high_water, self.size)
+                self.cond.notify_all()
+            return n
+
+    def read(self, n, timeout=None):
+        """Returns exactly n bytes, or fewer if the timeout expires first."""
+        n = min(n, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            if self.size < n:
+                self.waits += 1
+            while self.size < n:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    n = self.size
+                    break
+                self.cond.wait(remaining)
+
+            first = min(n, self.capacity - self.head)
+            out = bytes(self.buf[self.head:self.head + first]) + bytes(self.buf[:n - first])
+            self.head = (self.head + n) % self.capacity
+            self.size -= n
+            self.bytes_out += n
+            return out
+
+    def stats(self):
+        with self.cond:
+            return {
+                "capacity": self.capacity,
+                "level": self.size,
+                "high_water": self.high_water,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_dropped": self.bytes_dropped,
+                "reader_waits": self.waits,
+            }
+
+
+def pool_bytes(record, config):
+    """The part of a batch's digest that may go into a pool, or None for a squelched batch."""
+    if record.h_min <= 0.0:
+        # Squelched batch (range too small), not safe to use
+        return None
+    if config is None or config.conditioning == protocol.COND_LEGACY:
+        # Legacy batches are digest || hash(digest); the second half adds no entropy
+        return record.digest[:len(record.digest) // 2]
+    # Already credit-conditioned on the device
+    return record.digest
+
+
+class Harvester(threading.Thread):
+    """Pulls records from a source iterator into the pool."""
+    def __init__(self, records, pool, raw_writer=None):
+        super().__init__(daemon=True)
+        self.records = records
+        self.pool = pool
+        self.raw_writer = raw_writer
+        self.batches = 0
+        self.squelched = 0
+        self.health_events = 0
+        self.telemetry = None
+        self.config = None
+        self.started = time.monotonic()
+
+    def run(self):
+        for record in self.records:
+            if isinstance(record, protocol.RawRecord):
+                if self.raw_writer is not None:
+                    self.raw_writer.write(record)
+                continue
+            if isinstance(record, protocol.TelemetryRecord):
+                self.telemetry = record
+                continue
+            if isinstance(record, protocol.ConfigRecord):
+                self.config = record
+                continue
+            if isinstance(record, protocol.HealthRecord):
+                # Batch suppressed on the device by a health test
+                self.health_events += 1
+                continue
+            if not isinstance(record, protocol.BatchRecord):
+                continue
+            self.batches += 1
+            data = pool_bytes(record, self.config)
+            if data is None:
+                self.squelched += 1
+                continue
+            self.pool.write(data)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        stats = self.pool.stats()
+        stats.update({
+            "batches": self.batches,
+            "squelched": self.squelched,
+            "health_events": self.health_events,
+            "uptime_s": round(elapsed, 1),
+            "in_rate_Bps": round(stats["bytes_in"] / elapsed, 1) if elapsed else 0.0,
+        })
+        if self.telemetry is not None:
+            stats["device"] = self.telemetry._asdict()
+        if self.config is not None:
+            stats["config"] = self.config._asdict()
+        return stats
+
+
+class PoolRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            cmd = line.decode("ascii", errors="ignore").split()
+            if not cmd:
+                continue
+            if cmd[0] == "GET" and len(cmd) == 2 and cmd[1].isdigit():
+                n = min(int(cmd[1]), MAX_REQUEST)
+                self.wfile.write(self.server.pool.read(n))
+            elif cmd[0] == "STATS":
+                self.wfile.write((json.dumps(self.server.harvester.stats()) + "\n").encode())
+            else:
+                self.wfile.write(b"ERR unknown command\n")
+            self.wfile.flush()
+
+
+class PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pool, harvester):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, PoolRequestHandler)
+        os.chmod(path, 0o660)
+        self.pool = pool
+        self.harvester = harvester
+
+
+def get_bytes(n, path=DEFAULT_SOCKET):
+    """Client helper: fetch n bytes from a running daemon."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(f"GET {n}\n".encode())
+        chunks = []
+        remaining = n
+        while remaining:
+            chunk = sock.recv(min(remaining, 65536))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+
+def make_source(args):
+    if args.source == "serial":
+        commands = [protocol.config_command(*setting.split("=")) for setting in args.set]
+        return protocol.serial_records(args.port, args.baud, args.protocol, commands=commands)
+    if args.source == "replay":
+        return protocol.replay_records(args.replay, args.protocol, rate=args.rate, loop=True)
+    if args.source == "capture":
+        import capture
+        return capture.replay_capture(args.replay, speed=args.speed)
+    return protocol.mock_records(rate=args.rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless QRNG entropy harvesting daemon")
+    parser.add_argument("--source", choices=("serial", "replay", "capture", "mock"), default="serial")
+    parser.add_argument("--port", default="/dev/ttyACM0")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text")
+    parser.add_argument("--replay", help="serial byte dump (--source replay) or .qcap file (--source capture)")
+    parser.add_argument("--rate", type=float, default=10,
+                        help="batches/s for mock and replay sources (0 = as fast as possible)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="capture replay speed (1.0 = original timing, 0 = as fast as possible)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="device setting sent on connect: batch_size, lag_depth or window (repeatable)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument("--raw-capture", metavar="FILE",
+                        help="also record raw sample frames (firmware STREAM_RAW) to a packed capture")
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    parser.add_argument("--get", type=int, metavar="N",
+                        help="client mode: write N bytes from a running daemon to stdout")
+    args = parser.parse_args()
+
+    if args.get is not None:
+        sys.stdout.buffer.write(get_bytes(args.get, args.socket))
+        return
+
+    if args.source in ("replay", "capture") and not args.replay:
+        parser.error(f"--source {args.source} needs --replay FILE")
+
+    pool = RingBuffer(args.pool_size)
+    raw_writer = RawCaptureWriter(args.raw_capture) if args.raw_capture else None
+    harvester = Harvester(make_source(args), pool, raw_writer)
+    harvester.start()
+
+    server = PoolServer(args.socket, pool, harvester)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {args.source} entropy on {args.socket}")
+
+    try:
+        while harvester.is_alive():
+            harvester.join(args.stats_interval)
+            print(json.dumps(harvester.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.unlink(args.socket)
+        if raw_writer is not None:
+            raw_writer.close()
+
+
+if __name__ == "__main__":
+    main()
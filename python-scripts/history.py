@@ -0,0 +1,232 @@
+"""
+Fixed-memory per-batch history of H_min and range, for display.py's charts.
+
+Every batch's (timestamp, seq, H_min, range) goes into one preallocated
+NumPy ring of `capacity` entries (18 bytes each, so the default half a
+million batches, about 14 hours at 10 batches/s, is 9 MiB). On top sit
+LEVELS coarser rings: a bucket of level l summarises FACTOR buckets of
+level l-1 (min, max and mean of H_min and range, first and last
+timestamp), rolled up as soon as the batches below it are complete.
+
+window() answers a chart's question, "this time span in at most N points",
+from the finest level that fits in N, plus the incomplete newest bucket
+aggregated on the spot. A repaint therefore costs about as much for six
+hours of history as for the last minute, and the full-resolution samples
+are still there when the span is short enough to show them.
+
+export() writes the samples in a time range to a capture (.qcap) that
+capture.py, harvestd.py and display.py --source replay can open. The history
+keeps no digests, so the capture's digest size is 0.
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+CAPACITY = 1 << 19           # Full-resolution batches kept
+FACTOR = 16                  # Batches per bucket, and buckets per bucket of the next level
+LEVELS = 4                   # Buckets of 16, 256, 4096 and 65536 batches
+
+SAMPLE_DTYPE = np.dtype([("timestamp", "<f8"), ("seq", "<u4"), ("h_min", "<f4"), ("range", "<u2")])
+BUCKET_DTYPE = np.dtype([("t0", "<f8"), ("t1", "<f8"),
+                         ("h_min_lo", "<f4"), ("h_min_hi", "<f4"), ("h_min_mean", "<f4"),
+                         ("range_lo", "<f4"), ("range_hi", "<f4"), ("range_mean", "<f4")])
+
+# What window() returns: bucket mid times and per-bucket envelopes, plus the level used (0 = raw)
+Series = namedtuple("Series", "t h_min_lo h_min_hi h_min_mean range_lo range_hi range_mean level")
+
+
+def ring_slice(ring, start, stop):
+    """Copy of absolute entries start..stop of a ring (entry i lives at i % len(ring))."""
+    size, n = len(ring), stop - start
+    if n <= 0:
+        return ring[:0].copy()
+    a = start % size
+    if a + n <= size:
+        return ring[a:a + n].copy()
+    return np.concatenate((ring[a:], ring[:a + n - size]))
+
+
+def summarize_samples(rows, width):
+    """Buckets of `width` consecutive samples (len(rows) a multiple of width)."""
+    groups = rows.reshape(-1, width)
+    out = np.zeros(len(groups), dtype=BUCKET_DTYPE)
+    out["t0"] = groups["timestamp"][:, 0]
+    out["t1"] = groups["timestamp"][:, -1]
+    for name in ("h_min", "range"):
+        values = groups[name].astype(np.float32)
+        out[name + "_lo"] = values.min(axis=1)
+        out[name + "_hi"] = values.max(axis=1)
+        out[name + "_mean"] = values.mean(axis=1)
+    return out
+
+
+def summarize_buckets(rows, width):
+    """Buckets of `width` consecutive buckets; all full, so the means weigh equally."""
+    groups = rows.reshape(-1, width)
+    out = np.zeros(len(groups), dtype=BUCKET_DTYPE)
+    out["t0"] = groups["t0"][:, 0]
+    out["t1"] = groups["t1"][:, -1]
+    for name in ("h_min", "range"):
+        out[name + "_lo"] = groups[name + "_lo"].min(axis=1)
+        out[name + "_hi"] = groups[name + "_hi"].max(axis=1)
+        out[name + "_mean"] = groups[name + "_mean"].mean(axis=1)
+    return out
+
+
+class History:
+    """
+    Thread-safe: the serial worker appends while the GUI thread reads
+    windows, each under one short lock.
+    """
+    def __init__(self, capacity=CAPACITY, factor=FACTOR, levels=LEVELS):
+        self.capacity = capacity
+        self.factor = factor
+        self.samples = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.count = 0               # Samples ever appended
+        # Each level keeps about the same time span as the samples
+        self.levels = [np.zeros(max(2, capacity // factor ** l), dtype=BUCKET_DTYPE)
+                       for l in range(1, levels + 1)]
+        self.level_counts = [0] * levels
+        self.last_time = float("-inf")
+        # Largest values ever appended, for chart axes (H_min goes up to log2(batch size))
+        self.h_min_peak = 0.0
+        self.range_peak = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, seq, h_min, dynamic_range):
+        with self.lock:
+            # Host clock steps backwards must not break the time order searches rely on
+            timestamp = max(timestamp, self.last_time)
+            self.last_time = timestamp
+            self.samples[self.count % self.capacity] = (timestamp, seq, h_min, dynamic_range)
+            self.h_min_peak = max(self.h_min_peak, float(h_min))
+            self.range_peak = max(self.range_peak, int(dynamic_range))
+            self.count += 1
+            if self.count % self.factor == 0:
+                self._roll_up()
+
+    def extend(self, timestamps, seqs, h_mins, ranges):
+        """Appends many samples at once (arrays of equal length)."""
+        n = len(timestamps)
+        if not n:
+            return
+        with self.lock:
+            timestamps = np.maximum.accumulate(np.maximum(np.asarray(timestamps, dtype=np.float64),
+                                                          self.last_time))
+            # Only the last `capacity` can be kept
+            keep = slice(max(0, n - self.capacity), n)
+            index = (self.count + np.arange(n)[keep]) % self.capacity
+            self.samples["timestamp"][index] = timestamps[keep]
+            self.samples["seq"][index] = np.asarray(seqs)[keep]
+            self.samples["h_min"][index] = np.asarray(h_mins)[keep]
+            self.samples["range"][index] = np.asarray(ranges)[keep]
+            self.count += n
+            self.last_time = float(timestamps[-1])
+            self.h_min_peak = max(self.h_min_peak, float(np.max(h_mins)))
+            self.range_peak = max(self.range_peak, int(np.max(ranges)))
+            self._roll_up()
+
+    def _roll_up(self):
+        """
+        Fills every bucket whose inputs are now complete, level by level.
+        Each level's new buckets are handed straight to the next, so a big
+        extend() never has to read back entries it has just overwritten.
+        """
+        f = self.factor
+        # Inputs of level 1: samples from its first unfilled bucket on (or the oldest kept)
+        first = max(self.level_counts[0], -(-max(0, self.count - self.capacity) // f)) * f
+        inputs = ring_slice(self.samples, first, self.count)
+        summarize = summarize_samples
+        for l, ring in enumerate(self.levels):
+            usable = len(inputs) // f * f
+            if not usable:
+                break
+            summary = summarize(inputs[:usable], f)
+            old_count, new_first = self.level_counts[l], first // f
+            new_count = new_first + len(summary)
+
+            if l + 1 < len(self.levels):
+                # Next level's partial bucket so far, read before this level's ring is overwritten
+                kept = new_first if old_count < new_first else max(0, old_count - len(ring))
+                first = max(self.level_counts[l + 1] * f, -(-kept // f) * f)
+                inputs = np.concatenate((ring_slice(ring, first, new_first),
+                                         summary[max(0, first - new_first):]))
+
+            tail = summary[-len(ring):]
+            ring[np.arange(new_count - len(tail), new_count) % len(ring)] = tail
+            self.level_counts[l] = new_count
+            summarize = summarize_buckets
+
+    def _oldest(self):
+        return max(0, self.count - self.capacity)
+
+    def _search(self, t):
+        """Absolute index of the first retained sample with timestamp >= t."""
+        times = self.samples["timestamp"]
+        if self.count <= self.capacity:
+            return int(np.searchsorted(times[:self.count], t))
+        # Wrapped: the ring is two sorted runs, oldest first from count % capacity
+        split = self.count % self.capacity
+        older = times[split:]
+        oldest = self.count - self.capacity
+        if t <= older[-1]:
+            return oldest + int(np.searchsorted(older, t))
+        return oldest + len(older) + int(np.searchsorted(times[:split], t))
+
+    def time_span(self):
+        """(first, last) retained timestamps, or None when empty."""
+        with self.lock:
+            if not self.count:
+                return None
+            return (float(self.samples["timestamp"][self._oldest() % self.capacity]),
+                    float(self.samples["timestamp"][(self.count - 1) % self.capacity]))
+
+    def window(self, start, end, max_points):
+        """
+        Series covering start <= timestamp < end in at most about max_points
+        buckets (one more for the partial newest bucket at coarse levels).
+        """
+        with self.lock:
+            a = self._search(start)
+            b = self._search(end)
+            n = b - a
+            level = 0
+            while level < len(self.levels) and n > max_points * self.factor ** level:
+                level += 1
+            if level == 0:
+                rows = ring_slice(self.samples, a, b)
+                h, r = rows["h_min"].astype(np.float32), rows["range"].astype(np.float32)
+                return Series(rows["timestamp"], h, h, h, r, r, r, 0)
+
+            width = self.factor ** level
+            ring = self.levels[level - 1]
+            complete = self.level_counts[level - 1]
+            first = max(a // width, complete - len(ring))
+            last = min(-(-b // width), complete)
+            buckets = ring_slice(ring, first, last)
+            # The newest batches haven't filled a bucket yet: summarise them directly
+            tail_start = max(last * width, a)
+            if b > tail_start:
+                rows = ring_slice(self.samples, tail_start, b)
+                buckets = np.concatenate((buckets, summarize_samples(rows, len(rows))))
+        return Series((buckets["t0"] + buckets["t1"]) / 2,
+                      buckets["h_min_lo"], buckets["h_min_hi"], buckets["h_min_mean"],
+                      buckets["range_lo"], buckets["range_hi"], buckets["range_mean"], level)
+
+    def export(self, path, start=None, end=None):
+        """Writes the retained samples in [start, end) to a .qcap capture. Returns the number written."""
+        import capture
+        with self.lock:
+            a = self._search(start) if start is not None else self._oldest()
+            b = self._search(end) if end is not None else self.count
+            rows = ring_slice(self.samples, a, b)
+        out = np.zeros(len(rows), dtype=capture.record_dtype(0, 0))
+        for name in ("timestamp", "seq", "h_min", "range"):
+            out[name] = rows[name]
+        with capture.CaptureWriter(path, digest_size=0) as writer:
+            writer.write_array(out)
+        return len(out)
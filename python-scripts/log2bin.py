@@ -0,0 +1,401 @@
+"""
+Streaming converter from captured text-mode serial logs to binary for `ent`,
+sts.py or `assess`.
+
+The log is read in fixed-size chunks and each chunk is converted with a few
+whole-array NumPy passes: lines are found with one scan for newlines, the
+digest lines are validated and hex-decoded as one (lines x chars) array,
+and squelched headers are spotted from the bytes after `H_min:` without
+parsing floats. Memory use doesn't grow with the log, so multi-gigabyte
+captures convert at close to disk speed.
+
+Only records with the exact firmware structure are kept: a
+`H_min: x | R: y | Data:` header followed by DIGEST_LINES hex lines of the
+stream's digest length (learned from the first record: 64 chars for
+QRNG.py, 128 for main.c), or the single-line form the credit / extract
+conditioning modes print. display.py --headless logs work too: the
+sequence number it puts in front of each record is skipped, and its
+single-line legacy records (both digests joined, so DIGEST_LINES times the
+digest length) are split like the firmware's. `CFG:` lines say which one a
+single-line record is; until one shows up, the length decides. Anything
+else is counted and skipped. Batches with H_min 0 (squelched: floating or
+disconnected input) are dropped. In legacy mode the second digest is only
+SHA256/SHA512 of the first, so --drop-chained keeps just the first one;
+conditioned output has no chained digest and is kept as is.
+
+Usage:
+    python log2bin.py capture.log qrng_dump.bin
+    python log2bin.py capture.log qrng_dump.bin --drop-chained --limit 256000000
+    python display.py --headless --log /dev/stdout | python log2bin.py - - | ent
+    python display.py --headless --log /dev/stdout | python log2bin.py - - --drop-chained --digest-size 64
+    python log2bin.py --check
+"""
+import argparse
+import binascii
+import itertools
+import random
+import re
+import sys
+import time
+
+import numpy as np
+
+import protocol
+
+CHUNK_SIZE = 8 << 20         # Bytes read per pass
+DIGEST_LINES = 2             # Hex lines after a legacy header
+DIGEST_SIZE = 32             # Digest bytes assumed for single-line legacy records until a header shows the real size
+SEQ_DIGITS = 10              # Longest sequence number display.py puts in front of a record
+MAX_LINE = 1 << 20           # A "line" longer than this without a newline is junk
+
+HEADER = np.frombuffer(b"H_min:", dtype=np.uint8)
+DATA_END = np.frombuffer(b"Data:", dtype=np.uint8)
+HMIN_WINDOW = 16             # Bytes after "H_min:" that must hold the value and the first '|'
+INLINE = re.compile(rb"H_min:\s*([0-9.]+)\s*\|\s*R:\s*(\d+)\s*\|\s*Data:\s*(-|[0-9a-fA-F]+)")
+CONFIG = np.frombuffer(b"CFG:", dtype=np.uint8)
+CONDITIONING = re.compile(rb"\bconditioning=(\d+)")
+
+
+def window_rows(arr, starts, width):
+    """(len(starts), width) copy of arr[start:start + width] for each start (all must fit)."""
+    if not len(starts):
+        return np.zeros((0, width), dtype=np.uint8)
+    return np.lib.stride_tricks.sliding_window_view(arr, width)[starts]
+
+
+def is_hex_rows(rows):
+    """True for each row of ASCII bytes that is all hex digits (uint8 wraparound does the range checks)."""
+    digit = (rows - np.uint8(ord("0"))) < 10
+    letter = ((rows | np.uint8(0x20)) - np.uint8(ord("a"))) < 6
+    return (digit | letter).all(axis=1)
+
+
+class LogConverter:
+    """
+    Incremental text-log to binary conversion. feed() takes chunks of any
+    size and returns the output bytes of the records they completed;
+    finish() flushes what is left at end of file.
+    """
+    def __init__(self, drop_chained=False, keep_squelched=False, digest_lines=DIGEST_LINES,
+                 digest_size=DIGEST_SIZE):
+        self.drop_chained = drop_chained
+        self.keep_squelched = keep_squelched
+        self.digest_lines = digest_lines
+        self.digest_size = digest_size
+        self.digest_chars = None
+        self.conditioned = None      # From the last CFG: line; None until one is seen
+        self.tail = b""
+        self.stats = dict(lines=0, batches=0, squelched=0, empty=0, malformed=0, orphans=0, bytes_out=0)
+
+    def feed(self, data):
+        buf = self.tail + data
+        out, used = self._convert(buf, final=False)
+        self.tail = buf[used:]
+        if len(self.tail) > MAX_LINE and b"\n" not in self.tail:
+            self.stats["malformed"] += 1
+            self.tail = b""
+        return out
+
+    def finish(self):
+        out, _ = self._convert(self.tail, final=True)
+        self.tail = b""
+        return out
+
+    def _convert(self, buf, final):
+        """(output bytes, bytes of buf consumed)."""
+        arr = np.frombuffer(buf, dtype=np.uint8)
+        ends = np.flatnonzero(arr == 10)
+        if final and len(arr) and (not len(ends) or ends[-1] != len(arr) - 1):
+            ends = np.append(ends, len(arr))
+        if not len(ends):
+            return b"", 0
+        consumed = min(int(ends[-1]) + 1, len(arr))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+
+        # Trailing CR / spaces aren't part of the line
+        while True:
+            last = arr[np.maximum(ends - 1, 0)]
+            trim = (ends > starts) & ((last == 13) | (last == 32))
+            if not trim.any():
+                break
+            ends = ends - trim
+        line_starts = starts
+
+        # display.py's "<seq> H_min: ..." lines: start those after the number
+        first = arr[np.minimum(starts, len(arr) - 1)]
+        numbered = np.flatnonzero(((first - np.uint8(ord("0"))) < 10)
+                                  & (ends - starts > SEQ_DIGITS + 1 + len(HEADER)))
+        if len(numbered):
+            prefix = window_rows(arr, starts[numbered], SEQ_DIGITS + 1)
+            digits = np.argmin((prefix - np.uint8(ord("0"))) < 10, axis=1)
+            gap = prefix[np.arange(len(numbered)), digits] == ord(" ")
+            numbered, digits = numbered[gap], digits[gap]
+            named = (window_rows(arr, starts[numbered] + digits + 1, len(HEADER)) == HEADER).all(axis=1)
+            starts = starts.copy()
+            starts[numbered[named]] += digits[named] + 1
+        lengths = ends - starts
+
+        header = (lengths >= len(HEADER)) & (arr[np.minimum(starts, len(arr) - 1)] == HEADER[0])
+        header[header] = (window_rows(arr, starts[header], len(HEADER)) == HEADER).all(axis=1)
+        legacy = header & (lengths >= len(HEADER) + len(DATA_END))
+        legacy[legacy] = (window_rows(arr, ends[legacy] - len(DATA_END), len(DATA_END)) == DATA_END).all(axis=1)
+        inline = header & ~legacy
+        config = (lengths >= len(CONFIG)) & (arr[np.minimum(starts, len(arr) - 1)] == CONFIG[0])
+        config[config] = (window_rows(arr, starts[config], len(CONFIG)) == CONFIG).all(axis=1)
+        k = self.digest_lines
+
+        # A legacy record still missing digest lines waits for the next chunk
+        n_lines = len(starts)
+        if not final:
+            waiting = np.flatnonzero(legacy & (np.arange(n_lines) + k >= n_lines))
+            if len(waiting):
+                n_lines = int(waiting[0])
+                consumed = int(line_starts[n_lines])
+                starts, ends, lengths = starts[:n_lines], ends[:n_lines], lengths[:n_lines]
+                header, legacy = header[:n_lines], legacy[:n_lines]
+                inline, config = inline[:n_lines], config[:n_lines]
+        self.stats["lines"] += n_lines
+
+        heads = np.flatnonzero(legacy)
+        if self.digest_chars is None and len(heads) and heads[0] + 1 < n_lines:
+            chars = int(lengths[heads[0] + 1])
+            if chars and chars % 2 == 0:
+                self.digest_chars = chars
+
+        # Every line that could be a digest: right length, hex throughout
+        chars = self.digest_chars or 2
+        candidates = np.flatnonzero(lengths == chars) if self.digest_chars else np.zeros(0, dtype=np.int64)
+        rows = window_rows(arr, starts[candidates], chars)
+        # Decoding all of them at once doubles as the check; only a failure needs the per-line one
+        try:
+            valid = np.ones(len(rows), dtype=bool)
+            values = np.frombuffer(binascii.unhexlify(rows.tobytes()), dtype=np.uint8)
+        except binascii.Error:
+            valid = is_hex_rows(rows)
+            values = np.zeros(len(rows) * chars // 2, dtype=np.uint8)
+            values.reshape(len(rows), -1)[valid] = np.frombuffer(
+                binascii.unhexlify(rows[valid].tobytes()), dtype=np.uint8).reshape(-1, chars // 2)
+        values = values.reshape(len(rows), chars // 2)
+        row_of = np.zeros(n_lines, dtype=np.int64)
+        row_of[candidates] = np.arange(len(candidates))
+        is_hex = np.zeros(n_lines, dtype=bool)
+        is_hex[candidates] = valid
+
+        # Hex lines that no header accounts for (e.g. a log that starts mid-record)
+        claimed = np.zeros(n_lines + k, dtype=bool)
+        for j in range(1, k + 1):
+            claimed[heads + j] = True
+        self.stats["orphans"] += int(np.count_nonzero(is_hex & ~claimed[:n_lines]))
+
+        complete = heads + k < n_lines
+        self.stats["malformed"] += int(np.count_nonzero(~complete))
+        heads = heads[complete]
+        ok = np.ones(len(heads), dtype=bool)
+        for j in range(1, k + 1):
+            ok &= is_hex[heads + j]
+        self.stats["malformed"] += int(np.count_nonzero(~ok))
+        heads = heads[ok]
+
+        # Squelched: no digit 1-9 in the H_min value (everything before the first '|')
+        # (heads are followed by digest lines, so the window never runs off the buffer)
+        value = window_rows(arr, np.minimum(starts[heads] + len(HEADER), len(arr) - HMIN_WINDOW), HMIN_WINDOW)
+        pipe = value == ord("|")
+        before = np.cumsum(pipe, axis=1) == 0
+        nonzero = ((value >= ord("1")) & (value <= ord("9")) & before).any(axis=1)
+        bad = ~pipe.any(axis=1)
+        self.stats["malformed"] += int(np.count_nonzero(bad))
+        squelched = ~nonzero & ~bad
+        self.stats["squelched"] += int(np.count_nonzero(squelched))
+        heads = heads[~bad & (self.keep_squelched | ~squelched)]
+        self.stats["batches"] += len(heads)
+
+        take = 1 if self.drop_chained else k
+        digest_lines = (heads[:, None] + np.arange(1, take + 1)).ravel()
+        decoded = values[row_of[digest_lines]].reshape(len(heads), take * chars // 2)
+
+        inline_lines = np.flatnonzero(inline | config)
+        if not len(inline_lines):
+            out = decoded.tobytes()
+        else:
+            # Conditioned output is one line per batch, so this part goes line by line
+            pieces = [(int(h), row.tobytes()) for h, row in zip(heads, decoded)]
+            for i in inline_lines:
+                line = buf[starts[i]:ends[i]]
+                if config[i]:
+                    setting = CONDITIONING.search(line)
+                    if setting:
+                        self.conditioned = int(setting.group(1)) != 0
+                    continue
+                match = INLINE.fullmatch(line)
+                if not match:
+                    self.stats["malformed"] += 1
+                    continue
+                if float(match.group(1)) == 0 and not self.keep_squelched:
+                    self.stats["squelched"] += 1
+                    continue
+                self.stats["batches"] += 1
+                if match.group(3) == b"-":
+                    self.stats["empty"] += 1
+                    continue
+                data = bytes.fromhex(match.group(3).decode())
+                # Both legacy digests on one line (display.py): the second is chained
+                size = self.digest_chars // 2 if self.digest_chars else self.digest_size
+                if self.drop_chained and not self.conditioned and len(data) == k * size:
+                    data = data[:size]
+                pieces.append((int(i), data))
+            pieces.sort(key=lambda piece: piece[0])
+            out = b"".join(piece for _, piece in pieces)
+
+        self.stats["bytes_out"] += len(out)
+        return out, consumed
+
+
+def convert(src, dst, converter, chunk_size=CHUNK_SIZE, limit=0):
+    """Copies src to dst through converter, stopping after limit output bytes (0 = no limit)."""
+    written = 0
+    chunks = iter(lambda: src.read(chunk_size), b"")
+    for data in chunks:
+        out = converter.feed(data)
+        if limit and written + len(out) >= limit:
+            dst.write(out[:limit - written])
+            return limit
+        dst.write(out)
+        written += len(out)
+    out = converter.finish()
+    if limit:
+        out = out[:limit - written]
+    dst.write(out)
+    return written + len(out)
+
+
+# ----------------------------------------------------------------------------
+# SELF-CHECK
+# ----------------------------------------------------------------------------
+def reference(stream, drop_chained):
+    """The same conversion through protocol.TextParser, record by record."""
+    out = bytearray()
+    for record in protocol.TextParser().feed(stream + b"\n"):
+        if isinstance(record, protocol.BatchRecord) and record.h_min != 0:
+            if drop_chained and len(record.digest) == 64:   # conditioned lines carry 32-byte blocks here
+                out += record.digest[:32]
+            else:
+                out += record.digest
+    return bytes(out)
+
+
+def check(count=3000, seed=0):
+    """Converts synthetic logs in random chunk sizes and compares with TextParser. Returns True if all match."""
+    rng = random.Random(seed)
+    stream = bytearray(protocol.synthetic_stream(count, "text", seed=seed, noise=True))
+    # Firmware chatter, telemetry, CRLF line ends and conditioned single-line batches
+    lines = stream.split(b"\n")
+    for i in sorted(rng.sample(range(len(lines)), 40), reverse=True):
+        lines.insert(i - i % 3 + 1, rng.choice((
+            b"TLM: interval_ms=1000 acquired=10", b"HEALTH: tests=1 rct_run=7", b"Core 1: ready",
+            b"H_min: 7.9000 | R: 4000 | Data: -", b"H_min: 0.0000 | R:  120 | Data: -",
+            b"H_min: 7.8000 | R: 4001 | Data: " + rng.randbytes(32).hex().encode())))
+    good = b"\r\n".join(lines)
+
+    ok = True
+    for drop_chained in (False, True):
+        want = reference(good.replace(b"\r", b""), drop_chained)
+        converter = LogConverter(drop_chained=drop_chained)
+        out = bytearray()
+        pos = 0
+        while pos < len(good):
+            step = rng.choice((1, 7, 100, 4096, 65536))
+            out += converter.feed(good[pos:pos + step])
+            pos += step
+        out += converter.finish()
+        match = bytes(out) == want
+        ok &= match
+        print(f"{'PASS' if match else 'FAIL'} drop_chained={drop_chained}: {len(out):,} bytes "
+              f"({converter.stats['batches']} batches, {converter.stats['squelched']} squelched, "
+              f"{converter.stats['empty']} empty)")
+
+    # display.py --headless output: numbered lines, both legacy digests on one line,
+    # and a stretch of conditioned batches (32-byte blocks) announced by CFG: lines
+    import display
+    records = list(itertools.islice(protocol.mock_records(rate=0, seed=seed), 2000))
+    for i in sorted(rng.sample(range(len(records)), 20), reverse=True):
+        records.insert(i, protocol.HealthRecord(i, *[1] * len(protocol.HEALTH_FIELDS)))
+        records.insert(i, protocol.TelemetryRecord(i, *[1000] * len(protocol.TELEMETRY_FIELDS)))
+    conditioned = [protocol.BatchRecord(2000 + j, 7.5, 4000, rng.randbytes(32 * rng.randrange(4)))
+                   for j in range(100)]
+    records[1000:1000] = ([protocol.ConfigRecord(2000, 1024, 2, 64, 2)] + conditioned
+                          + [protocol.ConfigRecord(2100, 1024, 2, 64, 0)])
+    headless = ("\n".join(filter(None, map(display.format_line, records))) + "\n").encode()
+    for drop_chained in (False, True):
+        want = b"".join(r.digest if r in conditioned or not drop_chained else r.digest[:32]
+                        for r in records if isinstance(r, protocol.BatchRecord) and r.h_min != 0)
+        converter = LogConverter(drop_chained=drop_chained)
+        out = b"".join(converter.feed(headless[pos:pos + 4096]) for pos in range(0, len(headless), 4096))
+        out += converter.finish()
+        match = out == want
+        ok &= match
+        print(f"{'PASS' if match else 'FAIL'} display.py headless, drop_chained={drop_chained}: "
+              f"{len(out):,} bytes ({converter.stats['batches']} batches)")
+
+    # Damaged records are skipped, never half-written
+    digest = "ab" * 32
+    damaged = "\n".join([
+        "H_min: 7.5000 | R: 4000 | Data: ", digest, digest,       # good
+        "H_min: 7.5000 | R: 4000 | Data: ", digest, "zz" * 32,    # bad hex
+        "H_min: 7.5000 | R: 4000 | Data: ", digest[:-2],          # short line, then a good record
+        "H_min: 7.5000 | R: 4000 | Data: ", digest, digest,
+        digest,                                                   # orphan
+        "H_min: 7.5000 | R: 4000 | Data: ", digest,               # truncated at end of file
+    ]).encode()
+    converter = LogConverter()
+    out = converter.feed(damaged) + converter.finish()
+    stats = converter.stats
+    good_damaged = len(out) == 128 and stats["malformed"] == 3 and stats["orphans"] == 1
+    ok &= good_damaged
+    print(f"{'PASS' if good_damaged else 'FAIL'} damaged log: {len(out)} bytes, "
+          f"{stats['malformed']} malformed, {stats['orphans']} orphan lines")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text serial log to binary converter")
+    parser.add_argument("log", nargs="?", help="text log ('-' for stdin)")
+    parser.add_argument("output", nargs="?", help="binary output ('-' for stdout)")
+    parser.add_argument("--drop-chained", action="store_true",
+                        help="keep only the first digest of each legacy batch (the second is its hash)")
+    parser.add_argument("--keep-squelched", action="store_true", help="keep batches with H_min 0")
+    parser.add_argument("--digest-lines", type=int, default=DIGEST_LINES)
+    parser.add_argument("--digest-size", type=int, default=DIGEST_SIZE,
+                        help="bytes per digest in single-line legacy records (32 QRNG.py, 64 main.c)")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many output bytes")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--check", action="store_true", help="compare against protocol.TextParser")
+    args = parser.parse_args()
+
+    if args.check:
+        return 0 if check() else 1
+    if not args.log or not args.output:
+        parser.error("log and output are needed (or --check)")
+
+    converter = LogConverter(args.drop_chained, args.keep_squelched, args.digest_lines, args.digest_size)
+    src = sys.stdin.buffer if args.log == "-" else open(args.log, "rb")
+    dst = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    t0 = time.perf_counter()
+    try:
+        written = convert(src, dst, converter, args.chunk, args.limit)
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if dst is not sys.stdout.buffer:
+            dst.close()
+    elapsed = time.perf_counter() - t0
+
+    stats = converter.stats
+    read = stats["lines"]
+    print(f"{written:,} bytes from {stats['batches']:,} batches ({read:,} lines) in {elapsed:.1f} s | "
+          f"squelched {stats['squelched']:,}, empty {stats['empty']:,}, malformed {stats['malformed']:,}, "
+          f"orphan lines {stats['orphans']:,}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
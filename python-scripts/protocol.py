@@ -0,0 +1,448 @@
+"""
+Host-side decoding of the QRNG serial output.
+
+The firmware can emit batches in one of two formats:
+
+* text   - the original human readable output:
+               H_min: 7.6781 | R: 4084 | Data:
+               <hex digest 1>
+               <hex digest 2>
+* binary - versioned frames with a CRC, roughly 2.3x smaller on the wire:
+
+    offset  size  field
+    0       2     sync word 0x5AA5 (bytes A5 5A)
+    2       1     protocol version
+    3       1     frame type
+    4       4     sequence number (u32)
+    8       2     payload length N (u16)
+    10      N     payload
+    10+N    4     CRC32 over bytes [2 : 10+N]
+
+  All fields are little-endian. A FRAME_BATCH payload is the H_min estimate
+  as unsigned Q4.12 fixed point (u16), the dynamic range (u16) and then the
+  raw digest bytes. A FRAME_RAW payload carries the same batch's raw samples
+  packed as little-endian 12-bit values (3 bytes per 2 samples); in text
+  mode these arrive as a `RAW: <hex>` line after the batch. A FRAME_TELEMETRY
+  payload is one u32 per TELEMETRY_FIELDS entry (`TLM: name=value ...` in
+  text mode), counted over the last reporting interval. A FRAME_CONFIG
+  payload is one u16 per CONFIG_FIELDS entry (`CFG: name=value ...`), sent
+  at boot and in answer to every command line written to the device
+  (`SET <field> <value>` or `GET`, see config_command()); its sequence
+  number is that of the first batch produced with those settings. A
+  FRAME_HEALTH payload (`HEALTH: name=value ...`) is one u16 per HEALTH_FIELDS
+  entry and replaces a batch that failed the on-device SP 800-90B repetition
+  count or adaptive proportion test; it carries that batch's sequence number.
+
+With conditioning set to credit or extract (CONDITIONING_MODES), a batch
+carries however many 32-byte full-entropy blocks its credited H_min paid
+for, possibly none, instead of the two legacy digests; the text form is
+then always the single-line one, with `Data: -` for an empty batch.
+
+Both parsers take arbitrary chunks of the byte stream via feed() and return
+the records completed by that chunk, so they can sit directly behind a
+serial.read() call. Running this file benchmarks both parsers against the
+synthetic stream generator.
+"""
+import random
+import struct
+import sys
+import time
+import zlib
+from collections import namedtuple
+
+# ----------------------------------------------------------------------------
+# FRAME LAYOUT (keep in sync with QRNG.py and main.c)
+# ----------------------------------------------------------------------------
+SYNC = 0x5AA5
+SYNC_BYTES = struct.pack("<H", SYNC)
+VERSION = 1
+
+FRAME_BATCH = 1
+FRAME_RAW = 2
+FRAME_TELEMETRY = 3
+FRAME_CONFIG = 4
+FRAME_HEALTH = 5
+
+HEADER = struct.Struct("<HBBIH")
+BATCH_HEADER = struct.Struct("<HH")
+CRC = struct.Struct("<I")
+
+HMIN_SCALE = 4096          # Q4.12 fixed point
+MAX_PAYLOAD = 8192         # Anything longer is treated as a false sync
+
+# Pipeline counters, in QRNG.py's TLM_* slot order
+TELEMETRY_FIELDS = ("interval_ms", "acquired", "adc_us", "jitter_us", "stalls", "stall_us",
+                    "queue_hwm", "processed", "process_us", "hash_us", "output_us", "bytes_out",
+                    "adc_reads", "adc_max_us", "health_fails", "tail_us")
+TELEMETRY = struct.Struct("<" + "I" * len(TELEMETRY_FIELDS))
+
+# Runtime settings, in QRNG.py's CFG_* slot order
+CONFIG_FIELDS = ("batch_size", "lag_depth", "window", "conditioning")
+CONFIG = struct.Struct("<" + "H" * len(CONFIG_FIELDS))
+
+# Health test failure event: tests is a HEALTH_RCT | HEALTH_APT bit mask,
+# rct_run / apt_count the worst run and window count seen in the batch
+HEALTH_FIELDS = ("tests", "rct_run", "apt_count", "rct_cutoff", "apt_cutoff")
+HEALTH = struct.Struct("<" + "H" * len(HEALTH_FIELDS))
+HEALTH_RCT = 1
+HEALTH_APT = 2
+
+BatchRecord = namedtuple("BatchRecord", "seq h_min range digest")
+RawRecord = namedtuple("RawRecord", "seq packed")
+TelemetryRecord = namedtuple("TelemetryRecord", "seq " + " ".join(TELEMETRY_FIELDS))
+ConfigRecord = namedtuple("ConfigRecord", "seq " + " ".join(CONFIG_FIELDS))
+HealthRecord = namedtuple("HealthRecord", "seq " + " ".join(HEALTH_FIELDS))
+
+# Values of the conditioning setting (COND_* in QRNG.py)
+CONDITIONING_MODES = ("legacy", "credit", "extract")
+COND_LEGACY = 0
+Frame = namedtuple("Frame", "type seq payload")
+
+
+def hmin_to_fixed(h_min):
+    return max(0, min(0xFFFF, int(h_min * HMIN_SCALE + 0.5)))
+
+
+def hmin_from_fixed(value):
+    return value / HMIN_SCALE
+
+
+# ----------------------------------------------------------------------------
+# ENCODING
+# ----------------------------------------------------------------------------
+def encode_frame(frame_type, seq, payload):
+    header = HEADER.pack(SYNC, VERSION, frame_type, seq & 0xFFFFFFFF, len(payload))
+    crc = zlib.crc32(payload, zlib.crc32(header[2:]))
+    return header + payload + CRC.pack(crc)
+
+
+def encode_batch(seq, h_min, dynamic_range, digest):
+    payload = BATCH_HEADER.pack(hmin_to_fixed(h_min), dynamic_range) + digest
+    return encode_frame(FRAME_BATCH, seq, payload)
+
+
+def config_command(name, value=None):
+    """Command line for the device: SET <name> <value>, or GET with no name."""
+    if name is None:
+        return b"GET\n"
+    if name not in CONFIG_FIELDS:
+        raise ValueError(f"Unknown setting: {name}")
+    if name == "conditioning" and value in CONDITIONING_MODES:
+        value = CONDITIONING_MODES.index(value)
+    return f"SET {name} {int(value)}\n".encode()
+
+
+def format_text_batch(h_min, dynamic_range, digests):
+    """Renders a batch exactly as the firmware's text mode prints it."""
+    lines = [f"H_min: {h_min:.4f} | R: {dynamic_range:4d} | Data: "]
+    lines.extend(d.hex() for d in digests)
+    return ("\n".join(lines) + "\n").encode()
+
+
+def format_telemetry(record, batch_size=1024):
+    """One-line summary of where the pipeline spends its time."""
+    seconds = record.interval_ms / 1000 or 1.0
+
+    def per_batch(us, n):
+        return us / n / 1000 if n else 0.0
+
+    return (f"acq {record.acquired * batch_size / seconds:,.0f} S/s "
+            f"(adc {per_batch(record.adc_us, record.acquired):.1f} ms, "
+            f"jitter {per_batch(record.jitter_us, record.acquired):.1f} ms, "
+            f"max {record.adc_max_us / 1000:.1f} ms, "
+            f"{record.adc_reads / (record.acquired * batch_size) if record.acquired else 0:.1f} reads/S) | "
+            f"proc {per_batch(record.process_us, record.processed):.1f} ms, "
+            f"hash {per_batch(record.hash_us, record.processed):.1f} ms, "
+            f"out {per_batch(record.output_us, record.processed):.1f} ms, "
+            f"tail {per_batch(record.tail_us, record.processed):.1f} ms | "
+            f"{record.bytes_out / seconds:,.0f} B/s | "
+            f"queue {record.queue_hwm}, stalls {record.stalls}, health fails {record.health_fails}")
+
+
+def format_record(record):
+    """Single-line form used by display.py (the format mock_run emits)."""
+    return f"H_min: {record.h_min:.4f} | R: {record.range} | Data: {record.digest.hex() or '-'}"
+
+
+# ----------------------------------------------------------------------------
+# DECODING
+# ----------------------------------------------------------------------------
+def decode_batch(seq, payload):
+    hmin_q, dynamic_range = BATCH_HEADER.unpack_from(payload)
+    return BatchRecord(seq, hmin_from_fixed(hmin_q), dynamic_range, payload[BATCH_HEADER.size:])
+
+
+def decode_raw(seq, payload):
+    return RawRecord(seq, payload)
+
+
+def decode_telemetry(seq, payload):
+    return TelemetryRecord(seq, *TELEMETRY.unpack_from(payload))
+
+
+def decode_config(seq, payload):
+    return ConfigRecord(seq, *CONFIG.unpack_from(payload))
+
+
+def decode_health(seq, payload):
+    return HealthRecord(seq, *HEALTH.unpack_from(payload))
+
+
+DECODERS = {
+    FRAME_BATCH: decode_batch,
+    FRAME_RAW: decode_raw,
+    FRAME_TELEMETRY: decode_telemetry,
+    FRAME_CONFIG: decode_config,
+    FRAME_HEALTH: decode_health,
+}
+
+
+class FrameParser:
+    """
+    Incremental binary frame decoder. Resynchronises on the sync word after
+    corrupt frames or any text (boot banners, tracebacks) mixed into the stream.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        self.buf += data
+        buf = self.buf
+        records = []
+        pos = 0
+        end = len(buf)
+
+        while True:
+            start = buf.find(SYNC_BYTES, pos)
+            if start < 0:
+                # Keep a trailing A5 in case it is the first half of a sync word
+                keep = end - 1 if end and buf[end - 1] == SYNC_BYTES[0] else end
+                self.skipped_bytes += keep - pos
+                pos = keep
+                break
+            self.skipped_bytes += start - pos
+            pos = start
+
+            if end - pos < HEADER.size:
+                break
+            _, version, frame_type, seq, length = HEADER.unpack_from(buf, pos)
+            if version != VERSION or length > MAX_PAYLOAD:
+                pos += 1
+                self.skipped_bytes += 1
+                continue
+
+            frame_end = pos + HEADER.size + length + CRC.size
+            if frame_end > end:
+                break
+
+            body_end = frame_end - CRC.size
+            (crc,) = CRC.unpack_from(buf, body_end)
+            if zlib.crc32(buf[pos + 2:body_end]) != crc:
+                self.crc_errors += 1
+                self.skipped_bytes += 1
+                pos += 1
+                continue
+
+            payload = bytes(buf[pos + HEADER.size:body_end])
+            decoder = DECODERS.get(frame_type)
+            if decoder is None:
+                records.append(Frame(frame_type, seq, payload))
+            else:
+                records.append(decoder(seq, payload))
+            self.frames += 1
+            pos = frame_end
+
+        del buf[:pos]
+        return records
+
+
+class TextParser:
+    """
+    Incremental decoder for the text format. Accepts both the three-line
+    firmware output and the single-line form produced by format_record().
+    Text records carry no sequence number, so one is assigned locally.
+    """
+    def __init__(self, digest_lines=2):
+        self.buf = bytearray()
+        self.digest_lines = digest_lines
+        self.pending = None
+        self.seq = 0
+        self.frames = 0
+        self.parse_errors = 0
+
+    def _header(self, line):
+        parts = line.split("|")
+        h_min = float(parts[0].split(":")[1])
+        dynamic_range = int(parts[1].split(":")[1])
+        data = parts[2].split(":", 1)[1].strip()
+        return h_min, dynamic_range, data
+
+    def _finish(self, h_min, dynamic_range, hex_parts):
+        record = BatchRecord(self.seq, h_min, dynamic_range, bytes.fromhex("".join(hex_parts)))
+        self.seq += 1
+        self.frames += 1
+        return record
+
+    def feed(self, data):
+        self.buf += data
+        records = []
+        *lines, rest = self.buf.split(b"\n")
+        self.buf = bytearray(rest)
+
+        for raw in lines:
+            line = raw.decode("utf-8", errors="ignore").strip()
+            try:
+                if line.startswith("H_min:") and "Data:" in line:
+                    h_min, dynamic_range, data_part = self._header(line)
+                    if data_part:
+                        # "-" is a conditioned batch that produced no output
+                        records.append(self._finish(h_min, dynamic_range, [data_part.strip("-")]))
+                        self.pending = None
+                    else:
+                        self.pending = (h_min, dynamic_range, [])
+                elif line.startswith("TLM:"):
+                    values = dict(item.split("=") for item in line[4:].split())
+                    records.append(TelemetryRecord(self.seq - 1,
+                                                   *(int(values.get(f, 0)) for f in TELEMETRY_FIELDS)))
+                elif line.startswith("CFG:"):
+                    values = dict(item.split("=") for item in line[4:].split())
+                    records.append(ConfigRecord(self.seq,
+                                                *(int(values.get(f, 0)) for f in CONFIG_FIELDS)))
+                elif line.startswith("HEALTH:"):
+                    # Stands in for a suppressed batch, which still used up a sequence number
+                    values = dict(item.split("=") for item in line[7:].split())
+                    records.append(HealthRecord(self.seq, *(int(values.get(f, 0)) for f in HEALTH_FIELDS)))
+                    self.seq += 1
+                elif line.startswith("RAW:"):
+                    # Raw samples follow the batch they belong to
+                    records.append(RawRecord(self.seq - 1, bytes.fromhex(line[4:].strip())))
+                elif self.pending is not None:
+                    self.pending[2].append(line)
+                    if len(self.pending[2]) == self.digest_lines:
+                        records.append(self._finish(*self.pending))
+                        self.pending = None
+            except (ValueError, IndexError):
+                self.parse_errors += 1
+                self.pending = None
+        return records
+
+
+def make_parser(mode):
+    if mode == "binary":
+        return FrameParser()
+    if mode == "text":
+        return TextParser()
+    raise ValueError(f"Unknown protocol mode: {mode}")
+
+
+# ----------------------------------------------------------------------------
+# RECORD SOURCES
+# ----------------------------------------------------------------------------
+def serial_records(port, baud, mode, should_stop=lambda: False, commands=()):
+    """
+    Yields records from a serial port until should_stop() returns True.
+    commands (config_command() lines) are written to the device first.
+    """
+    import serial
+    with serial.Serial(port, baud, timeout=1) as ser:
+        print(f"Connected to {port}", file=sys.stderr)
+        for command in commands:
+            ser.write(command)
+        parser = make_parser(mode)
+        while not should_stop():
+            chunk = ser.read(ser.in_waiting or 1)
+            yield from parser.feed(chunk)
+
+
+def replay_records(path, mode, rate=0, loop=False, should_stop=lambda: False):
+    """
+    Yields records from a file of captured serial bytes (e.g. `cat /dev/ttyACM0 > session.bin`).
+    rate is in batches per second, 0 replays as fast as possible.
+    """
+    while True:
+        parser = make_parser(mode)
+        with open(path, "rb") as f:
+            while not should_stop():
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                for record in parser.feed(chunk):
+                    yield record
+                    if rate:
+                        time.sleep(1.0 / rate)
+        if not loop or should_stop():
+            return
+
+
+def mock_records(rate=10, digest_size=32, seed=None, should_stop=lambda: False):
+    """Endless synthetic records, for running consumers without a device."""
+    seq = 0
+    while not should_stop():
+        for h_min, dynamic_range, d1, d2 in synthetic_records(1000, digest_size, seed):
+            if should_stop():
+                return
+            yield BatchRecord(seq, h_min, dynamic_range, d1 + d2)
+            seq += 1
+            if rate:
+                time.sleep(1.0 / rate)
+        seed = None if seed is None else seed + 1
+
+
+# ----------------------------------------------------------------------------
+# SYNTHETIC STREAM (parser tests and benchmarks without a Pico)
+# ----------------------------------------------------------------------------
+def synthetic_records(count, digest_size=32, seed=None):
+    """Yields (h_min, range, digest_1, digest_2) tuples shaped like real batches."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        dynamic_range = rng.randint(1800, 4090)
+        h_min = 10.0 - rng.choice((2.0, 2.3219, 2.5850, 2.8074, 3.0))
+        if rng.random() < 0.01:
+            dynamic_range = rng.randint(0, 199)
+            h_min = 0.0
+        yield h_min, dynamic_range, rng.randbytes(digest_size), rng.randbytes(digest_size)
+
+
+def synthetic_stream(count, mode="binary", digest_size=32, seed=None, noise=False):
+    """
+    Returns the bytes the firmware would send for `count` batches. With
+    noise=True, text chatter and corrupted frames are mixed in to exercise
+    resynchronisation.
+    """
+    rng = random.Random(seed)
+    out = bytearray()
+    if noise:
+        out += b"Core 1: Processing Entropy & Hashing.\n"
+    for seq, (h_min, dynamic_range, d1, d2) in enumerate(
+            synthetic_records(count, digest_size, seed)):
+        if mode == "binary":
+            frame = encode_batch(seq, h_min, dynamic_range, d1 + d2)
+            if noise and rng.random() < 0.01:
+                damaged = bytearray(frame)
+                damaged[rng.randrange(2, len(damaged))] ^= 0xFF
+                out += damaged
+        else:
+            frame = format_text_batch(h_min, dynamic_range, (d1, d2))
+        out += frame
+    return bytes(out)
+
+
+def benchmark(count=20000, chunk=4096):
+    for mode in ("text", "binary"):
+        stream = synthetic_stream(count, mode, seed=1)
+        parser = make_parser(mode)
+        parsed = 0
+        t0 = time.perf_counter()
+        for i in range(0, len(stream), chunk):
+            parsed += len(parser.feed(stream[i:i + chunk]))
+        elapsed = time.perf_counter() - t0
+        print(f"{mode:>6}: {len(stream) / count:6.1f} bytes/batch | "
+              f"{parsed / elapsed:9.0f} batches/s | "
+              f"{len(stream) / elapsed / 1e6:6.1f} MB/s")
+
+
+if __name__ == "__main__":
+    benchmark()
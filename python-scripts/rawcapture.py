@@ -0,0 +1,122 @@
+"""
+Memory-mapped capture of the raw ADC samples streamed when STREAM_RAW is on.
+
+Samples are stored exactly as they come off the link: packed little-endian
+12-bit values, 3 bytes per 2 samples, batches back to back with no header.
+The file grows in large steps and is mapped into memory, so recording is a
+slice copy per batch; it is truncated to the real length on close.
+
+Usage:
+    python rawcapture.py --port /dev/ttyACM0 --protocol binary samples.p12
+    python analysis.py --packed samples.p12
+"""
+import argparse
+import mmap
+import os
+
+import numpy as np
+
+import protocol
+
+GROW_STEP = 64 << 20    # Extend the file 64 MiB at a time
+
+
+def pack12(samples):
+    """Packs 12-bit samples (even count) into the on-wire layout."""
+    s = np.asarray(samples, dtype=np.uint16).reshape(-1, 2) & 0xFFF
+    out = np.empty((len(s), 3), dtype=np.uint8)
+    out[:, 0] = s[:, 0] & 0xFF
+    out[:, 1] = (s[:, 0] >> 8) | ((s[:, 1] & 0x0F) << 4)
+    out[:, 2] = s[:, 1] >> 4
+    return out.ravel()
+
+
+def unpack12(packed):
+    """Inverse of pack12; accepts bytes or a uint8 array, returns uint16 samples."""
+    b = np.frombuffer(packed, dtype=np.uint8) if isinstance(packed, (bytes, bytearray, memoryview)) \
+        else np.asarray(packed, dtype=np.uint8)
+    b = b[:len(b) - len(b) % 3].reshape(-1, 3).astype(np.uint16)
+    out = np.empty((len(b), 2), dtype=np.uint16)
+    out[:, 0] = b[:, 0] | ((b[:, 1] & 0x0F) << 8)
+    out[:, 1] = (b[:, 1] >> 4) | (b[:, 2] << 4)
+    return out.ravel()
+
+
+def read_raw_capture(path):
+    """Returns all samples of a packed capture as a uint16 array."""
+    return unpack12(np.memmap(path, dtype=np.uint8, mode="r"))
+
+
+class RawCaptureWriter:
+    """Appends packed raw batches to a memory-mapped, growable file."""
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "w+b")
+        self.length = 0
+        self.capacity = 0
+        self.map = None
+        self.batches = 0
+        self.seq_gaps = 0
+        self.last_seq = None
+        self._grow(GROW_STEP)
+
+    def _grow(self, size):
+        if self.map is not None:
+            self.map.close()
+        self.capacity = size
+        self.f.truncate(size)
+        self.map = mmap.mmap(self.f.fileno(), size)
+
+    def write(self, record):
+        """Takes a protocol.RawRecord."""
+        if self.last_seq is not None and record.seq != (self.last_seq + 1) & 0xFFFFFFFF:
+            # Lost batches break the lag history across the gap
+            self.seq_gaps += 1
+        self.last_seq = record.seq
+
+        n = len(record.packed)
+        if self.length + n > self.capacity:
+            self._grow(self.capacity + max(GROW_STEP, n))
+        self.map[self.length:self.length + n] = record.packed
+        self.length += n
+        self.batches += 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            self.f.truncate(self.length)
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record raw sample frames to a packed capture file")
+    parser.add_argument("output")
+    parser.add_argument("--port", default="/dev/ttyACM0")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--protocol", choices=("text", "binary"), default="binary")
+    parser.add_argument("--batches", type=int, default=0, help="stop after N raw batches (0 = forever)")
+    args = parser.parse_args()
+
+    with RawCaptureWriter(args.output) as writer:
+        try:
+            for record in protocol.serial_records(args.port, args.baud, args.protocol):
+                if isinstance(record, protocol.RawRecord):
+                    writer.write(record)
+                    if args.batches and writer.batches >= args.batches:
+                        break
+        except KeyboardInterrupt:
+            pass
+    print(f"Wrote {writer.batches} batches ({writer.length} bytes, {writer.seq_gaps} sequence gaps) "
+          f"to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
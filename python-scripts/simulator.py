@@ -0,0 +1,642 @@
+"""
+Runs QRNG.py on a PC against a simulated ADC.
+
+QRNG.py imports `machine`, `rp2`, `_thread`, `uhashlib`, `ubinascii` and
+`micropython`, so it normally only runs on an RP2040. This script loads it unmodified with
+CPython stand-ins for those modules (plus the MicroPython `time.ticks_*`
+functions), so main() and core1_entry() run as two host threads and their
+output goes to a virtual serial port. Bytes written to the port reach the
+firmware's sys.stdin, so `SET ...` command lines work as on the board:
+
+* pty    - a pseudo-terminal; point display.py / harvestd.py / capture.py at
+           the printed device path
+* stdout - the firmware output as-is
+* null   - discarded, for throughput measurements
+
+The ADC is driven by a noise model:
+
+* gaussian - white noise around mid-scale, the healthy case
+* pulse    - the PIO square wave bleeding into the input: a periodic pulse
+             on top of AR(1) correlated noise
+* stuck    - a stuck-at input, one constant code
+* floating - an unconnected input slowly drifting by a few LSB
+* glitch   - gaussian, with a short stuck-at burst now and then (what the
+             firmware's SP 800-90B health tests are for)
+
+The simulated ADC returns read_u16() values the way MicroPython does on the
+RP2040 (12-bit code << 4 | code >> 8), so the firmware's `& 0xFFF` sees the
+same bits it would on the board. Timing is host timing: the 1-4 us jitter
+sleeps are skipped unless --realtime is given, because time.sleep() on a PC
+cannot wait less than tens of microseconds.
+
+Usage:
+    python simulator.py --output pty --protocol binary          # then: display.py / harvestd.py on the pty
+    python simulator.py --output null --seconds 10 --model pulse
+    python simulator.py --check                                 # health check of every noise model
+    python simulator.py --check-kernels                         # viper vs Python processing kernel
+    python simulator.py --output null --seconds 5 --set window=8 --set batch_size=2048
+"""
+import argparse
+import binascii
+import hashlib
+import importlib.util
+import io
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+
+import analysis
+import protocol
+import rawcapture
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "QRNG.py")
+
+
+# ----------------------------------------------------------------------------
+# NOISE MODELS (12-bit ADC codes)
+# ----------------------------------------------------------------------------
+class GaussianNoise:
+    def __init__(self, rng, mean=2048.0, sigma=600.0):
+        self.rng = rng
+        self.mean = mean
+        self.sigma = sigma
+
+    def block(self, n):
+        gauss = self.rng.gauss
+        return [min(4095, max(0, int(gauss(self.mean, self.sigma)))) for _ in range(n)]
+
+
+class PulseNoise:
+    """Periodic pulse plus AR(1) noise; rho sets the sample-to-sample correlation."""
+    def __init__(self, rng, mean=2048.0, sigma=300.0, rho=0.9, amplitude=800.0, period=24, duty=4):
+        self.rng = rng
+        self.mean = mean
+        self.sigma = sigma
+        self.rho = rho
+        self.amplitude = amplitude
+        self.period = period
+        self.duty = duty
+        self.x = 0.0
+        self.phase = 0
+
+    def block(self, n):
+        gauss = self.rng.gauss
+        rho = self.rho
+        innovation = self.sigma * math.sqrt(1 - rho * rho)
+        out = []
+        for _ in range(n):
+            self.x = rho * self.x + gauss(0.0, innovation)
+            pulse = self.amplitude if self.phase < self.duty else 0.0
+            self.phase = (self.phase + 1 + self.rng.randrange(3)) % self.period
+            out.append(min(4095, max(0, int(self.mean + pulse + self.x))))
+        return out
+
+
+class StuckNoise:
+    def __init__(self, rng, value=2048):
+        self.value = value
+
+    def block(self, n):
+        return [self.value] * n
+
+
+class FloatingNoise:
+    """Slow random walk of a few LSB, as with nothing connected to the input."""
+    def __init__(self, rng, mean=1900.0, step=0.05, sigma=0.7, span=3.0):
+        self.rng = rng
+        self.mean = mean
+        self.step = step
+        self.sigma = sigma
+        self.span = span
+        self.drift = 0.0
+
+    def block(self, n):
+        gauss = self.rng.gauss
+        out = []
+        for _ in range(n):
+            self.drift = max(-self.span, min(self.span, self.drift + gauss(0.0, self.step)))
+            out.append(int(round(self.mean + self.drift + gauss(0.0, self.sigma))))
+        return out
+
+
+class GlitchNoise(GaussianNoise):
+    """Healthy noise, but every `every` samples the input sticks for `length` samples."""
+    def __init__(self, rng, every=5000, length=32):
+        super().__init__(rng)
+        self.every = every
+        self.length = length
+        self.position = 0
+
+    def block(self, n):
+        out = super().block(n)
+        for i in range(n):
+            if (self.position + i) % self.every < self.length:
+                out[i] = 2048
+        self.position += n
+        return out
+
+
+NOISE_MODELS = {
+    "gaussian": GaussianNoise,
+    "pulse": PulseNoise,
+    "stuck": StuckNoise,
+    "floating": FloatingNoise,
+    "glitch": GlitchNoise,
+}
+
+
+class Halt(Exception):
+    """Raised inside the firmware's core 0 loop to stop the simulation."""
+
+
+class SimulatedADC:
+    """machine.ADC stand-in fed from a noise model in blocks."""
+    BLOCK = 4096
+
+    def __init__(self, model):
+        self.model = model
+        self.buffer = []
+        self.pos = 0
+        self.reads = 0
+        self.halted = False
+
+    def __call__(self, channel):
+        # Used as the machine.ADC constructor
+        return self
+
+    def read_u16(self):
+        if self.pos >= len(self.buffer):
+            if self.halted:
+                raise Halt()
+            self.buffer = self.model.block(self.BLOCK)
+            self.pos = 0
+        code = self.buffer[self.pos]
+        self.pos += 1
+        self.reads += 1
+        return (code << 4) | (code >> 8)
+
+
+# ----------------------------------------------------------------------------
+# MICROPYTHON STAND-INS
+# ----------------------------------------------------------------------------
+def make_modules(adc, realtime=False):
+    """Returns the fake modules QRNG.py imports, keyed by module name."""
+    machine = types.ModuleType("machine")
+    clock = [125_000_000]
+
+    def freq(hz=None):
+        if hz is None:
+            return clock[0]
+        clock[0] = hz
+
+    machine.freq = freq
+    machine.mem32 = {}
+    machine.Pin = lambda pin, *args, **kwargs: pin
+    machine.ADC = adc
+
+    rp2 = types.ModuleType("rp2")
+    rp2.PIO = types.SimpleNamespace(OUT_LOW=0, OUT_HIGH=1)
+    # The PIO program body uses names only the real assembler defines, so never call it
+    rp2.asm_pio = lambda **kwargs: (lambda program: program)
+
+    class StateMachine:
+        def __init__(self, sm_id, program, **kwargs):
+            self.running = 0
+
+        def active(self, value=None):
+            if value is not None:
+                self.running = value
+            return self.running
+
+    rp2.StateMachine = StateMachine
+
+    thread = types.ModuleType("_thread")
+    thread.allocate_lock = threading.Lock
+    thread.start_new_thread = lambda fn, args: threading.Thread(
+        target=fn, args=args, daemon=True, name="core1").start()
+
+    uhashlib = types.ModuleType("uhashlib")
+    uhashlib.sha256 = hashlib.sha256
+
+    # The viper / native emitters compile to machine code on the board; here
+    # the decorated function simply runs as Python (see VIPER_TYPES)
+    micropython = types.ModuleType("micropython")
+    micropython.viper = micropython.native = lambda fn: fn
+    micropython.const = lambda value: value
+
+    ubinascii = types.ModuleType("ubinascii")
+    ubinascii.hexlify = binascii.hexlify
+    ubinascii.crc32 = zlib.crc32
+
+    # MicroPython's time extras, bound into the firmware's namespace only
+    utime = types.ModuleType("time")
+    utime.__dict__.update(time.__dict__)
+    utime.ticks_us = lambda: time.perf_counter_ns() // 1000
+    utime.ticks_ms = lambda: time.perf_counter_ns() // 1_000_000
+    utime.ticks_diff = lambda a, b: a - b
+    utime.sleep_us = (lambda us: time.sleep(us / 1e6)) if realtime else (lambda us: None)
+
+    return {"machine": machine, "rp2": rp2, "_thread": thread,
+            "uhashlib": uhashlib, "ubinascii": ubinascii, "micropython": micropython, "time": utime}
+
+
+# Viper's pointer types only appear as argument annotations in QRNG.py; on
+# the host the kernel indexes the arrays themselves. Python ints never wrap,
+# which is fine while the kernel's values stay far below 2^31.
+VIPER_TYPES = {"ptr8": bytearray, "ptr16": memoryview, "ptr32": memoryview, "uint": int}
+
+
+def load_firmware(modules, overrides=None, path=FIRMWARE):
+    """Executes QRNG.py with the stand-ins installed and returns it as a module."""
+    saved = {name: sys.modules.get(name) for name in modules}
+    sys.modules.update(modules)
+    try:
+        spec = importlib.util.spec_from_file_location("QRNG", path)
+        firmware = importlib.util.module_from_spec(spec)
+        vars(firmware).update(VIPER_TYPES)
+        spec.loader.exec_module(firmware)
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+    firmware.time = modules["time"]
+    for name, value in (overrides or {}).items():
+        setattr(firmware, name, value)
+    return firmware
+
+
+# ----------------------------------------------------------------------------
+# VIRTUAL SERIAL PORT
+# ----------------------------------------------------------------------------
+class SerialSink(io.RawIOBase):
+    """Raw byte sink standing in for the USB CDC link (sys.stdout.buffer)."""
+    def __init__(self, write):
+        self._write = write
+        self.bytes_out = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        n = len(data)
+        self._write(bytes(data))
+        self.bytes_out += n
+        return n
+
+
+def fd_writer(fd):
+    def write(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    return write
+
+
+class CommandInput:
+    """sys.stdin stand-in reading the host's command bytes from a file descriptor."""
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, n=1):
+        return os.read(self.fd, n).decode("latin-1")
+
+
+def open_pty():
+    """Returns (master fd, slave device path) of a raw-mode pseudo-terminal."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+# ----------------------------------------------------------------------------
+# SIMULATOR
+# ----------------------------------------------------------------------------
+class Simulator:
+    """
+    One simulated board. Firmware text output and binary frames both end up
+    in sink; start() runs main() on a host thread, stop() halts core 0 and
+    waits for core 1 to drain the published buffers.
+    """
+    def __init__(self, sink, model="gaussian", seed=None, realtime=False, command_fd=None, **overrides):
+        self.sink = sink
+        if command_fd is None:
+            command_fd, self.command_write = os.pipe()
+        else:
+            self.command_write = None
+        self.commands = CommandInput(command_fd)
+        self.adc = SimulatedADC(NOISE_MODELS[model](random.Random(seed)))
+        self.firmware = load_firmware(make_modules(self.adc, realtime), overrides)
+        self.thread = None
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        # print() in the firmware goes through sys.stdout, CR LF like MicroPython's USB CDC
+        self.stdout = sys.stdout
+        self.stdin = sys.stdin
+        sys.stdout = io.TextIOWrapper(self.sink, encoding="utf-8", newline="\r\n", write_through=True)
+        sys.stdin = self.commands
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="core0")
+        self.thread.start()
+
+    def send_command(self, line):
+        """Writes a command line (protocol.config_command) as if it came over the port."""
+        os.write(self.command_write, line)
+
+    def _run(self):
+        try:
+            self.firmware.main()
+        except Halt:
+            pass
+
+    def stop(self, timeout=5.0):
+        self.adc.halted = True
+        self.thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while sum(self.firmware.buffer_owner) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.elapsed = time.perf_counter() - self.started
+        sys.stdout.flush()
+        sys.stdout = self.stdout
+        sys.stdin = self.stdin
+
+    @property
+    def samples(self):
+        # Inline acquisition makes a second read per sample for the jitter draw
+        reads_per_sample = 1 if self.firmware.ACQUISITION == "schedule" else 2
+        return max(0, self.adc.reads - self.firmware.MAX_BATCH_SIZE) // reads_per_sample
+
+    def stats(self):
+        elapsed = self.elapsed or time.perf_counter() - self.started
+        return {
+            "seconds": round(elapsed, 3),
+            "samples": self.samples,
+            "samples_per_s": round(self.samples / elapsed) if elapsed else 0,
+            "batches_per_s": round(self.samples / self.firmware.config[0] / elapsed, 1) if elapsed else 0.0,
+            "bytes_out": self.sink.bytes_out,
+        }
+
+
+def run_parsed(model, mode="binary", batches=64, seed=0, commands=(), **overrides):
+    """Runs the firmware until it has produced `batches` batch (or health) records; returns all records."""
+    parser = protocol.make_parser(mode)
+    records = []
+    sink = SerialSink(lambda data: records.extend(parser.feed(data)))
+    sim = Simulator(sink, model, seed, OUTPUT_MODE=mode, TELEMETRY_INTERVAL_MS=0, **overrides)
+    for command in commands:
+        sim.send_command(command)
+    sim.start()
+    deadline = time.monotonic() + 60
+    while len(outcomes_of(records)) < batches and time.monotonic() < deadline:
+        time.sleep(0.02)
+    sim.stop()
+    return records, sim
+
+
+def batches_of(records):
+    return [r for r in records if isinstance(r, protocol.BatchRecord)]
+
+
+def outcomes_of(records):
+    """One record per batch the firmware took: the batch itself, or the health event that replaced it."""
+    return [r for r in records if isinstance(r, (protocol.BatchRecord, protocol.HealthRecord))]
+
+
+def check(batches=32):
+    """
+    Health check: healthy models must pass every batch; a dead input must
+    have every batch suppressed by the health tests; glitches only some.
+    """
+    expect = {"gaussian": "healthy", "pulse": "healthy", "stuck": "suppressed", "floating": "suppressed",
+              "glitch": "mixed"}
+    failed = False
+    for model, expected in expect.items():
+        for mode in ("text", "binary"):
+            records, sim = run_parsed(model, mode, batches)
+            outcomes = outcomes_of(records)[:batches]
+            passed = batches_of(outcomes)
+            health = [r for r in outcomes if isinstance(r, protocol.HealthRecord)]
+            h_min = [r.h_min for r in passed]
+            squelched = sum(r.range < 200 and r.h_min == 0.0 for r in passed)
+            # Suppressed batches still use up their sequence number, in both formats
+            seqs_ok = [r.seq for r in outcomes] == list(range(len(outcomes)))
+            if expected == "healthy":
+                ok = len(passed) == batches and not squelched and min(h_min) > 5.0
+            elif expected == "suppressed":
+                ok = len(health) == batches
+            else:
+                ok = 0 < len(health) < batches and all(r.tests & protocol.HEALTH_RCT for r in health)
+            ok = ok and seqs_ok
+            failed |= not ok
+            mean = sum(h_min) / len(h_min) if h_min else float("nan")
+            print(f"{'OK  ' if ok else 'FAIL'} {model:9s} {mode:6s} {len(passed):3d} batches, "
+                  f"{len(health):3d} suppressed, mean H_min {mean:.4f}, {squelched} squelched, "
+                  f"{sim.stats()['batches_per_s']} batches/s", file=sys.stderr)
+    return (check_health() and check_kernels() and check_streaming() and check_config()
+            and check_conditioning() and not failed)
+
+
+def check_health():
+    """The boot-time cutoffs against an exact binomial tail (SP 800-90B 4.4.2)."""
+    from fractions import Fraction
+    firmware = load_firmware(make_modules(SimulatedADC(None)))
+    window = firmware.APT_WINDOW
+    alpha = Fraction(1, 2 ** firmware.HEALTH_ALPHA_LOG2)
+    ok = True
+    for h in (1, 2, 4, 8):
+        p = Fraction(1, 2 ** h)
+        tail = Fraction(0)
+        apt = window + 1
+        while apt > 1:
+            term = math.comb(window, apt - 1) * p ** (apt - 1) * (1 - p) ** (window - apt + 1)
+            if tail + term > alpha:
+                break
+            tail += term
+            apt -= 1
+        rct = 1 + math.ceil(firmware.HEALTH_ALPHA_LOG2 / h)
+        ok &= firmware.health_cutoffs(h) == (rct, apt)
+    print(f"{'OK  ' if ok else 'FAIL'} health    cutoffs match the exact binomial tail", file=sys.stderr)
+    return ok
+
+
+def check_config(batches=24):
+    """
+    Reconfigures the firmware over the command channel and checks the result
+    against analysis.BatchAnalyzer run on the raw samples it streamed.
+    """
+    commands = [protocol.config_command("lag_depth", 8), protocol.config_command("window", 4),
+                protocol.config_command("window", 0)]   # The last one is out of range
+    records, sim = run_parsed("pulse", "binary", batches, commands=commands, STREAM_RAW=True)
+    configs = [r for r in records if isinstance(r, protocol.ConfigRecord)]
+    ok = len(configs) == 1 + len(commands) and configs[-1][1:] == (1024, 8, 4, 0)
+
+    # A config reply carries the seq of the first batch that uses it
+    raw = {r.seq: r.packed for r in records if isinstance(r, protocol.RawRecord)}
+    after = [r for r in batches_of(records) if r.seq >= configs[-1].seq and r.seq in raw]
+    samples = np.concatenate([rawcapture.unpack12(raw[r.seq]) for r in after])
+    expected = analysis.BatchAnalyzer(1024, 8, window=4).process(samples)
+    ok = ok and len(after) >= batches // 2 and all(
+        protocol.hmin_to_fixed(r.h_min) == protocol.hmin_to_fixed(e) for r, e in zip(after, expected.min_entropy))
+
+    # Batch size change: new batches come out at the new size
+    records, sim = run_parsed("gaussian", "binary", batches, STREAM_RAW=True,
+                              commands=[protocol.config_command("batch_size", 2048)])
+    sizes = [len(r.packed) for r in records if isinstance(r, protocol.RawRecord)]
+    ok = ok and sizes[0] == 1536 and sizes[-1] == 3072 and batches_of(records)[-1].h_min > 8.0
+
+    print(f"{'OK  ' if ok else 'FAIL'} config    binary  lag/window/batch_size over the command channel, "
+          f"{len(after)} windowed batches match analysis.py", file=sys.stderr)
+    return ok
+
+
+def check_kernels(batches=16, seed=5):
+    """
+    The processing kernel against analysis.reference_stats, and its viper
+    copy against the Python one (QRNG.check_kernels, also run at boot).
+    On the host both copies run as Python, so this catches the two loops
+    drifting apart; the board's boot check covers the compiled code.
+    """
+    firmware = load_firmware(make_modules(SimulatedADC(None)))
+    ok = firmware.check_kernels()
+    rng = np.random.default_rng(seed)
+    # Same kernel calls as core1_entry's per-batch mode, over a pulse-like input
+    for lag in (1, 5, 12, 64):
+        state = firmware.kernel_state(*firmware.health_cutoffs(firmware.HEALTH_ENTROPY))
+        counts = firmware.array("H", bytes(4096 * 2))
+        history, head = [0] * lag, 0
+        for _ in range(batches):
+            raw = rng.integers(0, 1 << 16, 1024)
+            raw[::97] = 0xFFFF
+            batch = firmware.array("H", raw.tolist())
+            counts[:] = firmware.array("H", bytes(4096 * 2))
+            firmware.start_batch(state, len(batch), lag, 0)
+            firmware.process_python(batch, counts, None, state)
+            expected, head = analysis.reference_stats(raw, history, head)
+            ok &= (state[firmware.K_MIN], state[firmware.K_MAX], state[firmware.K_MAX_COUNT]) == \
+                (expected.min, expected.max, expected.max_count)
+            ok &= list(batch) == (raw & 0xFFF).tolist()
+    print(f"{'OK  ' if ok else 'FAIL'} kernels   viper and Python loops agree, and match analysis.py",
+          file=sys.stderr)
+    return ok
+
+
+def check_streaming(batches=24):
+    """
+    Sub-block hand-over (SUB_BLOCK) must not change a single output byte:
+    the same seed gives the same records with whole batches, and each
+    digest is the SHA256 of the batch's samples.
+    """
+    ok = True
+    for model in ("pulse", "glitch"):
+        runs = {}
+        for sub_block in (0, 96):
+            records, sim = run_parsed(model, "binary", batches, SUB_BLOCK=sub_block, STREAM_RAW=True)
+            runs[sub_block] = outcomes_of(records)[:batches]
+            raw = {r.seq: r.packed for r in records if isinstance(r, protocol.RawRecord)}
+            for r in batches_of(runs[sub_block]):
+                samples = rawcapture.unpack12(raw[r.seq]).astype("<u2").tobytes()
+                ok &= r.digest[:32] == hashlib.sha256(samples).digest()
+            # A batch that failed a health test doesn't stream its samples either
+            ok &= not any(r.seq in raw for r in records if isinstance(r, protocol.HealthRecord))
+        same = runs[0] == runs[96] and len(runs[0]) == batches
+        ok &= same
+        print(f"{'OK  ' if same else 'FAIL'} {model:9s} binary  sub-blocks of 96 give the same "
+              f"{len(runs[96])} records as whole batches", file=sys.stderr)
+    return ok
+
+
+def check_conditioning(batches=12):
+    """Credit-accounted output: blocks only as paid for by H_min, none from a dead input."""
+    ok = True
+    # A dead input never gets past the health tests, so it sends no batches at all
+    expect = {("gaussian", "credit"): lambda n: n and all(x == 32 for x in n),
+              ("gaussian", "extract"): lambda n: n and all(x > 32 for x in n),
+              ("floating", "credit"): lambda n: not n, ("floating", "extract"): lambda n: not n}
+    for (model, mode), good in expect.items():
+        records, sim = run_parsed(model, "binary", batches,
+                                  commands=[protocol.config_command("conditioning", mode)])
+        config = [r for r in records if isinstance(r, protocol.ConfigRecord)][-1]
+        sizes = [len(r.digest) for r in batches_of(records) if r.seq >= config.seq]
+        passed = bool(good(sizes))
+        ok &= passed
+        print(f"{'OK  ' if passed else 'FAIL'} {model:9s} {mode:7s} {sum(sizes) / len(sizes) if sizes else 0:.0f} "
+              f"conditioned bytes/batch", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run QRNG.py on the host against a simulated ADC")
+    parser.add_argument("--model", choices=sorted(NOISE_MODELS), default="gaussian")
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text",
+                        help="firmware OUTPUT_MODE")
+    parser.add_argument("--output", default="pty", help="pty, stdout, null or a file path")
+    parser.add_argument("--raw", action="store_true", help="enable STREAM_RAW")
+    parser.add_argument("--acquisition", choices=("inline", "schedule"), default="inline",
+                        help="firmware ACQUISITION mode")
+    parser.add_argument("--telemetry-ms", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=0, help="stop after this long (0 = until Ctrl-C)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--realtime", action="store_true", help="really sleep for the jitter delays")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="send a SET command at start (batch_size, lag_depth, window)")
+    parser.add_argument("--check", action="store_true", help="health check every noise model and exit")
+    parser.add_argument("--check-kernels", action="store_true",
+                        help="compare the viper and Python processing kernels and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+    if args.check_kernels:
+        sys.exit(0 if check_kernels() else 1)
+
+    command_fd = None
+    if args.output == "pty":
+        master, slave, device = open_pty()
+        sink = SerialSink(fd_writer(master))
+        command_fd = master
+        print(f"Virtual serial port: {device}", file=sys.stderr)
+    elif args.output == "stdout":
+        sink = SerialSink(fd_writer(sys.stdout.fileno()))
+    elif args.output == "null":
+        sink = SerialSink(lambda data: None)
+    else:
+        f = open(args.output, "wb")
+        sink = SerialSink(f.write)
+
+    sim = Simulator(sink, args.model, args.seed, args.realtime, command_fd, OUTPUT_MODE=args.protocol,
+                    STREAM_RAW=args.raw, TELEMETRY_INTERVAL_MS=args.telemetry_ms,
+                    ACQUISITION=args.acquisition)
+    for setting in args.set:
+        # Applied before boot, so they hold from the first batch
+        name, value = setting.split("=")
+        if not sim.firmware.handle_command(protocol.config_command(name, value).decode()):
+            parser.error(f"rejected setting {setting}")
+    sim.start()
+    try:
+        if args.seconds:
+            time.sleep(args.seconds)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    print(" ".join(f"{k}={v}" for k, v in sim.stats().items()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Streaming power spectrum and autocorrelation of the raw ADC samples, to spot
+coupling from the PIO laser drive and to pick LAG_DEPTH per board.
+
+Samples are fed in any chunking. Internally they are cut into blocks and
+every block in a chunk is transformed in one batched NumPy FFT:
+
+* spectrum  - Welch estimate: Hann-windowed NFFT-sample segments, 50% overlap,
+              the overlap carried between chunks, |X|^2 accumulated
+* autocorr  - every lag up to --max-lag at once: each block is correlated
+              against itself plus the previous max_lag samples (carried
+              over), so pairs that straddle a chunk boundary are counted once
+
+The report lists spectral peaks well above the local noise floor, in cycles per
+sample and, given the sample rate, in Hz, with the PIO pulse (250 MHz / 6
+cycles, plus harmonics) and the 500 kHz ADC conversion clock aliased down
+to the sample rate marked where a peak lines up with them. It then
+recommends a lag in 1..MAX_LAG_DEPTH for the firmware's lagged derivative:
+the current LAG_DEPTH if its autocorrelation is already indistinguishable
+from zero, else the shortest lag that is, else the one with the lowest
+|autocorrelation|. The choice is checked against the current lag with
+analysis.BatchAnalyzer.
+
+Usage:
+    python spectral.py capture.u16
+    python spectral.py --packed samples.p12 --sample-rate 180000
+    python spectral.py --port /dev/ttyACM0 --protocol binary --batches 2000   # needs STREAM_RAW
+    python spectral.py --simulate pulse --batches 200
+"""
+import argparse
+import json
+import math
+
+import numpy as np
+
+import analysis
+
+NFFT = 1024                  # Welch segment length (samples)
+MAX_LAG = 1024               # Autocorrelation lags kept
+MAX_LAG_DEPTH = 64           # Largest lag the firmware accepts (SET lag_depth)
+BLOCK = 8192                 # Autocorrelation block length per FFT row
+PEAK_DB = 10.0               # Peak threshold above the local spectral floor
+FLOOR_BINS = 16              # Half width of the running median that sets the floor
+PIO_HZ = 250e6 / 6           # square_wave: 1 cycle high + 5 low at 250 MHz
+ADC_HZ = 500e3               # RP2040 ADC conversion clock (48 MHz / 96)
+HARMONICS = 8
+
+
+class SpectralAnalyzer:
+    """Running Welch spectrum and autocorrelation; update() takes sample chunks of any size."""
+    def __init__(self, nfft=NFFT, max_lag=MAX_LAG, block=BLOCK):
+        self.nfft = nfft
+        self.hop = nfft // 2
+        self.max_lag = max_lag
+        self.block = max(block, max_lag)
+        self.window = np.hanning(nfft)
+        self.window_power = float((self.window ** 2).sum())
+        # Real FFT length for a block plus its history, rounded up for speed
+        self.acf_size = 1 << (self.block + max_lag - 1).bit_length()
+
+        self.psd_sum = np.zeros(nfft // 2 + 1)
+        self.segments = 0
+        self.psd_tail = np.zeros(0)
+
+        self.acf_sum = np.zeros(max_lag + 1)
+        self.acf_pairs = 0
+        self.history = np.zeros(0)      # Last max_lag samples already counted
+        self.pending = np.zeros(0)      # Samples waiting for a whole block
+
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, samples):
+        # Centre on mid-scale so the running sums stay well inside float64 precision
+        x = (np.asarray(samples).astype(np.int64).ravel() & 0xFFF) - 2048.0
+        if not len(x):
+            return
+        self.n += len(x)
+        self.total += float(x.sum())
+        self.total_sq += float(np.dot(x, x))
+        self._update_spectrum(x)
+        self._update_autocorr(x)
+
+    def _update_spectrum(self, x):
+        buf = np.concatenate((self.psd_tail, x))
+        if len(buf) < self.nfft:
+            self.psd_tail = buf
+            return
+        segments = np.lib.stride_tricks.sliding_window_view(buf, self.nfft)[::self.hop]
+        # Each segment's own mean comes out so the DC bin doesn't leak into its neighbours
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        spectra = np.fft.rfft(segments * self.window, axis=1)
+        self.psd_sum += (spectra.real ** 2 + spectra.imag ** 2).sum(axis=0)
+        self.segments += len(segments)
+        self.psd_tail = buf[len(segments) * self.hop:]
+
+    def _update_autocorr(self, x):
+        if len(self.history) < self.max_lag:
+            # The first max_lag samples only serve as history for later ones
+            take = min(len(x), self.max_lag - len(self.history))
+            self.history = np.concatenate((self.history, x[:take]))
+            x = x[take:]
+        buf = np.concatenate((self.pending, x))
+        whole = len(buf) - len(buf) % self.block
+        if not whole:
+            self.pending = buf
+            return
+        m = self.max_lag
+        stream = np.concatenate((self.history, buf[:whole]))
+        rows = np.lib.stride_tricks.sliding_window_view(stream, m + self.block)[::self.block]
+        # r[k] = sum_j new[j] * row[j + m - k]: the new samples against themselves and their history
+        new = np.zeros_like(rows)
+        new[:, m:] = rows[:, m:]
+        size = self.acf_size
+        r = np.fft.irfft(np.fft.rfft(new, size, axis=1) * np.conj(np.fft.rfft(rows, size, axis=1)),
+                         size, axis=1)
+        self.acf_sum += r[:, :m + 1].sum(axis=0)
+        self.acf_pairs += whole
+        self.history = stream[-m:]
+        self.pending = buf[whole:]
+
+    # ------------------------------------------------------------------------
+    def psd(self):
+        """One-sided power spectral density per frequency bin (cycles/sample), DC excluded."""
+        if not self.segments:
+            return np.zeros(0), np.zeros(0)
+        psd = self.psd_sum / (self.segments * self.window_power)
+        freqs = np.fft.rfftfreq(self.nfft)
+        return freqs[1:], psd[1:]
+
+    def autocorr(self):
+        """Autocorrelation coefficient for lags 0..max_lag."""
+        if not self.acf_pairs:
+            return np.zeros(0)
+        mean = self.total / self.n
+        var = self.total_sq / self.n - mean * mean
+        cov = self.acf_sum / self.acf_pairs - mean * mean
+        return cov / var if var > 0 else np.zeros_like(cov)
+
+    def peaks(self, threshold_db=PEAK_DB, limit=10):
+        """[(freq cycles/sample, dB above the floor)], strongest first."""
+        freqs, psd = self.psd()
+        if len(psd) < 3:
+            return []
+        # Local floor: running median over FLOOR_BINS bins either side, so
+        # correlated (red) noise doesn't count as a peak at low frequencies
+        padded = np.pad(psd, FLOOR_BINS, mode="edge")
+        floor = np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * FLOOR_BINS + 1), axis=1)
+        db = 10 * np.log10(np.maximum(psd, 1e-30) / np.maximum(floor, 1e-30))
+        local_max = np.r_[False, (psd[1:-1] > psd[:-2]) & (psd[1:-1] >= psd[2:]), False]
+        found = np.flatnonzero(local_max & (db > threshold_db))
+        found = found[np.argsort(db[found])[::-1][:limit]]
+        return [(float(freqs[i]), float(db[i])) for i in found]
+
+    def significance(self):
+        """|r| below this is indistinguishable from zero (3 sigma for white noise)."""
+        return 3 / math.sqrt(self.acf_pairs) if self.acf_pairs else float("inf")
+
+    def recommend_lag(self, max_depth=MAX_LAG_DEPTH, current=None):
+        """
+        (lag, |r|) in 1..max_depth. Lags whose correlation is within noise of
+        zero are equally good: the current lag is kept if it is one of them,
+        otherwise the shortest of them wins. With none, the lowest |r| does.
+        """
+        acf = self.autocorr()
+        if len(acf) < 2:
+            return None, None
+        candidates = np.abs(acf[1:min(max_depth, self.max_lag) + 1])
+        quiet = np.flatnonzero(candidates < self.significance())
+        if current is not None and current - 1 in quiet:
+            best = current - 1
+        elif len(quiet):
+            best = int(quiet[0])
+        else:
+            best = int(np.argmin(candidates))
+        return best + 1, float(candidates[best])
+
+
+def alias(freq_hz, sample_rate):
+    """Apparent frequency of freq_hz when sampled at sample_rate, in cycles/sample (0-0.5)."""
+    f = (freq_hz / sample_rate) % 1.0
+    return min(f, 1.0 - f)
+
+
+def known_lines(sample_rate):
+    """{name: cycles/sample} for the PIO drive and ADC clock harmonics, folded to the sample rate."""
+    lines = {}
+    for h in range(1, HARMONICS + 1):
+        lines[f"PIO x{h}" if h > 1 else "PIO"] = alias(h * PIO_HZ, sample_rate)
+        lines[f"ADC x{h}" if h > 1 else "ADC"] = alias(h * ADC_HZ, sample_rate)
+    return lines
+
+
+def attribute(freq, sample_rate, tolerance):
+    """Names of the known lines within tolerance (cycles/sample) of freq."""
+    if not sample_rate:
+        return []
+    return [name for name, f in known_lines(sample_rate).items() if abs(f - freq) <= tolerance]
+
+
+def hmin_by_lag(samples, lags, batch_size=analysis.BATCH_SIZE):
+    """Mean per-batch H_min of the lagged derivative for each lag (analysis.BatchAnalyzer)."""
+    usable = len(samples) - len(samples) % batch_size
+    if not usable:
+        return {}
+    return {lag: float(analysis.BatchAnalyzer(batch_size, lag).process(samples[:usable]).min_entropy.mean())
+            for lag in lags}
+
+
+def report(analyzer, sample_rate=None, current_lag=analysis.LAG_DEPTH, check_samples=None,
+           batch_size=analysis.BATCH_SIZE):
+    peaks = analyzer.peaks()
+    tolerance = 1.5 / analyzer.nfft
+    lag, corr = analyzer.recommend_lag(current=current_lag)
+    acf = analyzer.autocorr()
+    result = {
+        "samples": analyzer.n,
+        "segments": analyzer.segments,
+        "sample_rate": sample_rate,
+        "peaks": [{
+            "cycles_per_sample": round(f, 6),
+            "period_samples": round(1 / f, 2),
+            "hz": round(f * sample_rate, 1) if sample_rate else None,
+            "db": round(db, 1),
+            "sources": attribute(f, sample_rate, tolerance),
+        } for f, db in peaks],
+        "recommended_lag": lag,
+        "recommended_lag_autocorr": corr,
+        "significance": analyzer.significance(),
+        "current_lag": current_lag,
+        "current_lag_autocorr": float(acf[current_lag]) if len(acf) > current_lag else None,
+        "autocorr_1_to_16": [round(float(v), 5) for v in acf[1:17]],
+    }
+    if check_samples is not None and lag:
+        result["h_min_by_lag"] = {str(k): round(v, 4) for k, v in
+                                  hmin_by_lag(check_samples, sorted({current_lag, lag}), batch_size).items()}
+    return result
+
+
+def print_report(r):
+    print(f"Samples: {r['samples']:,} ({r['segments']} spectrum segments)")
+    if r["peaks"]:
+        print("Spectral peaks:")
+        for p in r["peaks"]:
+            hz = f"{p['hz']:>12,.1f} Hz" if p["hz"] is not None else ""
+            src = ("  <- " + ", ".join(p["sources"])) if p["sources"] else ""
+            print(f"  {p['cycles_per_sample']:.5f} cyc/S (period {p['period_samples']:8.2f} S) "
+                  f"{hz} {p['db']:+6.1f} dB{src}")
+    else:
+        print("Spectral peaks: none above the floor")
+    print("Autocorrelation, lags 1-16: " + " ".join(f"{v:+.3f}" for v in r["autocorr_1_to_16"]))
+    if r["recommended_lag"]:
+        print(f"Recommended LAG_DEPTH: {r['recommended_lag']} (|r| = {r['recommended_lag_autocorr']:.5f}, "
+              f"noise level {r['significance']:.5f}); current {r['current_lag']} has r = {r['current_lag_autocorr']:+.5f}")
+    if "h_min_by_lag" in r:
+        print("Mean H_min by lag: " + ", ".join(f"{k}: {v:.4f}" for k, v in r["h_min_by_lag"].items()))
+
+
+# ----------------------------------------------------------------------------
+# SOURCES
+# ----------------------------------------------------------------------------
+def file_chunks(path, packed=False, chunk=1 << 20):
+    """Raw uint16 (.u16) or packed 12-bit (.p12) captures, streamed in chunks."""
+    if packed:
+        from rawcapture import unpack12
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        step = chunk * 3 // 2
+        for i in range(0, len(data), step):
+            yield unpack12(data[i:i + step])
+    else:
+        samples = np.memmap(path, dtype="<u2", mode="r")
+        for i in range(0, len(samples), chunk):
+            yield samples[i:i + chunk]
+
+
+def live_chunks(records, batches, rates, configs):
+    """Unpacks RawRecords (firmware STREAM_RAW); telemetry and the batch size give the sample rate."""
+    import protocol
+    from rawcapture import unpack12
+    seen = 0
+    for record in records:
+        if isinstance(record, protocol.TelemetryRecord) and record.interval_ms and record.acquired:
+            rates.append(record)
+        elif isinstance(record, protocol.ConfigRecord):
+            configs.append(record)
+        elif isinstance(record, protocol.RawRecord):
+            yield unpack12(record.packed)
+            seen += 1
+            if seen >= batches:
+                return
+
+
+def simulated_chunks(model, batches, seed=0, batch_size=analysis.BATCH_SIZE):
+    """12-bit codes straight from a simulator.py noise model, as main.c's adc_read() sees them."""
+    import random
+    import simulator
+    noise = simulator.NOISE_MODELS[model](random.Random(seed))
+    for _ in range(batches):
+        yield np.array(noise.block(batch_size), dtype=np.uint16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming spectrum / autocorrelation of raw ADC samples")
+    parser.add_argument("capture", nargs="?", help="raw little-endian uint16 sample file")
+    parser.add_argument("--packed", action="store_true", help="capture is packed 12-bit (rawcapture.py)")
+    parser.add_argument("--port", help="read live raw frames (STREAM_RAW) from a serial port")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text")
+    parser.add_argument("--simulate", metavar="MODEL", help="samples from a simulator.py noise model")
+    parser.add_argument("--batches", type=int, default=500, help="batches to read with --port / --simulate")
+    parser.add_argument("--sample-rate", type=float, help="samples/s, to report peaks in Hz and match "
+                        "PIO / ADC lines (taken from telemetry when reading live)")
+    parser.add_argument("--nfft", type=int, default=NFFT)
+    parser.add_argument("--max-lag", type=int, default=MAX_LAG)
+    parser.add_argument("--lag-depth", type=int, default=analysis.LAG_DEPTH, help="current firmware LAG_DEPTH")
+    parser.add_argument("--batch-size", type=int, default=analysis.BATCH_SIZE,
+                        help="samples per batch (taken from the device's CFG when reading live)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    analyzer = SpectralAnalyzer(args.nfft, args.max_lag)
+    rates = []
+    configs = []
+    if args.simulate:
+        chunks = simulated_chunks(args.simulate, args.batches, batch_size=args.batch_size)
+    elif args.port:
+        import protocol
+        # GET makes the device report its settings, batch size included
+        records = protocol.serial_records(args.port, args.baud, args.protocol,
+                                          commands=[protocol.config_command(None)])
+        chunks = live_chunks(records, args.batches, rates, configs)
+    elif args.capture:
+        chunks = file_chunks(args.capture, args.packed)
+    else:
+        parser.error("give a capture file, --port or --simulate")
+
+    def batch_size():
+        return configs[-1].batch_size if configs else args.batch_size
+
+    # Keep the first few batches for the H_min cross-check
+    check = []
+    kept = 0
+    for samples in chunks:
+        analyzer.update(samples)
+        if kept < 64 * batch_size():
+            check.append(np.asarray(samples[:64 * batch_size() - kept]))
+            kept += len(check[-1])
+
+    sample_rate = args.sample_rate
+    if sample_rate is None and rates:
+        last = rates[-1]
+        sample_rate = last.acquired * batch_size() / (last.interval_ms / 1000)
+    check = np.concatenate(check) if check else None
+    result = report(analyzer, sample_rate, args.lag_depth, check, batch_size())
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Online ent / NIST-style quality statistics over a stream of output bytes.
+
+Instead of dumping 256 MB and running `ent` and `assess` afterwards, this
+keeps running sums that are updated one chunk at a time with NumPy, in
+constant memory:
+
+* monobit frequency (NIST 2.1)     * chi-square of the byte histogram (ent)
+* block frequency, M = 128 (2.2)   * arithmetic mean and Shannon entropy (ent)
+* runs (NIST 2.3)                  * serial correlation coefficient (ent)
+* Monte Carlo estimate of pi (ent)
+
+RollingMonitor reports fixed-size windows as they complete, plus totals
+since start.
+
+Usage:
+    python streamstats.py qrng_dump.bin
+    python streamstats.py --socket /tmp/qrng.sock --window 1000000   # live, from harvestd.py
+"""
+import argparse
+import math
+import sys
+from collections import deque
+
+import numpy as np
+
+BLOCK_BITS = 128              # NIST block frequency block length M
+MC_COORD_BYTES = 3            # ent uses 24-bit Monte Carlo coordinates
+MC_RADIUS_SQ = float((256 ** MC_COORD_BYTES - 1) ** 2)
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+BYTE_VALUES = np.arange(256, dtype=np.float64)
+
+
+# ----------------------------------------------------------------------------
+# SPECIAL FUNCTIONS (no SciPy dependency)
+# ----------------------------------------------------------------------------
+def igamc(a, x):
+    """Regularised upper incomplete gamma function Q(a, x), as used by NIST STS."""
+    if x <= 0 or a <= 0:
+        return 1.0
+    if x < a + 1:
+        # Series for P(a, x)
+        term = total = 1.0 / a
+        n = a
+        for _ in range(10000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(-x + a * math.log(x) - math.lgamma(a)))
+    # Continued fraction for Q(a, x) (modified Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(-x + a * math.log(x) - math.lgamma(a)) * h
+
+
+# ----------------------------------------------------------------------------
+# ACCUMULATOR
+# ----------------------------------------------------------------------------
+class StreamStats:
+    """Running statistics; update() takes chunks of any size."""
+    def __init__(self):
+        self.n_bytes = 0
+        self.byte_counts = np.zeros(256, dtype=np.int64)
+        self.ones = 0
+        self.transitions = 0          # Bit changes, for the runs test
+        self.last_bit = None
+
+        self.block_chi = 0.0          # Sum of (pi_i - 1/2)^2 over complete blocks
+        self.blocks = 0
+        self.block_tail = np.zeros(0, dtype=np.uint8)
+
+        self.first_byte = None        # ent wraps the last byte onto the first
+        self.last_byte = None
+        self.sum_xy = 0.0
+
+        self.mc_tail = np.zeros(0, dtype=np.uint8)
+        self.mc_points = 0
+        self.mc_inside = 0
+
+    def update(self, data):
+        chunk = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+        if not len(chunk):
+            return
+        self.n_bytes += len(chunk)
+        self.byte_counts += np.bincount(chunk, minlength=256)
+        self.ones += int(POPCOUNT[chunk].sum())
+
+        # Runs: count bit transitions, including across chunk boundaries
+        bits = np.unpackbits(chunk)
+        self.transitions += int(np.count_nonzero(bits[1:] != bits[:-1]))
+        if self.last_bit is not None and bits[0] != self.last_bit:
+            self.transitions += 1
+        self.last_bit = bits[-1]
+
+        # Block frequency over whole BLOCK_BITS blocks
+        block_bytes = BLOCK_BITS // 8
+        pending = np.concatenate((self.block_tail, chunk))
+        whole = len(pending) - len(pending) % block_bytes
+        if whole:
+            ones = POPCOUNT[pending[:whole]].reshape(-1, block_bytes).sum(axis=1)
+            self.block_chi += float(((ones / BLOCK_BITS - 0.5) ** 2).sum())
+            self.blocks += whole // block_bytes
+        self.block_tail = pending[whole:].copy()
+
+        # Serial correlation (lag-1 byte products)
+        x = chunk.astype(np.float64)
+        if self.first_byte is None:
+            self.first_byte = float(x[0])
+        else:
+            self.sum_xy += self.last_byte * x[0]
+        self.sum_xy += float(np.dot(x[:-1], x[1:]))
+        self.last_byte = float(x[-1])
+
+        # Monte Carlo pi over 6-byte (x, y) groups
+        group = 2 * MC_COORD_BYTES
+        pending = np.concatenate((self.mc_tail, chunk))
+        whole = len(pending) - len(pending) % group
+        if whole:
+            g = pending[:whole].reshape(-1, group).astype(np.float64)
+            weights = 256.0 ** np.arange(MC_COORD_BYTES - 1, -1, -1)
+            px = g[:, :MC_COORD_BYTES] @ weights
+            py = g[:, MC_COORD_BYTES:] @ weights
+            self.mc_inside += int(np.count_nonzero(px * px + py * py <= MC_RADIUS_SQ))
+            self.mc_points += len(g)
+        self.mc_tail = pending[whole:].copy()
+
+    def report(self):
+        n = self.n_bytes
+        n_bits = 8 * n
+        if not n:
+            return {"bytes": 0}
+        counts = self.byte_counts
+        expected = n / 256
+        chi_square = float(((counts - expected) ** 2 / expected).sum())
+        p = counts[counts > 0] / n
+
+        # NIST monobit
+        s_obs = abs(2 * self.ones - n_bits) / math.sqrt(n_bits)
+        pi = self.ones / n_bits
+
+        # NIST runs (only meaningful if the monobit prerequisite holds)
+        runs_p = 0.0
+        if abs(pi - 0.5) < 2 / math.sqrt(n_bits):
+            v_obs = self.transitions + 1
+            runs_p = math.erfc(abs(v_obs - 2 * n_bits * pi * (1 - pi))
+                               / (2 * math.sqrt(2 * n_bits) * pi * (1 - pi)))
+
+        # ent serial correlation, with the wrap-around term
+        s1 = float((counts * BYTE_VALUES).sum())
+        s2 = float((counts * BYTE_VALUES ** 2).sum())
+        sxy = self.sum_xy + self.last_byte * self.first_byte
+        denom = n * s2 - s1 * s1
+        scc = (n * sxy - s1 * s1) / denom if denom else 1.0
+
+        return {
+            "bytes": n,
+            "entropy_bits_per_byte": float(-(p * np.log2(p)).sum()),
+            "chi_square": chi_square,
+            "chi_square_p": igamc(255 / 2, chi_square / 2),
+            "mean": s1 / n,
+            "monobit_p": math.erfc(s_obs / math.sqrt(2)),
+            "block_frequency_p": igamc(self.blocks / 2, 2 * BLOCK_BITS * self.block_chi) if self.blocks else None,
+            "runs_p": runs_p,
+            "serial_correlation": scc,
+            "monte_carlo_pi": 4 * self.mc_inside / self.mc_points if self.mc_points else None,
+        }
+
+
+class RollingMonitor:
+    """Cumulative statistics plus tumbling windows of window_bytes each."""
+    def __init__(self, window_bytes=1 << 20, keep=16):
+        self.window_bytes = window_bytes
+        self.total = StreamStats()
+        self.window = StreamStats()
+        self.windows = deque(maxlen=keep)
+
+    def update(self, data):
+        """Returns the reports of any windows completed by this chunk."""
+        chunk = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+        completed = []
+        self.total.update(chunk)
+        while len(chunk):
+            take = min(len(chunk), self.window_bytes - self.window.n_bytes)
+            self.window.update(chunk[:take])
+            chunk = chunk[take:]
+            if self.window.n_bytes >= self.window_bytes:
+                report = self.window.report()
+                self.windows.append(report)
+                completed.append(report)
+                self.window = StreamStats()
+        return completed
+
+
+def format_report(r):
+    def p(v):
+        return "  n/a  " if v is None else f"{v:.5f}"
+    return (f"{r['bytes']:>12,} B | H {r['entropy_bits_per_byte']:.6f} | "
+            f"chi2 {r['chi_square']:8.2f} (p {p(r['chi_square_p'])}) | mean {r['mean']:8.4f} | "
+            f"pi {p(r['monte_carlo_pi'])} | scc {r['serial_correlation']:+.6f} | "
+            f"monobit {p(r['monobit_p'])} | block {p(r['block_frequency_p'])} | runs {p(r['runs_p'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming randomness statistics")
+    parser.add_argument("file", nargs="?", help="binary file to read ('-' for stdin)")
+    parser.add_argument("--socket", help="read live from a harvestd.py socket instead")
+    parser.add_argument("--window", type=int, default=1 << 20, help="window size in bytes")
+    parser.add_argument("--chunk", type=int, default=1 << 16)
+    args = parser.parse_args()
+
+    monitor = RollingMonitor(args.window)
+    if args.socket:
+        import harvestd
+        chunks = iter(lambda: harvestd.get_bytes(args.chunk, args.socket), b"")
+    else:
+        f = sys.stdin.buffer if args.file in (None, "-") else open(args.file, "rb")
+        chunks = iter(lambda: f.read(args.chunk), b"")
+
+    try:
+        for chunk in chunks:
+            for report in monitor.update(chunk):
+                print("window " + format_report(report), flush=True)
+    except KeyboardInterrupt:
+        pass
+    print("total  " + format_report(monitor.total.report()))
+
+
+if __name__ == "__main__":
+    main()
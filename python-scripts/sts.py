@@ -0,0 +1,782 @@
+"""
+Parallel NIST STS battery over a binary capture, in place of `assess`.
+
+The capture is cut into --streams consecutive bitstreams of --bits bits
+(MSB first, like `assess` in binary input mode) and every stream runs the
+15 SP 800-22 tests in a process pool, one stream per task, so the wall time
+drops with the number of cores. The tests are NumPy ports of sts-2.1.2 with
+the same parameters and constants as `assess` (including its
+OverlappingTemplate probabilities and LinearComplexity pi_0), vectorised
+over the whole stream rather than bit by bit:
+
+* every m-bit pattern test (templates, serial, approximate entropy) reads
+  one array of circular sliding windows, counted with bincount
+* rank eliminates all 32x32 matrices of a stream at once
+* linear complexity runs Berlekamp-Massey on all M-bit blocks at once
+* random excursions splits the walk into cycles with one bincount
+
+The report has the layout of finalAnalysisReport (see
+20260209-finalAnalysisReport-nist-sts-2.1.2-1000000-200.txt): the P-value
+histogram in ten bins, the uniformity P-value and the pass proportion of
+every test. The exit code is 1 when more than --max-flagged rows are
+flagged, so the runner can gate a board before it ships. --check runs the worked examples from
+SP 800-22 and cross-checks the vectorised kernels against direct loops.
+
+Usage:
+    python sts.py qrng_dump.bin                        # 200 x 1,000,000 bits, like `assess 1000000`
+    python sts.py qrng_dump.bin --streams 100 --workers 8 --output finalAnalysisReport.txt
+    python sts.py --check
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from streamstats import igamc
+
+STREAM_BITS = 1000000
+STREAMS = 200
+ALPHA = 0.01
+
+# Parameter adjustments, the `assess` defaults
+Params = namedtuple("Params", "block_frequency non_overlapping overlapping apen serial linear_complexity")
+DEFAULT_PARAMS = Params(block_frequency=128, non_overlapping=9, overlapping=9, apen=10, serial=16,
+                        linear_complexity=500)
+
+MAX_TEMPLATES = 148          # assess never runs more NonOverlappingTemplate templates than this
+TEMPLATE_BLOCKS = 8          # NonOverlappingTemplate N
+OVERLAPPING_BLOCK = 1032     # OverlappingTemplate M
+EXCURSION_STATES = (-4, -3, -2, -1, 1, 2, 3, 4)
+VARIANT_STATES = tuple(x for x in range(-9, 10) if x)
+
+# Universal: (minimum n, L), and the expected value / variance of f_n per L
+UNIVERSAL_L = ((1059061760, 16), (496435200, 15), (231669760, 14), (107560960, 13), (49643520, 12),
+               (22753280, 11), (10342400, 10), (4654080, 9), (2068480, 8), (904960, 7), (387840, 6))
+UNIVERSAL_EXPECTED = (0, 0.73264948, 1.5374383, 2.40160681, 3.31122472, 4.25342659, 5.2177052, 6.1962507,
+                      7.1836656, 8.1764248, 9.1723243, 10.170032, 11.168765, 12.168070, 13.167693,
+                      14.167488, 15.167379)
+UNIVERSAL_VARIANCE = (0, 0.690, 1.338, 1.901, 2.358, 2.705, 2.954, 3.125, 3.238, 3.311, 3.356, 3.384,
+                      3.401, 3.410, 3.416, 3.419, 3.421)
+
+# LongestRun: (minimum n, M, V_0, pi)
+LONGEST_RUN = ((750000, 10000, 10, (0.0882, 0.2092, 0.2483, 0.1933, 0.1208, 0.0675, 0.0727)),
+               (6272, 128, 4, (0.1174, 0.2430, 0.2493, 0.1752, 0.1027, 0.1124)),
+               (128, 8, 1, (0.2148, 0.3672, 0.2305, 0.1875)))
+
+LINEAR_COMPLEXITY_PI = (0.01047, 0.03125, 0.12500, 0.50000, 0.25000, 0.06250, 0.020833)
+
+# Report rows, in finalAnalysisReport order
+TESTS = ("Frequency", "BlockFrequency", "CumulativeSums", "Runs", "LongestRun", "Rank", "FFT",
+         "NonOverlappingTemplate", "OverlappingTemplate", "Universal", "ApproximateEntropy",
+         "RandomExcursions", "RandomExcursionsVariant", "Serial", "LinearComplexity")
+
+
+def normal_cdf(x):
+    return 0.5 * math.erfc(-x / math.sqrt(2))
+
+
+def c_div(a, b):
+    """C integer division (truncates toward zero), for the cusum bounds."""
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b > 0) else -q
+
+
+# ----------------------------------------------------------------------------
+# SEQUENCE
+# ----------------------------------------------------------------------------
+class Sequence:
+    """
+    One bitstream (uint8 array of 0/1) plus its circular sliding-window
+    patterns: patterns(m)[i] is bits i..i+m-1 (wrapping) as an integer, MSB
+    first. The widest window is built once and narrower ones are shifts of it.
+    """
+    def __init__(self, bits, width=0):
+        self.bits = np.asarray(bits, dtype=np.uint8)
+        self.n = len(self.bits)
+        self.width = width
+        self.windows = None
+
+    def patterns(self, m):
+        if self.windows is None or m > self.width:
+            self.width = max(self.width, m)
+            ext = np.concatenate((self.bits, self.bits[:self.width - 1]))
+            w = np.zeros(self.n, dtype=np.int64 if self.width > 30 else np.int32)
+            for j in range(self.width):
+                w <<= 1
+                w |= ext[j:j + self.n]
+            self.windows = w
+        return self.windows >> (self.width - m)
+
+    def walk(self):
+        """Partial sums of the +/-1 sequence."""
+        return np.cumsum(self.bits.astype(np.int32) * 2 - 1)
+
+
+# ----------------------------------------------------------------------------
+# TESTS (each returns a list of P-values, or None when it doesn't apply)
+# ----------------------------------------------------------------------------
+def frequency(seq):
+    s = 2 * int(np.count_nonzero(seq.bits)) - seq.n
+    return [math.erfc(abs(s) / math.sqrt(seq.n) / math.sqrt(2))]
+
+
+def block_frequency(seq, M):
+    N = seq.n // M
+    if not N:
+        return None
+    pi = seq.bits[:N * M].reshape(N, M).sum(axis=1) / M
+    chi2 = 4 * M * float(((pi - 0.5) ** 2).sum())
+    return [igamc(N / 2, chi2 / 2)]
+
+
+def cusum_p(n, z):
+    sum1 = sum(normal_cdf((4 * k + 1) * z / math.sqrt(n)) - normal_cdf((4 * k - 1) * z / math.sqrt(n))
+               for k in range(c_div(c_div(-n, z) + 1, 4), c_div(c_div(n, z) - 1, 4) + 1))
+    sum2 = sum(normal_cdf((4 * k + 3) * z / math.sqrt(n)) - normal_cdf((4 * k + 1) * z / math.sqrt(n))
+               for k in range(c_div(c_div(-n, z) - 3, 4), c_div(c_div(n, z) - 1, 4) + 1))
+    return 1 - sum1 + sum2
+
+
+def cumulative_sums(seq):
+    """Forward and reverse."""
+    s = seq.walk()
+    forward = int(np.abs(s).max())
+    backward = int(np.abs(s[-1] - np.concatenate(([0], s[:-1]))).max())
+    return [cusum_p(seq.n, forward), cusum_p(seq.n, backward)]
+
+
+def runs(seq):
+    n = seq.n
+    pi = np.count_nonzero(seq.bits) / n
+    if abs(pi - 0.5) >= 2 / math.sqrt(n):
+        return [0.0]
+    v = 1 + int(np.count_nonzero(seq.bits[1:] != seq.bits[:-1]))
+    return [math.erfc(abs(v - 2 * n * pi * (1 - pi)) / (2 * math.sqrt(2 * n) * pi * (1 - pi)))]
+
+
+def longest_runs(blocks):
+    """Longest run of ones in every row."""
+    N, M = blocks.shape
+    padded = np.zeros((N, M + 2), dtype=np.int8)
+    padded[:, 1:-1] = blocks
+    edges = np.diff(padded.ravel())
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    longest = np.zeros(N, dtype=np.int64)
+    np.maximum.at(longest, starts // (M + 2), ends - starts)
+    return longest
+
+
+def longest_run(seq):
+    for min_n, M, v0, pi in LONGEST_RUN:
+        if seq.n >= min_n:
+            break
+    else:
+        return None
+    N = seq.n // M
+    K = len(pi) - 1
+    v = np.clip(longest_runs(seq.bits[:N * M].reshape(N, M)) - v0, 0, K)
+    nu = np.bincount(v, minlength=K + 1)
+    expected = N * np.array(pi)
+    return [igamc(K / 2, float(((nu - expected) ** 2 / expected).sum()) / 2)]
+
+
+def gf2_ranks(rows, size):
+    """GF(2) rank of every matrix; rows is (count, size) with each row packed into an integer."""
+    rows = rows.copy()
+    count = len(rows)
+    index = np.arange(count)
+    used = np.zeros(rows.shape, dtype=bool)
+    rank = np.zeros(count, dtype=np.int64)
+    for col in range(size):
+        bit = np.uint64(1 << (size - 1 - col))
+        has = (rows & bit) != 0
+        candidates = has & ~used
+        found = candidates.any(axis=1)
+        pivot = candidates.argmax(axis=1)
+        value = np.where(found, rows[index, pivot], 0)
+        eliminate = has & found[:, None]
+        eliminate[index, pivot] = False
+        rows ^= np.where(eliminate, value[:, None], np.uint64(0))
+        used[index[found], pivot[found]] = True
+        rank += found
+    return rank
+
+
+def rank_probability(r, m=32, q=32):
+    product = 1.0
+    for i in range(r):
+        product *= (1 - 2.0 ** (i - q)) * (1 - 2.0 ** (i - m)) / (1 - 2.0 ** (i - r))
+    return 2.0 ** (r * (q + m - r) - m * q) * product
+
+
+def rank(seq, size=32):
+    N = seq.n // (size * size)
+    if not N:
+        return None
+    weights = np.uint64(1) << np.arange(size - 1, -1, -1, dtype=np.uint64)
+    rows = (seq.bits[:N * size * size].reshape(N, size, size).astype(np.uint64) * weights).sum(axis=2)
+    ranks = gf2_ranks(rows, size)
+    full = int(np.count_nonzero(ranks == size))
+    short = int(np.count_nonzero(ranks == size - 1))
+    p_full = rank_probability(size, size, size)
+    p_short = rank_probability(size - 1, size, size)
+    observed = (full, short, N - full - short)
+    expected = (p_full * N, p_short * N, (1 - p_full - p_short) * N)
+    chi2 = sum((o - e) ** 2 / e for o, e in zip(observed, expected))
+    return [math.exp(-chi2 / 2)]
+
+
+def dft(seq):
+    n = seq.n
+    magnitude = np.abs(np.fft.rfft(seq.bits.astype(np.float64) * 2 - 1))[:n // 2]
+    n1 = int(np.count_nonzero(magnitude < math.sqrt(math.log(20) * n)))
+    d = (n1 - 0.95 * n / 2) / math.sqrt(n / 4 * 0.95 * 0.05)
+    return [math.erfc(abs(d) / math.sqrt(2))]
+
+
+def aperiodic_templates(m):
+    """m-bit templates that can't overlap themselves, in ascending order (the sts templates/ files)."""
+    out = []
+    for t in range(1 << m):
+        bits = format(t, f"0{m}b")
+        if all(bits[:m - k] != bits[k:] for k in range(1, m)):
+            out.append(t)
+    return out
+
+
+def block_pattern_counts(seq, m, blocks, M):
+    """(blocks, 2^m) counts of the m-bit patterns starting in each M-bit block and ending inside it."""
+    windows = seq.patterns(m)[:blocks * M].reshape(blocks, M)[:, :M - m + 1]
+    offsets = (np.arange(blocks) << m)[:, None]
+    return np.bincount((windows + offsets).ravel(), minlength=blocks << m).reshape(blocks, 1 << m)
+
+
+def non_overlapping_template(seq, m, blocks=TEMPLATE_BLOCKS, templates=None):
+    """
+    Aperiodic templates can't overlap themselves, so skipping m bits after
+    each match (as the test specifies) counts exactly the plain matches.
+    """
+    M = seq.n // blocks
+    if templates is None:
+        templates = aperiodic_templates(m)[:MAX_TEMPLATES]
+    W = block_pattern_counts(seq, m, blocks, M)[:, templates]
+    mu = (M - m + 1) / 2 ** m
+    var = M * (1 / 2 ** m - (2 * m - 1) / 2 ** (2 * m))
+    chi2 = ((W - mu) ** 2 / var).sum(axis=0)
+    return [igamc(blocks / 2, float(c) / 2) for c in chi2]
+
+
+def overlapping_probability(u, eta):
+    """sts-2.1.2 Pr(u, eta), which `assess` uses for the class probabilities."""
+    if u == 0:
+        return math.exp(-eta)
+    return sum(math.exp(-eta - u * math.log(2) + l * math.log(eta) - math.lgamma(l + 1) + math.lgamma(u)
+                        - math.lgamma(l) - math.lgamma(u - l + 1)) for l in range(1, u + 1))
+
+
+def overlapping_template(seq, m, M=OVERLAPPING_BLOCK, K=5):
+    N = seq.n // M
+    if not N:
+        return None
+    windows = seq.patterns(m)[:N * M].reshape(N, M)[:, :M - m + 1]
+    W = np.minimum(np.count_nonzero(windows == (1 << m) - 1, axis=1), K)
+    nu = np.bincount(W, minlength=K + 1)
+    eta = (M - m + 1) / 2 ** m / 2
+    pi = [overlapping_probability(u, eta) for u in range(K)]
+    pi.append(1 - sum(pi))
+    expected = N * np.array(pi)
+    return [igamc(K / 2, float(((nu - expected) ** 2 / expected).sum()) / 2)]
+
+
+def universal(seq):
+    for min_n, L in UNIVERSAL_L:
+        if seq.n >= min_n:
+            break
+    else:
+        return None
+    Q = 10 * 2 ** L
+    K = seq.n // L - Q
+    weights = 1 << np.arange(L - 1, -1, -1)
+    values = seq.bits[:(Q + K) * L].reshape(Q + K, L) @ weights
+    # Index (1-based) of the previous block with the same value, 0 if none
+    order = np.argsort(values, kind="stable")
+    same = values[order[1:]] == values[order[:-1]]
+    previous = np.zeros(Q + K, dtype=np.int64)
+    previous[order[1:][same]] = order[:-1][same] + 1
+    index = np.arange(Q + 1, Q + K + 1)
+    phi = float(np.log2(index - previous[Q:]).sum()) / K
+    c = 0.7 - 0.8 / L + (4 + 32 / L) * K ** (-3 / L) / 15
+    sigma = c * math.sqrt(UNIVERSAL_VARIANCE[L] / K)
+    return [math.erfc(abs(phi - UNIVERSAL_EXPECTED[L]) / (math.sqrt(2) * sigma))]
+
+
+def apen_phi(seq, m):
+    if m == 0:
+        return 0.0
+    counts = np.bincount(seq.patterns(m), minlength=1 << m)
+    counts = counts[counts > 0]
+    return float((counts * np.log(counts / seq.n)).sum()) / seq.n
+
+
+def approximate_entropy(seq, m):
+    apen = apen_phi(seq, m) - apen_phi(seq, m + 1)
+    chi2 = 2 * seq.n * (math.log(2) - apen)
+    return [igamc(2 ** (m - 1), chi2 / 2)]
+
+
+def excursion_walk(seq):
+    """(partial sums, cycle index of every position, number of cycles J)."""
+    s = seq.walk()
+    zero = s == 0
+    cycles = int(np.count_nonzero(zero)) + (1 if s[-1] != 0 else 0)
+    return s, np.cumsum(zero), cycles
+
+
+def excursion_constraint(n):
+    return max(0.005 * math.sqrt(n), 500)
+
+
+def random_excursions(seq, enforce=True):
+    s, cycle, J = excursion_walk(seq)
+    if enforce and J < excursion_constraint(seq.n):
+        return None
+    states = (s != 0) & (np.abs(s) <= 4)
+    column = np.where(s < 0, s + 4, s + 3)[states]
+    visits = np.bincount(cycle[states] * 8 + column, minlength=J * 8).reshape(J, 8)
+    nu = np.stack([np.count_nonzero(np.minimum(visits, 5) == k, axis=0) for k in range(6)])
+    out = []
+    for col, x in enumerate(EXCURSION_STATES):
+        a = 1 / (2 * abs(x))
+        pi = [1 - a] + [a * a * (1 - a) ** (k - 1) for k in range(1, 5)] + [a * (1 - a) ** 4]
+        chi2 = sum((nu[k, col] - J * pi[k]) ** 2 / (J * pi[k]) for k in range(6))
+        out.append(igamc(2.5, chi2 / 2))
+    return out
+
+
+def random_excursions_variant(seq, enforce=True):
+    s, _, J = excursion_walk(seq)
+    if enforce and J < excursion_constraint(seq.n):
+        return None
+    inside = np.abs(s) <= 9
+    xi = np.bincount(s[inside] + 9, minlength=19)
+    return [math.erfc(abs(int(xi[x + 9]) - J) / math.sqrt(2 * J * (4 * abs(x) - 2))) for x in VARIANT_STATES]
+
+
+def psi2(seq, m):
+    if m <= 0:
+        return 0.0
+    counts = np.bincount(seq.patterns(m), minlength=1 << m).astype(np.float64)
+    return float((counts ** 2).sum()) * 2 ** m / seq.n - seq.n
+
+
+def serial(seq, m):
+    psim, psim1, psim2 = psi2(seq, m), psi2(seq, m - 1), psi2(seq, m - 2)
+    del1 = psim - psim1
+    del2 = psim - 2 * psim1 + psim2
+    return [igamc(2 ** (m - 2), del1 / 2), igamc(2 ** (m - 3), del2 / 2)]
+
+
+def pack_rows(bits, words):
+    """Each row of a 0/1 array as `words` uint64 words, bit i of the row in bit i % 64 of word i // 64."""
+    padded = np.zeros((len(bits), words * 64), dtype=np.uint8)
+    padded[:, :bits.shape[1]] = bits
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8")
+
+
+def parity(words):
+    """Parity of every column of packed words (words x columns)."""
+    v = np.bitwise_xor.reduce(words, axis=0)
+    for shift in (32, 16, 8, 4, 2, 1):
+        v ^= v >> np.uint64(shift)
+    return v & np.uint64(1)
+
+
+def linear_complexities(blocks):
+    """
+    Berlekamp-Massey over GF(2) on every row at once. Returns L per row.
+
+    The polynomials are packed 64 coefficients to a word and stored word-major
+    (one column per block), so every step is a handful of whole-array ops and
+    rows are selected with masks rather than fancy indexing.
+    """
+    N, M = blocks.shape
+    W = M // 64 + 1                           # C has degree <= M
+    C = np.zeros((W, N), dtype=np.uint64)
+    C[0] = 1
+    D = np.zeros((W, N), dtype=np.uint64)     # x^(n-m) B(x), the correction for the next discrepancy
+    D[0] = 2
+    L = np.zeros(N, dtype=np.int64)
+    # Bit i of window n is s[n-i]: the reversed block from bit M-1-n on
+    rev = np.ascontiguousarray(pack_rows(blocks[:, ::-1], (M - 1) // 64 + W + 1).T)
+    for n in range(M):
+        q, r = divmod(M - 1 - n, 64)
+        window = rev[q:q + W]
+        if r:
+            window = (window >> np.uint64(r)) | (rev[q + 1:q + 1 + W] << np.uint64(64 - r))
+        d = parity(C & window)
+        if d.any():
+            grow = (d != 0) & (2 * L <= n)
+            previous = C
+            C = C ^ (D & (np.uint64(0) - d))  # all ones where d = 1
+            L = np.where(grow, n + 1 - L, L)
+            D = np.where(grow, previous, D)
+        carry = D[:-1] >> np.uint64(63)
+        D = D << np.uint64(1)
+        D[1:] |= carry
+    return L
+
+
+def linear_complexity(seq, M):
+    N = seq.n // M
+    if not N:
+        return None
+    L = linear_complexities(seq.bits[:N * M].reshape(N, M))
+    sign = -1 if M % 2 else 1
+    # 2.0 ** -M underflows to 0 like the C pow; M / 2 ** M overflows past M = 1023
+    mu = M / 2 + (9 + (-sign)) / 36 - (M / 3 + 2 / 9) * 2.0 ** -M
+    T = sign * (L - mu) + 2 / 9
+    bins = np.searchsorted(np.array([-2.5, -1.5, -0.5, 0.5, 1.5, 2.5]), T, side="left")
+    nu = np.bincount(bins, minlength=7)
+    expected = N * np.array(LINEAR_COMPLEXITY_PI)
+    return [igamc(3, float(((nu - expected) ** 2 / expected).sum()) / 2)]
+
+
+def run_tests(bits, params=DEFAULT_PARAMS):
+    """{test name: [P-values] or None} for one bitstream."""
+    seq = Sequence(bits, width=max(params.serial, params.apen + 1, params.non_overlapping, params.overlapping))
+    return {
+        "Frequency": frequency(seq),
+        "BlockFrequency": block_frequency(seq, params.block_frequency),
+        "CumulativeSums": cumulative_sums(seq),
+        "Runs": runs(seq),
+        "LongestRun": longest_run(seq),
+        "Rank": rank(seq),
+        "FFT": dft(seq),
+        "NonOverlappingTemplate": non_overlapping_template(seq, params.non_overlapping),
+        "OverlappingTemplate": overlapping_template(seq, params.overlapping),
+        "Universal": universal(seq),
+        "ApproximateEntropy": approximate_entropy(seq, params.apen),
+        "RandomExcursions": random_excursions(seq),
+        "RandomExcursionsVariant": random_excursions_variant(seq),
+        "Serial": serial(seq, params.serial),
+        "LinearComplexity": linear_complexity(seq, params.linear_complexity),
+    }
+
+
+# ----------------------------------------------------------------------------
+# RUNNER
+# ----------------------------------------------------------------------------
+def read_stream(path, index, n_bits):
+    """Bitstream `index` of a capture cut into n_bits pieces, MSB first."""
+    start = index * n_bits
+    first = start // 8
+    raw = np.fromfile(path, dtype=np.uint8, count=(start + n_bits + 7) // 8 - first, offset=first)
+    return np.unpackbits(raw)[start - 8 * first:start - 8 * first + n_bits]
+
+
+def stream_task(job):
+    path, index, n_bits, params = job
+    return run_tests(read_stream(path, index, n_bits), params)
+
+
+def run_streams(path, streams, n_bits, params=DEFAULT_PARAMS, workers=None, progress=None):
+    """Runs the battery on each stream in a process pool. Returns the per-stream results in order."""
+    jobs = [(path, i, n_bits, params) for i in range(streams)]
+    if workers == 1:
+        results = map(stream_task, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(stream_task, jobs)
+    out = []
+    try:
+        for result in results:
+            out.append(result)
+            if progress:
+                progress(len(out), streams)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return out
+
+
+# ----------------------------------------------------------------------------
+# REPORT
+# ----------------------------------------------------------------------------
+Row = namedtuple("Row", "test histogram uniformity passed samples")
+
+
+def summarize(results, alpha=ALPHA):
+    """One Row per reported P-value column, in finalAnalysisReport order."""
+    rows = []
+    for test in TESTS:
+        columns = max((len(r[test]) for r in results if r[test] is not None), default=1)
+        for col in range(columns):
+            p = np.array([r[test][col] for r in results if r[test] is not None], dtype=np.float64)
+            histogram = np.bincount(np.minimum((p * 10).astype(np.int64), 9), minlength=10)
+            expected = len(p) / 10
+            uniformity = None
+            if expected:
+                uniformity = igamc(9 / 2, float(((histogram - expected) ** 2 / expected).sum()) / 2)
+            rows.append(Row(test, histogram, uniformity, int(np.count_nonzero(p >= alpha)), len(p)))
+    return rows
+
+
+def proportion_bounds(samples, alpha=ALPHA):
+    p_hat = 1 - alpha
+    spread = 3 * math.sqrt(p_hat * alpha / samples)
+    return (p_hat - spread) * samples, (p_hat + spread) * samples
+
+
+def row_flagged(row, alpha=ALPHA):
+    if not row.samples:
+        return False
+    low, high = proportion_bounds(row.samples, alpha)
+    return not low <= row.passed <= high or (row.uniformity is not None and row.uniformity < 0.0001)
+
+
+def format_report(rows, generator, streams, alpha=ALPHA):
+    rule = "-" * 78
+    lines = [rule,
+             "RESULTS FOR THE UNIFORMITY OF P-VALUES AND THE PROPORTION OF PASSING SEQUENCES",
+             rule,
+             f"   generator is <{generator}>",
+             rule,
+             " C1  C2  C3  C4  C5  C6  C7  C8  C9 C10  P-VALUE  PROPORTION  STATISTICAL TEST",
+             rule]
+    for row in rows:
+        line = "".join(f"{c:3d} " for c in row.histogram)
+        if row.uniformity is None:
+            line += "    ----    "
+        elif row.uniformity < 0.0001:
+            line += f" {row.uniformity:8.6f} * "
+        else:
+            line += f" {row.uniformity:8.6f}   "
+        if not row.samples:
+            line += f" ------     {row.test}"
+        else:
+            low, high = proportion_bounds(row.samples, alpha)
+            flag = " *  " if not low <= row.passed <= high else "    "
+            line += f"{row.passed:4d}/{row.samples:<4d}{flag}{row.test}"
+        lines.append(line)
+
+    excursions = next(row.samples for row in rows if row.test == "RandomExcursions")
+    dashes = "- " * 40 + "-"
+    lines += ["", "", dashes,
+              "The minimum pass rate for each statistical test with the exception of the",
+              f"random excursion (variant) test is approximately = {int(proportion_bounds(streams, alpha)[0])} for a",
+              f"sample size = {streams} binary sequences.", ""]
+    if excursions:
+        lines += ["The minimum pass rate for the random excursion (variant) test",
+                  f"is approximately = {int(proportion_bounds(excursions, alpha)[0])} "
+                  f"for a sample size = {excursions} binary sequences."]
+    else:
+        lines += ["The random excursion (variant) test is not applicable: no sequence",
+                  "had enough cycles."]
+    lines += ["",
+              "For further guidelines construct a probability table using the MAPLE program",
+              "provided in the addendum section of the documentation.",
+              dashes]
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------------
+# SELF-CHECK
+# ----------------------------------------------------------------------------
+EPSILON_100 = ("11001001000011111101101010100010001000010110100011"
+               "00001000110100110001001100011001100010100010111000")
+LONGEST_RUN_128 = ("11001100000101010110110001001100111000000000001001"
+                   "00110101010001000100111101011010000000110101111100"
+                   "1100111001101101100010110010")
+
+
+def sequence_of(text):
+    return Sequence(np.array([int(c) for c in text], dtype=np.uint8))
+
+
+def reference_rank(matrix):
+    rows = list(matrix)
+    r = 0
+    for bit in reversed(range(32)):
+        pivot = next((i for i in range(r, len(rows)) if rows[i] >> bit & 1), None)
+        if pivot is None:
+            continue
+        rows[r], rows[pivot] = rows[pivot], rows[r]
+        for i in range(len(rows)):
+            if i != r and rows[i] >> bit & 1:
+                rows[i] ^= rows[r]
+        r += 1
+    return r
+
+
+def reference_linear_complexity(s):
+    n = len(s)
+    c, b = [0] * (n + 1), [0] * (n + 1)
+    c[0] = b[0] = 1
+    L, m = 0, -1
+    for i in range(n):
+        d = s[i]
+        for j in range(1, L + 1):
+            d ^= c[j] & s[i - j]
+        if d:
+            t = c[:]
+            for j in range(n + 1 - (i - m)):
+                c[j + i - m] ^= b[j]
+            if 2 * L <= i:
+                L, m, b = i + 1 - L, i, t
+    return L
+
+
+def reference_universal_phi(bits, L, Q, K):
+    table = [0] * (1 << L)
+    total = 0.0
+    for i in range(1, Q + K + 1):
+        v = int("".join(map(str, bits[(i - 1) * L:i * L])), 2)
+        if i > Q:
+            total += math.log2(i - table[v])
+        table[v] = i
+    return total / K
+
+
+def check():
+    """SP 800-22 worked examples, then vectorised kernels against direct loops. Returns True if all pass."""
+    ok = True
+
+    def expect(name, got, want, tol=1e-6):
+        nonlocal ok
+        good = abs(got - want) <= tol
+        ok &= good
+        print(f"{'PASS' if good else 'FAIL'} {name}: {got:.6f} (expected {want:.6f})")
+
+    e100 = sequence_of(EPSILON_100)
+    expect("Frequency 1011010101", frequency(sequence_of("1011010101"))[0], 0.527089)
+    expect("Frequency 100 bits", frequency(e100)[0], 0.109599)
+    expect("BlockFrequency 0110011010 M=3", block_frequency(sequence_of("0110011010"), 3)[0], 0.801252)
+    expect("BlockFrequency 100 bits M=10", block_frequency(e100, 10)[0], 0.706438)
+    expect("CumulativeSums 1011010111", cumulative_sums(sequence_of("1011010111"))[0], 0.4116588)
+    forward, backward = cumulative_sums(e100)
+    expect("CumulativeSums 100 bits forward", forward, 0.219194)
+    expect("CumulativeSums 100 bits reverse", backward, 0.114866)
+    expect("Runs 1001101011", runs(sequence_of("1001101011"))[0], 0.147232)
+    expect("Runs 100 bits", runs(e100)[0], 0.500798)
+    # SP 800-22 quotes 0.180609 and 0.502529 below, from chi^2 printed as 4.882457 and
+    # 4.333033; the exact chi^2 of its own counts are 4.882605 and 4.333333
+    expect("LongestRun 128 bits", longest_run(sequence_of(LONGEST_RUN_128))[0], 0.180598)
+    expect("NonOverlappingTemplate B=001", non_overlapping_template(
+        sequence_of("10100100101110010110"), 3, blocks=2, templates=[0b001])[0], 0.344154)
+    expect("ApproximateEntropy 0100110101 m=3", approximate_entropy(sequence_of("0100110101"), 3)[0], 0.261961)
+    expect("ApproximateEntropy 100 bits m=2", approximate_entropy(e100, 2)[0], 0.235301)
+    p1, p2 = serial(sequence_of("0011011101"), 3)
+    expect("Serial 0011011101 m=3 p1", p1, 0.808792)
+    expect("Serial 0011011101 m=3 p2", p2, 0.670320)
+    excursion = sequence_of("0110110101")
+    expect("RandomExcursions x=+1", random_excursions(excursion, enforce=False)[4], 0.502488)
+    expect("RandomExcursionsVariant x=+1", random_excursions_variant(excursion, enforce=False)[9], 0.683091)
+    expect("Linear complexity 1101011110001",
+           linear_complexities(np.array([[int(c) for c in "1101011110001"]], dtype=np.uint8))[0], 4, 0)
+    expect("Aperiodic 9-bit templates", len(aperiodic_templates(9)), 148, 0)
+
+    rng = random.Random(0)
+    matrices = [[rng.getrandbits(32) & rng.choice((0xFFFFFFFF, 0xFFFF0000, 0x0F0F0F0F)) for _ in range(32)]
+                for _ in range(200)]
+    got = gf2_ranks(np.array(matrices, dtype=np.uint64), 32)
+    expect("Rank vs direct elimination (mismatches)",
+           sum(int(g) != reference_rank(m) for g, m in zip(got, matrices)), 0, 0)
+
+    blocks = np.array([[rng.getrandbits(1) for _ in range(100)] for _ in range(50)], dtype=np.uint8)
+    blocks[::7, 50:] = blocks[::7, :50]   # some with low complexity
+    got = linear_complexities(blocks)
+    expect("Berlekamp-Massey vs direct loop (mismatches)",
+           sum(int(g) != reference_linear_complexity(list(b)) for g, b in zip(got, blocks)), 0, 0)
+
+    np_rng = np.random.default_rng(0)
+    bits = np_rng.integers(0, 2, 400000, dtype=np.uint8)
+    seq = Sequence(bits)
+    L, Q = 6, 640
+    K = len(bits) // L - Q
+    want = reference_universal_phi(list(bits), L, Q, K)
+    c = 0.7 - 0.8 / L + (4 + 32 / L) * K ** (-3 / L) / 15
+    sigma = c * math.sqrt(UNIVERSAL_VARIANCE[L] / K)
+    expect("Universal vs direct loop", universal(seq)[0],
+           math.erfc(abs(want - UNIVERSAL_EXPECTED[L]) / (math.sqrt(2) * sigma)), 1e-9)
+
+    # assess accepts M up to 5000, past where 2 ** M fits in a float
+    p = linear_complexity(Sequence(bits[:20 * 2000]), 2000)[0]
+    expect("LinearComplexity M=2000 gives a P-value", float(0 <= p <= 1), 1, 0)
+
+    windows = seq.patterns(9)
+    direct = int("".join(map(str, np.concatenate((bits[-4:], bits[:5])))), 2)
+    expect("Circular window wraps", int(windows[-4]), direct, 0)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel NIST STS battery (finalAnalysisReport format)")
+    parser.add_argument("capture", nargs="?", help="binary capture (each byte holds 8 bits, MSB first)")
+    parser.add_argument("--streams", type=int, default=STREAMS, help="number of bitstreams")
+    parser.add_argument("--bits", type=int, default=STREAM_BITS, help="bits per stream")
+    parser.add_argument("--workers", type=int, help="processes (default: one per core)")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--alpha", type=float, default=ALPHA)
+    parser.add_argument("--max-flagged", type=int, default=0,
+                        help="flagged rows tolerated before the exit code is 1 (a good generator "
+                             "flags about one of the ~188 rows by chance)")
+    parser.add_argument("--block-frequency-m", type=int, default=DEFAULT_PARAMS.block_frequency)
+    parser.add_argument("--non-overlapping-m", type=int, default=DEFAULT_PARAMS.non_overlapping)
+    parser.add_argument("--overlapping-m", type=int, default=DEFAULT_PARAMS.overlapping)
+    parser.add_argument("--apen-m", type=int, default=DEFAULT_PARAMS.apen)
+    parser.add_argument("--serial-m", type=int, default=DEFAULT_PARAMS.serial)
+    parser.add_argument("--linear-complexity-m", type=int, default=DEFAULT_PARAMS.linear_complexity)
+    parser.add_argument("--check", action="store_true", help="run the SP 800-22 examples and kernel cross-checks")
+    args = parser.parse_args()
+
+    if args.check:
+        return 0 if check() else 1
+    if not args.capture:
+        parser.error("a capture file is needed (or --check)")
+
+    available = os.path.getsize(args.capture) * 8 // args.bits
+    streams = min(args.streams, available)
+    if not streams:
+        parser.error(f"{args.capture} holds less than one {args.bits}-bit stream")
+    if streams < args.streams:
+        print(f"Only {streams} streams of {args.bits} bits fit in {args.capture}", file=sys.stderr)
+
+    params = Params(args.block_frequency_m, args.non_overlapping_m, args.overlapping_m, args.apen_m,
+                    args.serial_m, args.linear_complexity_m)
+    workers = args.workers or os.cpu_count()
+    print(f"Testing {streams} streams of {args.bits:,} bits on {workers} workers", file=sys.stderr)
+
+    t0 = time.perf_counter()
+
+    def progress(done, total):
+        print(f"\r  {done}/{total} streams", end="", file=sys.stderr, flush=True)
+
+    results = run_streams(args.capture, streams, args.bits, params, workers, progress)
+    elapsed = time.perf_counter() - t0
+    print(f"\r  {streams} streams in {elapsed:.1f} s ({streams / elapsed:.2f} streams/s)", file=sys.stderr)
+
+    rows = summarize(results, args.alpha)
+    report = format_report(rows, args.capture, streams, args.alpha)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        sys.stdout.write(report)
+
+    flagged = [row for row in rows if row_flagged(row, args.alpha)]
+    for row in flagged:
+        print(f"FLAGGED {row.test}: {row.passed}/{row.samples} passed, uniformity "
+              + ("n/a" if row.uniformity is None else f"{row.uniformity:.6f}"), file=sys.stderr)
+    return 1 if len(flagged) > args.max_flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,17 +21,54 @@
 #define PIO_PIN           0       // Square Wave Output
 #define ADC_PIN           26      // ADC Input (GPIO 26)
 #define ADC_INPUT         0       // ADC Channel 0 matches GPIO 26
-#define BATCH_SIZE        1024    // Samples per batch
-#define LAG_DEPTH         12      // Compare current sample vs 4/8/12 samples ago
+#define BATCH_SIZE        1024    // Samples per batch (boot default, see SET batch_size)
+#define LAG_DEPTH         12      // Compare current sample vs 4/8/12 samples ago (SET lag_depth)
+#define WINDOW_BATCHES    1       // Batches in the H_min estimate, 1 = reset every batch (SET window)
+#define MAX_BATCH_SIZE    4096    // Queue entries are allocated at this size
+#define MAX_LAG_DEPTH     64
+#define MAX_WINDOW_SAMPLES 16384  // Delta history kept for the sliding window estimator
+#define OUTPUT_BINARY     0       // 0 = text output, 1 = binary frames (see python-scripts/protocol.py)
+#define CONDITIONING      0       // 0 = legacy (two chained digests), 1 = credit (see below)
+#define JITTER_SCHEDULE   0       // 1 = jitter delays from the previous batch, one adc_read() per sample
+#define BLOCK_CREDIT      (512 + 64)  // Credited bits per SHA-512 output block (SP 800-90C margin)
+#define HEALTH_ENTROPY    4.0     // Claimed min-entropy per raw sample (bits), sets the health test cutoffs
+#define HEALTH_ALPHA_LOG2 20      // Health test false alarm probability 2^-20 per test
+#define APT_WINDOW        512     // Adaptive proportion test window (SP 800-90B, non-binary samples)
+#define SUB_BLOCK         256     // Samples per hand-over to core 1 within a batch, 0 = whole batches
 
-// Structure to pass data between cores
+// Binary framing
+#define FRAME_SYNC        0x5AA5
+#define FRAME_VERSION     1
+#define FRAME_BATCH       1
+#define FRAME_CONFIG      4
+#define FRAME_HEALTH      5
+#define HEALTH_RCT        1
+#define HEALTH_APT        2
+#define HMIN_SCALE        4096    // H_min sent as Q4.12 fixed point
+
+// Structure to pass data between cores: one stretch of a batch, so core 1
+// can run the histogram, health tests and hash over it while core 0 samples
+// the rest (the whole batch with SUB_BLOCK 0)
+#define BLOCK_SAMPLES     (SUB_BLOCK ? SUB_BLOCK : MAX_BATCH_SIZE)
+#define QUEUE_BLOCKS      (4 * MAX_BATCH_SIZE / BLOCK_SAMPLES)  // Same memory as 4 whole batches
 typedef struct {
-    uint16_t samples[BATCH_SIZE];
-} adc_batch_t;
+    uint16_t first;     // Position of samples[0] in the batch
+    uint16_t count;     // Samples in this block
+    uint16_t total;     // Samples in the whole batch
+    uint16_t samples[BLOCK_SAMPLES];
+} adc_block_t;
 
 // Thread-safe queue for inter-core communication
 queue_t sample_queue;
 
+// Runtime configuration, changed over USB serial one line at a time:
+//   SET batch_size 2048 | SET lag_depth 8 | SET window 8 | GET
+// Core 1 applies commands between batches and answers each one with the
+// current settings; core 0 picks up a new batch size with its next batch.
+volatile uint16_t cfg_batch_size = BATCH_SIZE;
+volatile uint16_t cfg_lag_depth = LAG_DEPTH;
+volatile uint16_t cfg_window = WINDOW_BATCHES;
+
 // ----------------------------------------------------------------------------
 // CORE 1: Processing & Output
 // ----------------------------------------------------------------------------
@@ -44,49 +81,289 @@ void print_hex(uint8_t *data, size_t len) {
     printf("\n");
 }
 
+// Standard CRC-32 (same as zlib.crc32 on the host)
+uint32_t crc32_update(uint32_t crc, const uint8_t *data, size_t len) {
+    crc = ~crc;
+    for (size_t i = 0; i < len; i++) {
+        crc ^= data[i];
+        for (int b = 0; b < 8; b++) {
+            crc = (crc >> 1) ^ (0xEDB88320u & (0u - (crc & 1u)));
+        }
+    }
+    return ~crc;
+}
+
+// Write bytes without stdio's LF -> CRLF translation
+void write_raw(const uint8_t *data, size_t len) {
+    for (size_t i = 0; i < len; i++) {
+        putchar_raw(data[i]);
+    }
+}
+
+void put_u16(uint8_t *p, uint16_t v) { p[0] = v & 0xFF; p[1] = v >> 8; }
+void put_u32(uint8_t *p, uint32_t v) { put_u16(p, v & 0xFFFF); put_u16(p + 2, v >> 16); }
+
+// Header: sync(2) version(1) type(1) seq(4) length(2), then payload, then CRC32
+void send_frame(uint8_t type, uint32_t seq, const uint8_t *payload, uint16_t len) {
+    uint8_t header[10];
+    uint8_t crc_bytes[4];
+    put_u16(header, FRAME_SYNC);
+    header[2] = FRAME_VERSION;
+    header[3] = type;
+    put_u32(header + 4, seq);
+    put_u16(header + 8, len);
+
+    uint32_t crc = crc32_update(0, header + 2, sizeof(header) - 2);
+    crc = crc32_update(crc, payload, len);
+    put_u32(crc_bytes, crc);
+
+    write_raw(header, sizeof(header));
+    write_raw(payload, len);
+    write_raw(crc_bytes, sizeof(crc_bytes));
+}
+
+void send_config(uint32_t seq) {
+#if OUTPUT_BINARY
+    uint8_t payload[8];
+    put_u16(payload, cfg_batch_size);
+    put_u16(payload + 2, cfg_lag_depth);
+    put_u16(payload + 4, cfg_window);
+    put_u16(payload + 6, CONDITIONING);
+    send_frame(FRAME_CONFIG, seq, payload, sizeof(payload));
+#else
+    printf("CFG: batch_size=%d lag_depth=%d window=%d conditioning=%d\n",
+           cfg_batch_size, cfg_lag_depth, cfg_window, CONDITIONING);
+#endif
+}
+
+bool config_valid(int batch_size, int lag_depth, int window) {
+    return batch_size >= 16 && batch_size <= MAX_BATCH_SIZE && batch_size % 2 == 0
+        && lag_depth >= 1 && lag_depth <= MAX_LAG_DEPTH
+        && window >= 1 && (window == 1 || window * batch_size <= MAX_WINDOW_SAMPLES);
+}
+
+// Applies one command line; returns true if the configuration changed
+bool handle_command(const char *line) {
+    char name[16];
+    int value;
+    if (sscanf(line, "SET %15s %d", name, &value) != 2) return false;
+    int batch_size = cfg_batch_size, lag_depth = cfg_lag_depth, window = cfg_window;
+    if (strcmp(name, "batch_size") == 0) batch_size = value;
+    else if (strcmp(name, "lag_depth") == 0) lag_depth = value;
+    else if (strcmp(name, "window") == 0) window = value;
+    else return false;
+    if (!config_valid(batch_size, lag_depth, window)) return false;
+    if (batch_size == cfg_batch_size && lag_depth == cfg_lag_depth && window == cfg_window) return false;
+    cfg_batch_size = batch_size;
+    cfg_lag_depth = lag_depth;
+    cfg_window = window;
+    return true;
+}
+
+// Reads whatever command bytes are waiting; returns true if the configuration changed
+bool poll_commands(uint32_t seq) {
+    static char line[64];
+    static uint8_t len = 0;
+    bool changed = false;
+    int c;
+    while ((c = getchar_timeout_us(0)) != PICO_ERROR_TIMEOUT) {
+        if (c != '\r' && c != '\n') {
+            if (len < sizeof(line) - 1) line[len++] = (char)c;
+            continue;
+        }
+        if (len) {
+            line[len] = 0;
+            changed |= handle_command(line);
+            len = 0;
+            send_config(seq);
+        }
+    }
+    return changed;
+}
+
+// ----------------------------------------------------------------------------
+// HEALTH TESTS (NIST SP 800-90B 4.4)
+// ----------------------------------------------------------------------------
+// Repetition count: fails when one value repeats rct_cutoff times in a row.
+// Adaptive proportion: fails when the first value of a (non-overlapping)
+// APT_WINDOW-sample window turns up apt_cutoff times in it. Both run on every
+// raw sample in core 1's loop with cutoffs computed once at boot; a batch that
+// fails is not hashed or sent, a health record goes out in its place.
+void health_cutoffs(double h, uint16_t *rct, uint16_t *apt) {
+    *rct = 1 + (uint16_t)ceil(HEALTH_ALPHA_LOG2 / h);
+    // Smallest c with P(X >= c) <= alpha for X ~ Binomial(APT_WINDOW, 2^-h),
+    // summing the tail from the top in log space
+    static double log_pmf[APT_WINDOW + 1];
+    double p = pow(2.0, -h);
+    log_pmf[0] = APT_WINDOW * log(1.0 - p);
+    for (int k = 0; k < APT_WINDOW; k++) {
+        log_pmf[k + 1] = log_pmf[k] + log((double)(APT_WINDOW - k) / (k + 1)) + log(p / (1.0 - p));
+    }
+    double alpha = pow(2.0, -HEALTH_ALPHA_LOG2);
+    double tail = 0.0;
+    int c = APT_WINDOW + 1;
+    while (c > 1 && tail + exp(log_pmf[c - 1]) <= alpha) {
+        c--;
+        tail += exp(log_pmf[c]);
+    }
+    *apt = c;
+}
+
+void send_health(uint32_t seq, uint16_t tests, uint16_t rct_run, uint16_t apt_count,
+                 uint16_t rct_cutoff, uint16_t apt_cutoff) {
+#if OUTPUT_BINARY
+    uint8_t payload[10];
+    put_u16(payload, tests);
+    put_u16(payload + 2, rct_run);
+    put_u16(payload + 4, apt_count);
+    put_u16(payload + 6, rct_cutoff);
+    put_u16(payload + 8, apt_cutoff);
+    send_frame(FRAME_HEALTH, seq, payload, sizeof(payload));
+#else
+    printf("HEALTH: tests=%d rct_run=%d apt_count=%d rct_cutoff=%d apt_cutoff=%d\n",
+           tests, rct_run, apt_count, rct_cutoff, apt_cutoff);
+#endif
+}
+
 // Wrapper to allow swapping SHA-512 out easily
 void crypto_hash(const unsigned char *input, size_t ilen, unsigned char *output) {
     mbedtls_sha512(input, ilen, output, 0); 
 }
 
 void core1_entry() {
-    adc_batch_t batch;
+    static adc_block_t block;
     uint8_t hash_out_1[64];
     uint8_t hash_out_2[64];
+    uint8_t frame_payload[4 + 2 * 64];
+    uint32_t seq = 0;
     
     // Histogram for Min-Entropy
-    // IMPORTANT: uint16_t to prevent overflow with 1024 samples
-    uint16_t counts[4096]; 
+    // IMPORTANT: uint16_t to prevent overflow with up to MAX_WINDOW_SAMPLES samples
+    static uint16_t counts[4096]; 
 
     // --- RING BUFFER HISTORY ---
-    // We store the last 'LAG_DEPTH' samples here.
+    // We store the last 'cfg_lag_depth' samples here.
     // Comparing T vs T-12 breaks the correlation of the slow laser pulse shape.
-    static uint16_t history[LAG_DEPTH] = {0}; 
+    static uint16_t history[MAX_LAG_DEPTH] = {0}; 
     static uint8_t hist_head = 0;
     // ---------------------------
 
+    // --- SLIDING WINDOW ---
+    // The last window * batch_size deltas, so the oldest batch can be taken
+    // back out of counts as each new one goes in
+    static uint16_t window_deltas[MAX_WINDOW_SAMPLES];
+    uint32_t win_head = 0;
+    uint32_t win_fill = 0;
+    // ---------------------------
+
+    // --- CONDITIONING POOL ---
+    // CONDITIONING 1: batches are absorbed into a running SHA-512 and each is
+    // credited with H_min * samples bits (nothing when squelched). One 64-byte
+    // block is drawn, and the pool restarted, once BLOCK_CREDIT bits are in,
+    // instead of always sending a digest plus a hash of that digest.
+    static mbedtls_sha512_context pool;
+    float pool_credit = 0.0f;
+    mbedtls_sha512_init(&pool);
+    mbedtls_sha512_starts(&pool, 0);
+    // ---------------------------
+
+    // --- INCREMENTAL HASHING ---
+    // Blocks are absorbed as they arrive, so the digest is ready right after
+    // the last sample. CONDITIONING 0 feeds the first digest; CONDITIONING 1
+    // feeds a copy of the pool that only replaces it if the batch passes.
+    static mbedtls_sha512_context batch_hash;
+    mbedtls_sha512_init(&batch_hash);
+    // ---------------------------
+
+    // --- HEALTH TESTS ---
+    uint16_t rct_cutoff, apt_cutoff;
+    health_cutoffs(HEALTH_ENTROPY, &rct_cutoff, &apt_cutoff);
+    int32_t rct_value = -1;
+    uint16_t rct_run = 0;
+    int32_t apt_value = -1;
+    uint16_t apt_count = 0;
+    uint16_t apt_left = 0;
+    // ---------------------------
+
+    // Per-batch diagnostics, carried from block to block
+    uint16_t lag_depth = cfg_lag_depth;
+    uint32_t window_size = 0;
+    uint16_t max_count = 0;
+    uint16_t health = 0;
+    uint16_t rct_worst = 0;
+    uint16_t apt_worst = 0;
+
+    // --- Range Tracking ---
+    uint16_t min_val = 4096;
+    uint16_t max_val = 0;
+    // ---------------------------
+
+    send_config(seq);
+
     while (true) {
         // 1. Wait for data from Core 0
-        queue_remove_blocking(&sample_queue, &batch);
+        queue_remove_blocking(&sample_queue, &block);
+        if (block.first == 0) {
+            // First block of a batch: settings hold until it is finished
+            lag_depth = cfg_lag_depth;
+            // The window follows the configured batch size, like QRNG.py; batches
+            // still queued at an old size go into it sample by sample
+            uint32_t new_window = cfg_window > 1 ? (uint32_t)cfg_window * cfg_batch_size : 0;
+            if (new_window != window_size) {
+                // A ring of another size: its contents no longer line up, start afresh
+                memset(counts, 0, sizeof(counts));
+                win_head = 0;
+                win_fill = 0;
+                window_size = new_window;
+            }
 
-        // Reset diagnostics
-        memset(counts, 0, sizeof(counts));
-        uint16_t max_count = 0;
-        
-        // --- Range Tracking ---
-        uint16_t min_val = 4096; 
-        uint16_t max_val = 0;    
-        // ---------------------------
+            // Reset diagnostics
+            if (!window_size) memset(counts, 0, sizeof(counts));
+            max_count = 0;
+            health = 0;
+            rct_worst = 0;
+            apt_worst = 0;
+            min_val = 4096;
+            max_val = 0;
+#if CONDITIONING
+            mbedtls_sha512_clone(&batch_hash, &pool);
+#else
+            mbedtls_sha512_starts(&batch_hash, 0);
+#endif
+        }
 
-        for(int i = 0; i < BATCH_SIZE; i++) {
+        for(int i = 0; i < block.count; i++) {
             // Mask to ensure we only look at 12 bits
-            uint16_t val = batch.samples[i];
+            uint16_t val = block.samples[i];
             
             // --- Update Min/Max (Raw Data) ---
             if (val < min_val) min_val = val;
             if (val > max_val) max_val = val;
             // ---------------------------
 
+            // --- HEALTH TESTS (raw sample) ---
+            if (val == rct_value) {
+                rct_run++;
+                if (rct_run > rct_worst) rct_worst = rct_run;
+                if (rct_run >= rct_cutoff) health |= HEALTH_RCT;
+            } else {
+                rct_value = val;
+                rct_run = 1;
+            }
+            if (apt_left) {
+                apt_left--;
+                if (val == apt_value) {
+                    apt_count++;
+                    if (apt_count > apt_worst) apt_worst = apt_count;
+                    if (apt_count >= apt_cutoff) health |= HEALTH_APT;
+                }
+            } else {
+                apt_value = val;
+                apt_count = 1;
+                apt_left = APT_WINDOW - 1;
+            }
+            // ---------------------------
+
             // --- LAGGED DERIVATIVE CALCULATION ---
             // 1. Get the "Old" value from history
             uint16_t old_val = history[hist_head];
@@ -95,13 +372,21 @@ void core1_entry() {
             history[hist_head] = val;
             
             // 3. Advance the ring buffer head
-            hist_head = (hist_head + 1) % LAG_DEPTH;
+            hist_head = (hist_head + 1) % lag_depth;
 
             // 4. Calculate Delta against the OLD value
-            // We add 2048 to center the result.
-            uint16_t delta = (val - old_val + 2048);
+            // We add 2048 to center the result, and wrap to 12 bits to stay in counts[].
+            uint16_t delta = (val - old_val + 2048) & 0xFFF;
             // -------------------------------------
 
+            // Sliding window: drop the oldest delta once the window is full
+            if (window_size) {
+                if (win_fill == window_size) counts[window_deltas[win_head]]--;
+                else win_fill++;
+                window_deltas[win_head] = delta;
+                win_head = (win_head + 1) % window_size;
+            }
+
             // Update Histogram using DELTA
             if(counts[delta] < 65535) counts[delta]++; 
             if(counts[delta] > max_count) {
@@ -109,10 +394,26 @@ void core1_entry() {
             }
         }
 
-        // Calculate Min-Entropy
-        float min_entropy = 10.0f - log2f((float)max_count);
-        // scale for 8-bit min-entropy - for 10.0f it's 8/10.0
-        min_entropy *= (8.0/10.0);
+        // Hashing (SHA-512) - Note: We hash the RAW samples, not the derivative!
+        mbedtls_sha512_update(&batch_hash, (unsigned char*)block.samples, block.count * sizeof(uint16_t));
+        if (block.first + block.count < block.total) continue;
+
+        // Counts also go down in window mode, so take the peak afterwards
+        uint32_t estimate_samples = block.total;
+        if (window_size) {
+            max_count = 0;
+            for (int d = 0; d < 4096; d++) {
+                if (counts[d] > max_count) max_count = counts[d];
+            }
+            estimate_samples = win_fill;
+        }
+
+        // Calculate Min-Entropy, normalised to the samples in the estimate
+        float h_max = log2f((float)estimate_samples);
+        float min_entropy = h_max - log2f((float)max_count);
+        float credit_per_sample = min_entropy;   // bits per sample, before scaling
+        // scale for 8-bit min-entropy - 8 / log2(samples), 8/10.0 for 1024
+        min_entropy *= (8.0f / h_max);
         
         // Calculate Range
         uint16_t dynamic_range = max_val - min_val;
@@ -122,16 +423,73 @@ void core1_entry() {
         // Force entropy to 0.0 to indicate "Unsafe".
         if (dynamic_range < 200) {
             min_entropy = 0.0f;
+            credit_per_sample = 0.0f;
         }
 
-        // Hashing (SHA-512) - Note: We hash the RAW samples, not the derivative!
-        crypto_hash((unsigned char*)batch.samples, sizeof(batch.samples), hash_out_1);
-        crypto_hash(hash_out_1, 64, hash_out_2);
+        if (health) {
+            // Failed a health test: nothing from this batch may reach the output,
+            // its (partly) absorbed hash is simply never finished
+            send_health(seq, health, rct_worst, apt_worst, rct_cutoff, apt_cutoff);
+#if CONDITIONING
+            mbedtls_sha512_starts(&pool, 0);
+            pool_credit = 0.0f;
+#endif
+        } else {
+#if CONDITIONING
+            // Credit-accounted output: keep the absorbed batch, and draw a block once it is paid for
+            mbedtls_sha512_clone(&pool, &batch_hash);
+            pool_credit += credit_per_sample * block.total;
+            uint16_t out_len = 0;
+            if (pool_credit >= BLOCK_CREDIT) {
+                mbedtls_sha512_finish(&pool, hash_out_1);
+                mbedtls_sha512_starts(&pool, 0);
+                pool_credit = 0.0f;
+                out_len = 64;
+            }
 
-        // Output
-        printf("H_min: %.4f | R: %4d | Data: \n", min_entropy, dynamic_range);
-        print_hex(hash_out_1, 64);
-        print_hex(hash_out_2, 64); 
+#if OUTPUT_BINARY
+            put_u16(frame_payload, (uint16_t)(min_entropy * HMIN_SCALE + 0.5f));
+            put_u16(frame_payload + 2, dynamic_range);
+            memcpy(frame_payload + 4, hash_out_1, out_len);
+            send_frame(FRAME_BATCH, seq, frame_payload, 4 + out_len);
+#else
+            // Single line, "-" while the pool is still short of credit
+            printf("H_min: %.4f | R: %4d | Data: ", min_entropy, dynamic_range);
+            if (out_len) print_hex(hash_out_1, out_len);
+            else printf("-\n");
+#endif
+#else
+            (void)credit_per_sample;
+            (void)pool_credit;
+
+            // The samples are already absorbed, only the padding is left
+            mbedtls_sha512_finish(&batch_hash, hash_out_1);
+            crypto_hash(hash_out_1, 64, hash_out_2);
+
+            // Output
+#if OUTPUT_BINARY
+            put_u16(frame_payload, (uint16_t)(min_entropy * HMIN_SCALE + 0.5f));
+            put_u16(frame_payload + 2, dynamic_range);
+            memcpy(frame_payload + 4, hash_out_1, 64);
+            memcpy(frame_payload + 4 + 64, hash_out_2, 64);
+            send_frame(FRAME_BATCH, seq, frame_payload, sizeof(frame_payload));
+#else
+            printf("H_min: %.4f | R: %4d | Data: \n", min_entropy, dynamic_range);
+            print_hex(hash_out_1, 64);
+            print_hex(hash_out_2, 64); 
+#endif
+#endif
+        }
+        seq++;
+
+        if (poll_commands(seq)) {
+            // New settings: start the lag history and the estimate afresh
+            memset(history, 0, sizeof(history));
+            hist_head = 0;
+            memset(counts, 0, sizeof(counts));
+            win_head = 0;
+            win_fill = 0;
+        }
     }
 }
 
@@ -146,7 +504,7 @@ int main() {
     stdio_init_all();
 
     // 2. Setup Inter-core Queue
-    queue_init(&sample_queue, sizeof(adc_batch_t), 4);
+    queue_init(&sample_queue, sizeof(adc_block_t), QUEUE_BLOCKS);
 
     // 3. Setup PIO Square Wave
     PIO pio = pio0;
@@ -166,14 +524,38 @@ int main() {
     printf("Core 1: Processing Entropy & Hashing.\n");
 
     // 6. Main Loop
-    adc_batch_t current_batch;
+    static adc_block_t current_block;
+
+#if JITTER_SCHEDULE
+    // Slot i holds the delay after sample i, refilled from the sample taken there
+    static uint8_t jitter_schedule[MAX_BATCH_SIZE];
+    for (int i = 0; i < MAX_BATCH_SIZE; i++) {
+        jitter_schedule[i] = 1 + (adc_read() & 0x03);
+    }
+#endif
     
     while (true) {
-        for(int i = 0; i < BATCH_SIZE; i++) {
-            current_batch.samples[i] = adc_read();
-            // Jitter the timing slightly to prevent phase locking
-            busy_wait_us_32(1 + (adc_read() & 0x03)); 
+        uint16_t total = cfg_batch_size;
+        for (uint16_t first = 0; first < total; first += BLOCK_SAMPLES) {
+            current_block.first = first;
+            current_block.total = total;
+            current_block.count = total - first < BLOCK_SAMPLES ? total - first : BLOCK_SAMPLES;
+            for(int j = 0; j < current_block.count; j++) {
+#if JITTER_SCHEDULE
+                int i = first + j;   // Jitter slot: position in the batch
+                uint16_t val = adc_read();
+                current_block.samples[j] = val;
+                // Jitter the timing slightly to prevent phase locking
+                busy_wait_us_32(jitter_schedule[i]);
+                jitter_schedule[i] = 1 + (val & 0x03);
+#else
+                current_block.samples[j] = adc_read();
+                // Jitter the timing slightly to prevent phase locking
+                busy_wait_us_32(1 + (adc_read() & 0x03)); 
+#endif
+            }
+            // Hand this stretch to core 1 while the rest is sampled
+            queue_add_blocking(&sample_queue, &current_block);
         }
-        queue_add_blocking(&sample_queue, &current_batch);
     }
 }
\ No newline at end of file